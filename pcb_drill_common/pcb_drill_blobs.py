@@ -0,0 +1,404 @@
+#!/usr/bin/env python2.7
+
+"""
+pcb_drill_blobs.py - find the solder blobs (holes) of a solder mask with numpy: threshold, label
+8-connected components and measure every blob's area, centroid and bounding box in bulk.
+Gives the same holes as SimpleCV binarize().findBlobs() without SimpleCV's per blob objects.
+"""
+
+import argparse
+
+import numpy
+
+try:
+    from PIL import Image, ImageDraw
+except ImportError:
+    try:
+        # PIL 1.1.7 installs as top level modules
+        import Image
+        import ImageDraw
+    except ImportError:
+        # Only needed to read and draw on image files, arrays work without it
+        Image = None
+        ImageDraw = None
+
+from pcb_drill_raster import PngWriter
+from pcb_drill_tools import equivalent_diameter
+
+# SimpleCV findBlobs defaults: smaller blobs are noise
+DEFAULT_MIN_SIZE = 10
+# Rows thresholded and scanned at a time, bounds the temporary arrays
+DEFAULT_STRIP_ROWS = 256
+
+
+def to_gray(image):
+    """ uint8 grayscale of an image array, RGB(A) uses the same weights as OpenCV """
+    image = numpy.asarray(image)
+    if image.ndim == 2:
+        if image.dtype == numpy.uint8:
+            return image
+        return image.astype(numpy.uint8)
+    rgb = image[..., :3].astype(numpy.uint32)
+    return ((rgb[..., 0] * 299 + rgb[..., 1] * 587 + rgb[..., 2] * 114 + 500) // 1000).astype(numpy.uint8)
+
+
+def histogram(gray):
+    """ 256 bin histogram of a uint8 array """
+    return numpy.bincount(numpy.asarray(gray).ravel(), minlength=256)[:256]
+
+
+def otsu_threshold(counts):
+    """ Otsu's threshold from a 256 bin histogram, pixels <= threshold are the dark class
+        (what SimpleCV binarize() uses without a threshold)"""
+    counts = numpy.asarray(counts, dtype=float)
+    total = counts.sum()
+    if total == 0:
+        return 0
+    probability = counts / total
+    omega = numpy.cumsum(probability)
+    mu = numpy.cumsum(probability * numpy.arange(len(counts)))
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        variance = (mu[-1] * omega - mu) ** 2 / (omega * (1.0 - omega))
+    variance[~numpy.isfinite(variance)] = 0
+    return int(numpy.argmax(variance))
+
+
+class Blobs(object):
+    """ Every blob found in a mask as numpy arrays, one entry per blob in scan order """
+
+    def __init__(self, area, pixels, centroid, bounding_box):
+        """ Blobs
+        Arguments:
+            area - contour area (what SimpleCV Blob.area() reports)
+            pixels - number of pixels
+            centroid - (x, y) centre of mass
+            bounding_box - (x, y, width, height)
+        """
+        self.area = area
+        self.pixels = pixels
+        self.centroid = centroid
+        self.bounding_box = bounding_box
+
+    def __len__(self):
+        return len(self.area)
+
+    @property
+    def coordinates(self):
+        """ Integer centre of each bounding box, like SimpleCV Blob.coordinates() """
+        box = self.bounding_box
+        return numpy.column_stack([box[:, 0] + box[:, 2] // 2, box[:, 1] + box[:, 3] // 2])
+
+    def holes(self):
+        """ (x, y, diameter) of every blob, as process_solder_mask drills them """
+        return [(int(x), int(y), equivalent_diameter(area))
+                for (x, y), area in zip(self.coordinates.tolist(), self.area.tolist())]
+
+
+def _empty_blobs():
+    return Blobs(numpy.zeros(0), numpy.zeros(0, dtype=int), numpy.zeros((0, 2)),
+                 numpy.zeros((0, 4), dtype=int))
+
+
+class BlobFinder(object):
+    """ Connected components of a binary mask fed top to bottom in strips of rows.
+        Each row is kept as runs of foreground pixels, so memory grows with the number of runs
+        rather than with the image, and runs are joined into blobs once all rows are in."""
+
+    def __init__(self, width):
+        """ Blob finder
+        Arguments:
+            width - pixels per row
+        """
+        self._width = int(width)
+        # Rows waiting for the row below them, after the row above them for context
+        self._pending = numpy.zeros((1, self._width), dtype=bool)
+        self._next_row = 0
+        self._rows = []
+        self._starts = []
+        self._ends = []
+        self._interior = []
+
+    def feed(self, mask):
+        """ Add the next rows of the mask (2d bool array, True for blob pixels) """
+        mask = numpy.asarray(mask, dtype=bool)
+        if mask.ndim != 2 or mask.shape[1] != self._width:
+            raise ValueError("Expected rows of {0} pixels, got an array of shape {1}".format(
+                self._width, mask.shape))
+        if len(mask) == 0:
+            return
+        block = numpy.concatenate([self._pending, mask])
+        self._scan(block)
+        self._pending = block[-2:].copy()
+
+    def _scan(self, block):
+        """ Runs of block[1:-1], block[0] and block[-1] are the rows above and below """
+        rows = block[1:-1]
+        if len(rows) == 0:
+            return
+        padding = numpy.zeros((len(rows), 1), dtype=numpy.int8)
+        edges = numpy.diff(numpy.concatenate([padding, rows.view(numpy.int8), padding], axis=1), axis=1)
+        run_rows, starts = numpy.nonzero(edges == 1)
+        ends = numpy.nonzero(edges == -1)[1]
+        del edges
+        # Pixels with blob pixels on all four sides are inside the contour, the rest are on it
+        vertical = rows & block[:-2] & block[2:]
+        inside = numpy.cumsum(vertical, axis=1, dtype=numpy.int32)
+        del vertical
+        long_runs = ends - starts >= 3
+        interior = numpy.zeros(len(starts), dtype=numpy.int32)
+        interior[long_runs] = (inside[run_rows[long_runs], ends[long_runs] - 2] -
+                               inside[run_rows[long_runs], starts[long_runs]])
+        self._rows.append(run_rows + self._next_row)
+        self._starts.append(starts)
+        self._ends.append(ends)
+        self._interior.append(interior)
+        self._next_row += len(rows)
+
+    def finish(self, min_size=DEFAULT_MIN_SIZE, max_size=0):
+        """ Join the runs into blobs, returns Blobs
+        Arguments:
+            min_size - smallest contour area kept
+            max_size - largest contour area kept (0 for no limit)
+        """
+        self._scan(numpy.concatenate([self._pending, numpy.zeros((1, self._width), dtype=bool)]))
+        self._pending = numpy.zeros((1, self._width), dtype=bool)
+        if not self._rows or sum(len(rows) for rows in self._rows) == 0:
+            return _empty_blobs()
+        rows = numpy.concatenate(self._rows).astype(numpy.int64)
+        starts = numpy.concatenate(self._starts).astype(numpy.int64)
+        ends = numpy.concatenate(self._ends).astype(numpy.int64)
+        interior = numpy.concatenate(self._interior)
+        label = _join_runs(rows, starts, ends, self._width)
+        return _measure(label, rows, starts, ends, interior, min_size, max_size,
+                        max_size or self._width * self._next_row)
+
+
+def _join_runs(rows, starts, ends, width):
+    """ Blob label (0..count-1) of every run, runs sorted by row then start """
+    stride = width + 2
+    start_keys = rows * stride + starts
+    end_keys = rows * stride + ends
+    # 8-connected: a run in the row above touches [start - 1, end] of this run
+    first = numpy.searchsorted(end_keys, (rows - 1) * stride + starts, 'left')
+    last = numpy.searchsorted(start_keys, (rows - 1) * stride + ends, 'right')
+    touching = numpy.maximum(last - first, 0)
+    below = numpy.repeat(numpy.arange(len(rows)), touching)
+    offsets = numpy.arange(len(below)) - numpy.repeat(numpy.cumsum(touching) - touching, touching)
+    above = numpy.repeat(first, touching) + offsets
+    # Hook each run onto the smallest label it touches and jump pointers until nothing changes
+    label = numpy.arange(len(rows))
+    while len(below):
+        smallest = numpy.minimum(label[above], label[below])
+        targets = numpy.concatenate([label[above], label[below]])
+        values = numpy.concatenate([smallest, smallest])
+        order = numpy.argsort(targets, kind='mergesort')
+        targets = targets[order]
+        values = values[order]
+        heads = numpy.flatnonzero(numpy.concatenate([[True], targets[1:] != targets[:-1]]))
+        lowest = numpy.minimum.reduceat(values, heads)
+        roots = targets[heads]
+        if not (lowest < label[roots]).any():
+            break
+        label[roots] = numpy.minimum(label[roots], lowest)
+        while True:
+            jumped = label[label]
+            if (jumped == label).all():
+                break
+            label = jumped
+    return numpy.unique(label, return_inverse=True)[1]
+
+
+def _measure(label, rows, starts, ends, interior, min_size, max_size, image_size):
+    """ Blobs from the runs of each label """
+    count = label.max() + 1
+    lengths = ends - starts
+    pixels = numpy.bincount(label, weights=lengths, minlength=count)
+    boundary = numpy.bincount(label, weights=lengths - interior, minlength=count)
+    # Pick's theorem: area of the polygon through the centres of the contour pixels
+    area = numpy.maximum(pixels - boundary / 2.0 - 1, 0)
+    sum_x = numpy.bincount(label, weights=lengths * (starts + ends - 1) / 2.0, minlength=count)
+    sum_y = numpy.bincount(label, weights=lengths * rows, minlength=count)
+    order = numpy.argsort(label, kind='mergesort')
+    heads = numpy.searchsorted(label[order], numpy.arange(count))
+    min_x = numpy.minimum.reduceat(starts[order], heads)
+    max_x = numpy.maximum.reduceat(ends[order], heads)
+    # Runs are in row order, so the first run of a blob is its top row
+    min_y = rows[order][heads]
+    max_y = numpy.maximum.reduceat(rows[order], heads)
+    keep = (area >= min_size) & (area <= (max_size or image_size))
+    # Scan order: top row first, then leftmost
+    keep = numpy.flatnonzero(keep)
+    keep = keep[numpy.lexsort((min_x[keep], min_y[keep]))]
+    return Blobs(area[keep], pixels[keep].astype(int),
+                 numpy.column_stack([sum_x[keep] / pixels[keep], sum_y[keep] / pixels[keep]]),
+                 numpy.column_stack([min_x[keep], min_y[keep], max_x[keep] - min_x[keep],
+                                     max_y[keep] - min_y[keep] + 1]).astype(int))
+
+
+def find_blobs(image, threshold=-1, min_size=DEFAULT_MIN_SIZE, max_size=0, strip_rows=DEFAULT_STRIP_ROWS):
+    """ Dark blobs of an image array, like SimpleCV image.binarize(threshold).findBlobs()
+    Arguments:
+        image - 2d grayscale or 3d RGB(A) array
+        threshold - pixels <= threshold are blobs, -1 for Otsu's threshold
+        min_size, max_size - contour area limits (max_size 0 for no limit)
+        strip_rows - rows converted and scanned at a time
+    """
+    image = numpy.asarray(image)
+    if threshold < 0:
+        counts = numpy.zeros(256, dtype=numpy.int64)
+        for top in xrange(0, len(image), strip_rows):
+            counts += histogram(to_gray(image[top:top + strip_rows]))
+        threshold = otsu_threshold(counts)
+    finder = BlobFinder(image.shape[1])
+    for top in xrange(0, len(image), strip_rows):
+        finder.feed(to_gray(image[top:top + strip_rows]) <= threshold)
+    return finder.finish(min_size, max_size)
+
+
+def _band_histogram(job):
+    """ Worker stage: (image, top, bottom) -> histogram of rows top to bottom, image an array or a
+        pcb_drill_pool.SharedArray """
+    image, top, bottom = job
+    return histogram(to_gray(getattr(image, 'array', image)[top:bottom]))
+
+
+def _band_blobs(job):
+    """ Worker stage: blobs whose top row is in top to bottom, found in those rows and overlap rows around
+        them. Returns the Blobs and whether one may go on past the overlap (then the bands are not enough). """
+    image, top, bottom, overlap, threshold, min_size, max_size, strip_rows = job
+    image = getattr(image, 'array', image)
+    first, last = max(0, top - overlap), min(len(image), bottom + overlap)
+    finder = BlobFinder(image.shape[1])
+    for row in xrange(first, last, strip_rows):
+        finder.feed(to_gray(image[row:min(row + strip_rows, last)]) <= threshold)
+    blobs = finder.finish(min_size, max_size)
+    box = blobs.bounding_box
+    box[:, 1] += first
+    # Blobs touching the first overlap row belong to the band above, unless it is the top of the image
+    own = (box[:, 1] >= top) & (box[:, 1] < bottom) & ((box[:, 1] > first) | (first == 0))
+    cut = bool(((box[:, 1] + box[:, 3] >= last) & own).any()) and last < len(image)
+    blobs.centroid[:, 1] += first
+    return Blobs(blobs.area[own], blobs.pixels[own], blobs.centroid[own], box[own]), cut
+
+
+def find_blobs_banded(image, bands, overlap=128, threshold=-1, min_size=DEFAULT_MIN_SIZE, max_size=0,
+                      strip_rows=DEFAULT_STRIP_ROWS, map=map):
+    """ find_blobs with the image split into bands of rows that are searched independently, e.g. by
+        pcb_drill_pool.VisionPool.map. Same blobs in the same order as find_blobs.
+    Arguments:
+        image - array or pcb_drill_pool.SharedArray (for worker processes)
+        bands - number of bands
+        overlap - rows searched above and below each band, more than the tallest blob. When a blob is
+                  taller the whole image is searched again in one go.
+        threshold, min_size, max_size, strip_rows - see find_blobs
+        map - map(function, jobs) that runs the bands
+    """
+    height = len(getattr(image, 'array', image))
+    band_rows = max(1, -(-height // max(1, int(bands))))
+    tops = range(0, height, band_rows)
+    if threshold < 0:
+        counts = numpy.zeros(256, dtype=numpy.int64)
+        for band in map(_band_histogram, [(image, top, top + band_rows) for top in tops]):
+            counts += band
+        threshold = otsu_threshold(counts)
+    results = map(_band_blobs, [(image, top, top + band_rows, overlap, threshold, min_size, max_size, strip_rows)
+                                for top in tops])
+    if any(cut for blobs, cut in results):
+        return find_blobs(getattr(image, 'array', image), threshold, min_size, max_size, strip_rows)
+    results = [blobs for blobs, cut in results if len(blobs)]
+    if not results:
+        return _empty_blobs()
+    box = numpy.concatenate([blobs.bounding_box for blobs in results])
+    # Scan order: top row first, then leftmost
+    order = numpy.lexsort((box[:, 0], box[:, 1]))
+    return Blobs(numpy.concatenate([blobs.area for blobs in results])[order],
+                 numpy.concatenate([blobs.pixels for blobs in results])[order],
+                 numpy.concatenate([blobs.centroid for blobs in results])[order], box[order])
+
+
+def read_image(filename):
+    """ RGB array of an image file (needs PIL) """
+    if Image is None:
+        raise ImportError("Reading {0} needs PIL".format(filename))
+    return numpy.asarray(Image.open(filename).convert("RGB"))
+
+
+def holes_image(filename, holes, radius=2, color=(255, 0, 0)):
+    """ RGB PIL image of an image file (or file object) with a circle on every hole """
+    if Image is None:
+        raise ImportError("Drawing on {0} needs PIL".format(filename))
+    image = Image.open(filename).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    for hole in holes:
+        x, y = hole[0], hole[1]
+        draw.ellipse((x - radius, y - radius, x + radius, y + radius), outline=color)
+    del draw
+    return image
+
+
+def draw_holes(filename, holes, output_filename, radius=2, color=(255, 0, 0), format=None):
+    """ Save a copy of an image file with a circle on every hole (needs PIL), filename and output_filename
+        may be file objects (format then names the output format, e.g. PNG)"""
+    holes_image(filename, holes, radius, color).save(output_filename, format)
+
+
+def _circle_offsets(radius):
+    """ (dx, dy) arrays of the pixels on a circle outline """
+    span = numpy.arange(-radius, radius + 1)
+    dx, dy = numpy.meshgrid(span, span)
+    outline = numpy.abs(numpy.hypot(dx, dy) - radius) < 0.5
+    return dx[outline], dy[outline]
+
+
+def holes_array(gray, holes, radius=2, color=(255, 0, 0)):
+    """ RGB array of a grayscale array with a circle on every hole (no PIL needed) """
+    height, width = gray.shape
+    rgb = numpy.repeat(numpy.asarray(gray)[:, :, numpy.newaxis], 3, axis=2)
+    dx, dy = _circle_offsets(radius)
+    centres = numpy.array([hole[:2] for hole in holes], dtype=int).reshape(-1, 2)
+    x = (centres[:, 0:1] + dx).ravel()
+    y = (centres[:, 1:2] + dy).ravel()
+    inside = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+    rgb[y[inside], x[inside]] = color
+    return rgb
+
+
+def holes_preview(mask, holes, max_size, radius=2, color=(255, 0, 0)):
+    """ holes_array of every step-th pixel of a grayscale mask (e.g. memory-mapped, too big to load)
+        so that its longest side is at most max_size """
+    step = max(1, -(-max(mask.shape[:2]) // max_size))
+    preview = numpy.array(mask[::step, ::step])
+    return holes_array(preview, [(hole[0] // step, hole[1] // step) for hole in holes], radius, color)
+
+
+def draw_holes_strips(strips, width, height, holes, output_filename, radius=2, color=(255, 0, 0)):
+    """ Write a PNG of grayscale strips (top to bottom) with a circle on every hole, one strip in memory
+        at a time (for masks too big to load, see find_blobs on a memory-mapped pcb_drill_raster.open_pgm)"""
+    dx, dy = _circle_offsets(radius)
+    centres = numpy.array([hole[:2] for hole in holes], dtype=int).reshape(-1, 2)
+    x = (centres[:, 0:1] + dx).ravel()
+    y = (centres[:, 1:2] + dy).ravel()
+    inside = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+    x, y = x[inside], y[inside]
+    order = numpy.argsort(y, kind='mergesort')
+    x, y = x[order], y[order]
+    with open(output_filename, "wb") as output_file:
+        writer = PngWriter(output_file, width, height)
+        top = 0
+        for strip in strips:
+            rgb = numpy.repeat(numpy.asarray(strip)[:, :, numpy.newaxis], 3, axis=2)
+            first, last = numpy.searchsorted(y, [top, top + len(strip)])
+            rgb[y[first:last] - top, x[first:last]] = color
+            writer.write(rgb)
+            top += len(strip)
+        writer.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find the holes of a solder mask")
+    parser.add_argument('solder_mask', help="solder mask image file")
+    parser.add_argument('--threshold', type=int, default=-1, help="binarize threshold (-1 for Otsu)")
+    parser.add_argument('--min-size', type=float, default=DEFAULT_MIN_SIZE, help="smallest blob area")
+    args = parser.parse_args()
+    for hole in find_blobs(read_image(args.solder_mask), args.threshold, args.min_size).holes():
+        print "{0} {1} {2:.3f}".format(*hole)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python2.7
+
+"""
+pcb_drill_cache.py - content addressed on disk cache of processing results, keyed by a hash of the
+input bytes and the parameters it was processed with, bounded in size with least recently used eviction
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+# Default cache size limit in bytes
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+_RESULT_SUFFIX = ".json"
+# Bytes hashed at a time by file_cache_key
+_BLOCK_SIZE = 1024 * 1024
+
+
+def cache_key(data, parameters=None):
+    """ Hex digest of data (bytes) and parameters (anything json can write) """
+    digest = hashlib.sha1(data)
+    digest.update(json.dumps(parameters, sort_keys=True))
+    return digest.hexdigest()
+
+
+def file_cache_key(filename, parameters=None):
+    """ cache_key of a file's contents, read a block at a time """
+    digest = hashlib.sha1()
+    with open(filename, "rb") as input_file:
+        for block in iter(lambda: input_file.read(_BLOCK_SIZE), ""):
+            digest.update(block)
+    digest.update(json.dumps(parameters, sort_keys=True))
+    return digest.hexdigest()
+
+
+class ResultCache(object):
+    """ Results (json dicts) plus optional files per key, one set of files per entry in directory.
+        A file's modification time is when the entry was last used, so the least recently used
+        entries are evicted first, also after a restart."""
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        """ Result cache
+        Arguments:
+            directory - where entries are kept (created if missing)
+            max_bytes - size limit for all entries, 0 disables the cache
+        """
+        self._directory = directory
+        self._max_bytes = int(max_bytes)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # key -> [last used, bytes, file names]
+        self._entries = {}
+        # Jobs run on several threads
+        self._lock = threading.RLock()
+        if self._max_bytes > 0:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            self._scan()
+
+    def _scan(self):
+        """ Pick up the entries already on disk """
+        for name in os.listdir(self._directory):
+            key = name.split(".", 1)[0]
+            path = os.path.join(self._directory, name)
+            if len(key) != 40 or not os.path.isfile(path):
+                continue
+            entry = self._entries.setdefault(key, [0, 0, []])
+            status = os.stat(path)
+            entry[0] = max(entry[0], status.st_mtime)
+            entry[1] += status.st_size
+            entry[2].append(name)
+        # Entries missing their result (e.g. a crash while storing) are of no use
+        for key, entry in self._entries.items():
+            if key + _RESULT_SUFFIX not in entry[2]:
+                self._remove(key)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    @property
+    def size(self):
+        """ Bytes used by all entries """
+        return sum(entry[1] for entry in self._entries.itervalues())
+
+    def get(self, key):
+        """ The result stored for key or None, marks the entry as used """
+        with self._lock:
+            return self._get(key)
+
+    def _get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        try:
+            with open(os.path.join(self._directory, key + _RESULT_SUFFIX)) as result_file:
+                result = json.load(result_file)
+        except (IOError, ValueError):
+            # Removed or damaged behind our back
+            self._remove(key)
+            self.misses += 1
+            return None
+        entry[0] = time.time()
+        for name in entry[2]:
+            try:
+                os.utime(os.path.join(self._directory, name), (entry[0], entry[0]))
+            except OSError:
+                pass
+        self.hits += 1
+        return result
+
+    def file_path(self, key, suffix):
+        """ Full path of a file stored with key, None if there is none """
+        entry = self._entries.get(key)
+        if entry is None or key + suffix not in entry[2]:
+            return None
+        return os.path.join(self._directory, key + suffix)
+
+    def put(self, key, result, files=None, contents=None):
+        """ Store result for key
+        Arguments:
+            key - from cache_key
+            result - dict that json can write
+            files - {suffix: path} files copied into the cache next to the result, e.g. {'.png': overlay}
+            contents - {suffix: bytes} like files for data that only exists in memory
+        """
+        if self._max_bytes <= 0:
+            return
+        with self._lock:
+            self._put(key, result, files, contents)
+
+    def _put(self, key, result, files, contents=None):
+        self._remove(key)
+        names = []
+        size = 0
+        stored = [(suffix, path, None) for suffix, path in (files or {}).items()]
+        stored += [(suffix, None, data) for suffix, data in (contents or {}).items()]
+        for suffix, path, data in sorted(stored, key=lambda item: item[0]):
+            name = key + suffix
+            target = os.path.join(self._directory, name)
+            if path is not None:
+                shutil.copyfile(path, target + ".tmp")
+            else:
+                with open(target + ".tmp", "wb") as data_file:
+                    data_file.write(data)
+            os.rename(target + ".tmp", target)
+            names.append(name)
+            size += os.path.getsize(target)
+        # The result goes last, it marks the entry as complete
+        handle, temporary = tempfile.mkstemp(dir=self._directory, suffix=".tmp")
+        with os.fdopen(handle, "w") as result_file:
+            json.dump(result, result_file)
+        target = os.path.join(self._directory, key + _RESULT_SUFFIX)
+        os.rename(temporary, target)
+        names.append(key + _RESULT_SUFFIX)
+        size += os.path.getsize(target)
+        self._entries[key] = [time.time(), size, names]
+        self._evict()
+
+    def _evict(self):
+        """ Drop least recently used entries until the cache fits in max_bytes """
+        size = self.size
+        for key in sorted(self._entries, key=lambda key: self._entries[key][0]):
+            if size <= self._max_bytes:
+                break
+            size -= self._entries[key][1]
+            self._remove(key)
+            self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for name in entry[2]:
+            try:
+                os.remove(os.path.join(self._directory, name))
+            except OSError:
+                pass
+
+    def clear(self):
+        """ Remove every entry """
+        with self._lock:
+            for key in self._entries.keys():
+                self._remove(key)
@@ -0,0 +1,168 @@
+#!/usr/bin/env python2.7
+
+"""
+pcb_drill_calibrate.py - find the holes of the printer calibration program (CALIBRATE_HOLES) in a before
+and after picture by differencing small windows around where each hole should be instead of whole frames.
+Where the holes should be comes from the last calibration, or from a coarse pass over every few pixels.
+When a window misses, the full frames are differenced like before.
+"""
+
+import itertools
+import math
+
+import numpy
+
+from pcb_drill_blobs import BlobFinder, histogram, otsu_threshold, to_gray
+from pcb_drill_gcode import CALIBRATE_HOLES
+
+# Half the side of the window searched around each predicted hole, in pixels
+DEFAULT_WINDOW = 24
+# Smallest difference between a drilled hole and the unchanged board around it
+DEFAULT_MIN_CONTRAST = 40
+# The coarse pass differences every COARSE_STEP-th pixel of every COARSE_STEP-th row
+COARSE_STEP = 4
+# Smallest number of changed pixels that is a hole rather than noise, in the full frame
+MIN_HOLE_PIXELS = 6
+
+
+def difference(pre, post):
+    """ uint8 absolute difference of two grayscale arrays, holes show whether they are darker or lighter """
+    return numpy.abs(post.astype(numpy.int16) - pre.astype(numpy.int16)).astype(numpy.uint8)
+
+
+def _median(counts):
+    """ Median of a 256 bin histogram """
+    return int(numpy.searchsorted(numpy.cumsum(counts), (counts.sum() + 1) // 2))
+
+
+def _changed(diff, min_contrast):
+    """ Mask of the pixels that changed, None when nothing changed by at least min_contrast.
+        Measured against the median so a lighting change across the area is not a hole. """
+    counts = histogram(diff)
+    background = _median(counts)
+    peak = int(numpy.flatnonzero(counts)[-1])
+    if peak - background < min_contrast:
+        return None, background
+    threshold = max(otsu_threshold(counts), (peak + background) // 2)
+    return diff > threshold, background
+
+
+def _blobs(mask, min_size=0):
+    finder = BlobFinder(mask.shape[1])
+    finder.feed(mask)
+    return finder.finish(min_size)
+
+
+def difference_holes(pre, post, step=1, min_contrast=DEFAULT_MIN_CONTRAST, min_pixels=MIN_HOLE_PIXELS):
+    """ (x, y) centre of every changed blob of two whole grayscale frames, biggest first
+    Arguments:
+        pre, post - grayscale arrays before and after drilling
+        step - difference every step-th pixel only (a coarse pass), centres are in full resolution
+        min_contrast - smallest change that counts
+        min_pixels - smallest blob in full resolution pixels
+    """
+    diff = difference(pre[::step, ::step], post[::step, ::step])
+    mask, background = _changed(diff, min_contrast)
+    if mask is None:
+        return []
+    blobs = _blobs(mask)
+    keep = numpy.flatnonzero(blobs.pixels * step * step >= min_pixels)
+    keep = keep[numpy.argsort(-blobs.pixels[keep], kind='mergesort')]
+    # Centres of the sampled pixels
+    return [(x * step + (step - 1) / 2.0, y * step + (step - 1) / 2.0) for x, y in blobs.centroid[keep].tolist()]
+
+
+def window_centroid(pre, post, center, window=DEFAULT_WINDOW, min_contrast=DEFAULT_MIN_CONTRAST):
+    """ Sub-pixel (x, y) of the changed blob nearest center, from the pixels within window of it only.
+        None when nothing changed there or the blob does not fit in the window (after one recentre).
+    Arguments:
+        pre, post - grayscale arrays before and after drilling
+        center - (x, y) where the hole should be
+        window - half the side of the searched square
+        min_contrast - smallest change that counts
+    """
+    height, width = pre.shape
+    for attempt in xrange(2):
+        left = max(0, int(round(center[0])) - window)
+        top = max(0, int(round(center[1])) - window)
+        right = min(width, int(round(center[0])) + window + 1)
+        bottom = min(height, int(round(center[1])) + window + 1)
+        if right - left < 2 or bottom - top < 2:
+            return None
+        diff = difference(pre[top:bottom, left:right], post[top:bottom, left:right])
+        mask, background = _changed(diff, min_contrast)
+        if mask is None:
+            return None
+        blobs = _blobs(mask)
+        if len(blobs) == 0:
+            return None
+        distance = numpy.hypot(blobs.centroid[:, 0] + left - center[0], blobs.centroid[:, 1] + top - center[1])
+        x, y, box_width, box_height = blobs.bounding_box[int(numpy.argmin(distance))].tolist()
+        # The blob touches a side of the window that is not the side of the frame: it is cut off
+        cut = ((x == 0 and left > 0) or (y == 0 and top > 0) or
+               (x + box_width >= right - left and right < width) or
+               (y + box_height >= bottom - top and bottom < height))
+        box = (slice(y, y + box_height), slice(x, x + box_width))
+        # Weighted by how much each pixel changed, for a centre between pixels
+        weights = numpy.where(mask[box], diff[box].astype(float) - background, 0.0)
+        rows, columns = numpy.mgrid[box]
+        total = weights.sum()
+        found = (float((weights * columns).sum() / total + left), float((weights * rows).sum() / total + top))
+        if not cut:
+            return found
+        center = found
+    return None
+
+
+def order_holes(points, expected=CALIBRATE_HOLES):
+    """ points (pixels) in the order of expected (printer mm), matched by the shape of the triangle
+        they make, and the pixels per mm. None, None when the number of points is not right. """
+    if len(points) != len(expected) or len(points) < 2:
+        return None, None
+    pairs = list(itertools.combinations(xrange(len(expected)), 2))
+    lengths = numpy.array([math.hypot(expected[i][0] - expected[j][0], expected[i][1] - expected[j][1])
+                           for i, j in pairs])
+    best = None
+    for order in itertools.permutations(points):
+        measured = numpy.array([math.hypot(order[i][0] - order[j][0], order[i][1] - order[j][1])
+                                for i, j in pairs])
+        # Least squares scale from mm to pixels, then how far off the shape is
+        scale = numpy.dot(measured, lengths) / numpy.dot(lengths, lengths)
+        error = ((measured - scale * lengths) ** 2).sum()
+        if best is None or error < best[0]:
+            best = (error, list(order), scale)
+    return best[1], best[2]
+
+
+def locate_calibration_holes(pre, post, predicted=None, window=DEFAULT_WINDOW,
+                             min_contrast=DEFAULT_MIN_CONTRAST, expected=CALIBRATE_HOLES):
+    """ Find the holes drilled by the calibration program
+    Arguments:
+        pre, post - images (grayscale or RGB arrays) before and after drilling
+        predicted - (x, y) pixels of each hole, e.g. from the last calibration. None for a coarse pass.
+        window - half the side of the square searched around each predicted hole
+        min_contrast - smallest change that counts
+        expected - the holes drilled in printer mm
+    Returns a dict:
+        holes - (x, y) of every hole found, in the order of expected when all were found
+        pixels_per_mm - scale of the camera at the bed (None unless all were found)
+        method - roi (predicted windows), coarse (windows around a coarse pass) or full_frame
+        misses - windows that found nothing before the full frames were differenced
+    """
+    pre = to_gray(pre)
+    post = to_gray(post)
+    if pre.shape != post.shape:
+        raise ValueError("The images before and after drilling differ in size {0} != {1}".format(
+            pre.shape, post.shape))
+    method = "roi"
+    if predicted is None or len(predicted) != len(expected):
+        method = "coarse"
+        predicted = difference_holes(pre, post, COARSE_STEP, min_contrast)[:len(expected)]
+    holes = [window_centroid(pre, post, center, window, min_contrast) for center in predicted]
+    misses = len(expected) - len([hole for hole in holes if hole is not None])
+    if misses:
+        method = "full_frame"
+        holes = [window_centroid(pre, post, center, window, min_contrast) or center
+                 for center in difference_holes(pre, post, 1, min_contrast)]
+    ordered, scale = order_holes(holes, expected)
+    return {'holes': ordered or holes, 'pixels_per_mm': scale, 'method': method, 'misses': misses}
@@ -0,0 +1,391 @@
+#!/usr/bin/env python2.7
+
+"""
+pcb_drill_camera.py - keep the camera open between shots and capture straight into reusable numpy
+buffers, so a capture costs an exposure instead of a sensor warm up plus a PNG encode to the SD card.
+Images are only encoded (save_image, encode_image) when someone asks for a file.
+
+The camera itself is a backend: the Raspberry Pi camera (picamera) or a fake camera that serves a
+file or a synthetic board, so capture to result latency can be measured on any Linux box.
+"""
+
+import io
+import threading
+import time
+
+import numpy
+
+try:
+    import picamera
+except ImportError:
+    # Only on a Raspberry Pi, the fake camera works without it
+    picamera = None
+
+try:
+    from PIL import Image
+except ImportError:
+    try:
+        # PIL 1.1.7 installs as top level modules
+        import Image
+    except ImportError:
+        # PNG files are written with pcb_drill_raster instead, JPEG needs PIL
+        Image = None
+
+from pcb_drill_raster import PngWriter, iter_png_strips
+
+# Seconds the camera stays open after its last use
+DEFAULT_IDLE_TIMEOUT = 60.0
+# Buffers per resolution that capture() takes turns with, the last few images stay valid
+DEFAULT_BUFFERS = 2
+
+
+class CameraBackend(object):
+    """ What CameraService needs from a camera, images are height x width x 3 uint8 RGB arrays """
+    name = None
+
+    def open(self):
+        """ Power up the sensor, CameraService calls it once per warm period """
+        pass
+
+    def close(self):
+        pass
+
+    def frame_shape(self, width, height):
+        """ Shape of the buffer capture() fills for width x height, may be padded """
+        return (height, width, 3)
+
+    def capture(self, buffer, width, height, use_video_port=False):
+        """ Fill buffer (of frame_shape) with a width x height image """
+        raise NotImplementedError
+
+    def capture_sequence(self, buffers, width, height):
+        """ Fill buffers one after the other as fast as the camera allows """
+        for buffer in buffers:
+            self.capture(buffer, width, height, use_video_port=True)
+
+    def capture_jpeg(self, width, height, quality):
+        """ JPEG bytes of a video port capture when the camera encodes them itself, otherwise None """
+        return None
+
+    def start_preview(self):
+        pass
+
+    def stop_preview(self):
+        pass
+
+
+class PiCameraBackend(CameraBackend):
+    """ The Raspberry Pi camera through picamera """
+    name = "picamera"
+
+    def __init__(self):
+        if picamera is None:
+            raise ImportError("The picamera camera backend needs picamera")
+        self._camera = None
+
+    def open(self):
+        self._camera = picamera.PiCamera()
+        self._camera.awb_mode = 'fluorescent'
+        self._camera.contrast = 40
+        self._camera.exif_tags['IFD0.Artist'] = "pcb_drilld"
+        self._camera.exif_tags['IFD0.Copyright'] = "TODO"
+
+    def close(self):
+        if self._camera is not None:
+            self._camera.close()
+            self._camera = None
+
+    def frame_shape(self, width, height):
+        # Raw RGB captures are padded to a multiple of 32 columns and 16 rows
+        return ((height + 15) // 16 * 16, (width + 31) // 32 * 32, 3)
+
+    def _resolution(self, width, height):
+        if self._camera.resolution != (width, height):
+            self._camera.resolution = (width, height)
+
+    def capture(self, buffer, width, height, use_video_port=False):
+        self._resolution(width, height)
+        self._camera.capture(buffer, format='rgb', use_video_port=use_video_port)
+
+    def capture_sequence(self, buffers, width, height):
+        self._resolution(width, height)
+        self._camera.capture_sequence(buffers, format='rgb', use_video_port=True)
+
+    def capture_jpeg(self, width, height, quality):
+        # The GPU encodes, much faster than PIL on the ARM
+        self._resolution(width, height)
+        output = io.BytesIO()
+        self._camera.capture(output, format='jpeg', use_video_port=True, quality=quality)
+        return output.getvalue()
+
+    def start_preview(self):
+        self._camera.start_preview()
+
+    def stop_preview(self):
+        self._camera.stop_preview()
+
+
+class FakeCameraBackend(CameraBackend):
+    """ A camera that always sees the same scene: an image file (scaled to the resolution asked for) or
+        a synthetic board of dark holes on a light background """
+    name = "fake"
+
+    def __init__(self, source=None, warm_up=0.0, exposure=0.0):
+        """ Fake camera
+        Arguments:
+            source - image file (PNG, or anything PIL reads), None for a synthetic board
+            warm_up - seconds open() takes, like a real sensor settling
+            exposure - seconds each capture takes
+        """
+        self._source = source
+        self._warm_up = float(warm_up)
+        self._exposure = float(exposure)
+        self._scene = None
+        self._scaled = {}
+
+    def open(self):
+        time.sleep(self._warm_up)
+        if self._scene is None:
+            self._scene = read_rgb(self._source) if self._source else synthetic_board()
+
+    def close(self):
+        self._scaled = {}
+
+    def capture(self, buffer, width, height, use_video_port=False):
+        time.sleep(self._exposure)
+        scaled = self._scaled.get((width, height))
+        if scaled is None:
+            # Nearest neighbour is all a stand in for a lens needs
+            rows = numpy.arange(height) * self._scene.shape[0] // height
+            columns = numpy.arange(width) * self._scene.shape[1] // width
+            scaled = self._scaled[(width, height)] = self._scene[rows][:, columns]
+        buffer[:height, :width] = scaled
+
+
+CAMERA_BACKENDS = {
+    PiCameraBackend.name: PiCameraBackend,
+    FakeCameraBackend.name: FakeCameraBackend,
+}
+
+
+def get_camera_backend(backend, **kwargs):
+    """ Turn a backend name (see CAMERA_BACKENDS) or CameraBackend into a CameraBackend
+    Arguments:
+        backend - name or CameraBackend
+        **kwargs - options for the fake camera (source, warm_up, exposure)
+    """
+    if isinstance(backend, CameraBackend):
+        return backend
+    if backend not in CAMERA_BACKENDS:
+        raise ValueError("Unknown camera backend {0}, expected one of {1}".format(
+            backend, ", ".join(sorted(CAMERA_BACKENDS))))
+    if backend == FakeCameraBackend.name:
+        return FakeCameraBackend(**kwargs)
+    return CAMERA_BACKENDS[backend]()
+
+
+def synthetic_board(width=1024, height=768, pitch=48, radius=6):
+    """ RGB image of a light board with a grid of dark round holes """
+    board = numpy.empty((height, width, 3), dtype=numpy.uint8)
+    board[:] = 220
+    y, x = numpy.ogrid[:height, :width]
+    holes = ((x % pitch - pitch // 2) ** 2 + (y % pitch - pitch // 2) ** 2) <= radius * radius
+    board[holes] = 20
+    return board
+
+
+def read_rgb(filename):
+    """ RGB array of an image file, PNG files are read without PIL when it is missing """
+    if Image is not None:
+        return numpy.asarray(Image.open(filename).convert("RGB"))
+    gray = numpy.concatenate(list(iter_png_strips(filename)))
+    return numpy.dstack((gray, gray, gray))
+
+
+def average_frames(frames):
+    """ Pixel by pixel mean of equally sized images (e.g. a capture_burst), less sensor noise """
+    total = numpy.zeros(frames[0].shape, dtype=numpy.uint32)
+    for frame in frames:
+        total += frame
+    return (total // len(frames)).astype(numpy.uint8)
+
+
+def _image_format(filename):
+    return "JPEG" if filename.lower().endswith((".jpg", ".jpeg")) else "PNG"
+
+
+def encode_image(image, image_format="PNG", quality=None):
+    """ Bytes of image (RGB array) as a PNG or JPEG file (of quality 1-95, None for PIL's default) """
+    output = io.BytesIO()
+    if Image is not None:
+        options = {'quality': quality} if image_format == "JPEG" and quality else {}
+        Image.fromarray(numpy.ascontiguousarray(image)).save(output, image_format, **options)
+    elif image_format == "PNG":
+        writer = PngWriter(output, image.shape[1], image.shape[0])
+        writer.write(image)
+        writer.close()
+    else:
+        raise ImportError("Encoding {0} needs PIL".format(image_format))
+    return output.getvalue()
+
+
+def save_image(image, filename):
+    """ Write image (RGB array) to filename, PNG or JPEG by its extension """
+    data = encode_image(image, _image_format(filename))
+    with open(filename, "wb") as image_file:
+        image_file.write(data)
+
+
+class CameraService(object):
+    """ One camera kept open while it is in use: it closes after idle_timeout seconds without captures
+        and opens again on the next one. Captures go into buffers that are reused. """
+
+    def __init__(self, backend, idle_timeout=DEFAULT_IDLE_TIMEOUT, buffers=DEFAULT_BUFFERS):
+        """ Camera service
+        Arguments:
+            backend - CameraBackend
+            idle_timeout - seconds the camera stays open after its last use, 0 closes it straight away
+            buffers - captures at one resolution that stay valid, the one after overwrites the oldest
+        """
+        self._backend = backend
+        self._idle_timeout = float(idle_timeout)
+        self._buffers = max(1, int(buffers))
+        self._lock = threading.RLock()
+        self._open = False
+        self._in_preview = False
+        self._timer = None
+        self._last_used = 0.0
+        # (width, height): [buffer, ...]
+        self._pool = {}
+        self._turn = {}
+        self.opens = 0
+        self.captures = 0
+
+    @property
+    def is_open(self):
+        return self._open
+
+    def _acquire(self):
+        """ Open the camera if it is not, call with the lock held """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._open:
+            self._backend.open()
+            self._open = True
+            self.opens += 1
+
+    def _release(self):
+        """ Start the idle timeout, call with the lock held """
+        self._last_used = time.time()
+        if self._in_preview:
+            return
+        if self._idle_timeout <= 0:
+            self._close()
+            return
+        self._timer = threading.Timer(self._idle_timeout, self._idle)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _idle(self):
+        with self._lock:
+            if self._open and not self._in_preview and time.time() - self._last_used >= self._idle_timeout:
+                self._close()
+
+    def _close(self):
+        if self._open:
+            self._backend.close()
+            self._open = False
+
+    def _buffers_for(self, width, height, count):
+        """ At least count buffers for width x height """
+        pool = self._pool.setdefault((width, height), [])
+        while len(pool) < count:
+            pool.append(numpy.empty(self._backend.frame_shape(width, height), dtype=numpy.uint8))
+        return pool
+
+    def _next_buffer(self, width, height):
+        """ The buffer whose turn it is, call with the lock held """
+        pool = self._buffers_for(width, height, self._buffers)
+        turn = self._turn.get((width, height), 0)
+        self._turn[(width, height)] = (turn + 1) % self._buffers
+        return pool[turn]
+
+    def capture(self, width, height, use_video_port=False):
+        """ height x width x 3 RGB image, a view of a reused buffer: copy it to keep it past the next
+            `buffers` captures at this resolution """
+        width, height = int(width), int(height)
+        with self._lock:
+            self._acquire()
+            try:
+                buffer = self._next_buffer(width, height)
+                self._backend.capture(buffer, width, height, use_video_port)
+                self.captures += 1
+            finally:
+                self._release()
+        return buffer[:height, :width]
+
+    def capture_burst(self, count, width, height):
+        """ count images in quick succession from the video port, views of reused buffers (valid until
+            the next capture_burst at this resolution) """
+        width, height, count = int(width), int(height), int(count)
+        with self._lock:
+            self._acquire()
+            try:
+                buffers = self._buffers_for(width, height, count)[:count]
+                self._backend.capture_sequence(buffers, width, height)
+                self.captures += count
+            finally:
+                self._release()
+        return [buffer[:height, :width] for buffer in buffers]
+
+    def capture_jpeg(self, width, height, quality=85):
+        """ (bytes, mime type) of a video port capture for live previews: JPEG, encoded by the camera
+            when it can, PNG without PIL """
+        width, height = int(width), int(height)
+        with self._lock:
+            self._acquire()
+            try:
+                data = self._backend.capture_jpeg(width, height, quality)
+                content_type = "image/jpeg"
+                if data is None:
+                    buffer = self._next_buffer(width, height)
+                    self._backend.capture(buffer, width, height, use_video_port=True)
+                    image_format = "JPEG" if Image is not None else "PNG"
+                    data = encode_image(buffer[:height, :width], image_format, quality)
+                    content_type = "image/" + image_format.lower()
+                self.captures += 1
+            finally:
+                self._release()
+        return data, content_type
+
+    def start_preview(self):
+        with self._lock:
+            self._acquire()
+            if not self._in_preview:
+                self._backend.start_preview()
+                self._in_preview = True
+
+    def stop_preview(self):
+        with self._lock:
+            if self._in_preview:
+                self._backend.stop_preview()
+                self._in_preview = False
+                self._release()
+
+    def close(self):
+        """ Close the camera now (it opens again on the next capture) """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self._in_preview:
+                self._backend.stop_preview()
+                self._in_preview = False
+            self._close()
+
+    def stats(self):
+        with self._lock:
+            return {'backend': self._backend.name, 'open': self._open, 'in_preview': self._in_preview,
+                    'opens': self.opens, 'captures': self.captures,
+                    'buffer_bytes': sum(buffer.nbytes for pool in self._pool.values() for buffer in pool)}
@@ -1,27 +1,196 @@
-
 import zmq
 import datetime
-import json
+import threading
+import time
+import uuid
+
+from pcb_drill_transport import recv_message, send_message
+
+# Seconds to wait for the daemon's answer before the socket is reset
+DEFAULT_TIMEOUT = 10.0
+# Times a request that timed out is sent again on a new socket
+DEFAULT_RETRIES = 2
+# Seconds a pooled connection may sit unused before it is pinged before use, 0 never pings
+DEFAULT_HEARTBEAT = 30.0
+# Seconds the daemon has to answer a heartbeat
+HEARTBEAT_TIMEOUT = 1.0
+# Connections kept open by a ClientPool
+DEFAULT_POOL_SIZE = 4
+
+
+class DaemonTimeout(Exception):
+    """ The daemon did not answer in time, after every retry """
+    def __init__(self, command, attempts, timeout):
+        Exception.__init__(self, "No answer to {0} from the daemon after {1} attempts of {2}s".format(
+            command, attempts, timeout))
+        self.command = command
+        self.attempts = attempts
+        self.timeout = timeout
+
 
 class PcbDrillClient(object):
-    """ Client to wrap the RPC into a friendly method to call (i.e. handles serialization)"""
-    def __init__(self):
-        self._context = zmq.Context() 
-        self._socket = self._context.socket(zmq.REQ)
+    """ Client to wrap the RPC into a friendly method to call (i.e. handles serialization)
+        Binary keyword arguments (pcb_drill_transport.Binary) are sent as raw frames next to the command.
+        With a timeout a request that is not answered in time gets a new socket and is sent again
+        (ZeroMQ's lazy pirate pattern: a REQ socket cannot send again before it received)."""
+    def __init__(self, envelope=None, context=None, timeout=None, retries=0):
+        """ Client
+        Arguments:
+            envelope - format of messages carrying binary data, see pcb_drill_transport
+            context - ZeroMQ context (default a new one)
+            timeout - seconds to wait for each answer, None waits forever
+            retries - times a request that timed out is sent again, then DaemonTimeout is raised.
+                      Every attempt carries the same request id so a job command starts one job,
+                      other commands that are sent again may run twice.
+        """
+        self._context = context or zmq.Context()
+        self._timeout = timeout
+        self._retries = int(retries)
+        self._address = None
+        self._socket = None
+        self._open()
+        # Envelope format of messages carrying binary data, see pcb_drill_transport
+        self._envelope = envelope
+        self.resets = 0
+        self.last_used = time.time()
         #self._session = datetime.datetime.now().strftime('%Y%m%d_%H%M%S.%f')
     def __call__(self, command, **kwargs):
         updated_kwargs = kwargs
         #updated_kwargs['session'] = self._session
         response = self._request(command, **updated_kwargs)
         return response
+    def _open(self):
+        self._socket = self._context.socket(zmq.REQ)
+        # Unanswered requests are dropped when the socket is closed
+        self._socket.setsockopt(zmq.LINGER, 0)
+        if self._timeout is not None:
+            self._socket.setsockopt(zmq.SNDTIMEO, int(self._timeout * 1000))
+        if self._address is not None:
+            self._socket.connect(self._address)
+    def _reset(self):
+        """ New socket after an unanswered request, the old one is stuck waiting for it """
+        self._socket.close()
+        self.resets += 1
+        self._open()
     def _request(self, command, **kwargs):
-        data = {'command': command}
+        data = {'command': command, 'request_id': uuid.uuid4().hex}
         data.update(kwargs)
-        data_serialized = json.dumps(data)
-        self._socket.send(data_serialized)
-        response = self._socket.recv()
-        data = json.loads(response)
-        return data
+        return self._send(data, self._timeout, self._retries)
+    def _send(self, data, timeout, retries):
+        self.last_used = time.time()
+        if timeout is None:
+            send_message(self._socket, data, self._envelope)
+            return recv_message(self._socket)[0]
+        for attempt in xrange(retries + 1):
+            try:
+                send_message(self._socket, data, self._envelope)
+                if self._socket.poll(timeout * 1000, zmq.POLLIN):
+                    return recv_message(self._socket)[0]
+            except zmq.Again:
+                pass
+            self._reset()
+        raise DaemonTimeout(data['command'], retries + 1, timeout)
     def connect(self, *args):
         """ Connect to the server """
+        self._address = args[0]
         self._socket.connect(*args)
+    def ping(self, timeout=HEARTBEAT_TIMEOUT):
+        """ Whether the daemon answers a heartbeat within timeout seconds """
+        try:
+            return self._send({'command': 'ping'}, timeout, 0).get('success', False)
+        except DaemonTimeout:
+            return False
+    def close(self):
+        self._socket.close()
+
+
+class ClientPool(object):
+    """ Connections to the daemon shared by every thread of a process (e.g. the web app's requests):
+        a request borrows an idle connection instead of opening a socket and connecting. Connections
+        share one ZeroMQ context, time out, and are pinged before use when they sat unused for long. """
+    def __init__(self, address, size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES,
+                 heartbeat=DEFAULT_HEARTBEAT, envelope=None, context=None):
+        """ Client pool
+        Arguments:
+            address - the daemon's socket, e.g. tcp://localhost:5555
+            size - idle connections kept, more are opened while more requests run at once
+            timeout - seconds to wait for each answer
+            retries - times a request that timed out is sent again (see PcbDrillClient)
+            heartbeat - seconds unused before a connection is pinged before use, 0 never pings
+            envelope - format of messages carrying binary data, see pcb_drill_transport
+            context - ZeroMQ context (default the shared instance)
+        """
+        self.address = address
+        self.size = int(size)
+        self.timeout = float(timeout)
+        self.retries = int(retries)
+        self.heartbeat = float(heartbeat)
+        self._envelope = envelope
+        self._context = context or zmq.Context.instance()
+        self._lock = threading.Lock()
+        self._idle = []
+        self.healthy = True
+        self.opened = 0
+        self.requests = 0
+        self.timeouts = 0
+        self.heartbeats = 0
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+            self.opened += 1
+        client = PcbDrillClient(self._envelope, self._context, self.timeout, self.retries)
+        client.connect(self.address)
+        return client
+
+    def _release(self, client):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(client)
+                return
+        client.close()
+
+    def __call__(self, command, **kwargs):
+        """ Send command on an idle connection, like PcbDrillClient. Raises DaemonTimeout when the daemon
+            does not answer. """
+        client = self._acquire()
+        try:
+            if self.heartbeat and time.time() - client.last_used > self.heartbeat:
+                self.heartbeats += 1
+                self.healthy = client.ping(min(self.timeout, HEARTBEAT_TIMEOUT))
+                if not self.healthy:
+                    # Fail fast instead of waiting out every retry on a daemon that is gone
+                    raise DaemonTimeout(command, 1, min(self.timeout, HEARTBEAT_TIMEOUT))
+            self.requests += 1
+            response = client(command, **kwargs)
+            self.healthy = True
+            return response
+        except DaemonTimeout:
+            self.timeouts += 1
+            self.healthy = False
+            raise
+        finally:
+            self._release(client)
+
+    def ping(self):
+        """ Whether the daemon answers a heartbeat """
+        client = self._acquire()
+        try:
+            self.heartbeats += 1
+            self.healthy = client.ping(min(self.timeout, HEARTBEAT_TIMEOUT))
+            return self.healthy
+        finally:
+            self._release(client)
+
+    def stats(self):
+        with self._lock:
+            idle = len(self._idle)
+        return {'address': self.address, 'healthy': self.healthy, 'idle': idle, 'opened': self.opened,
+                'requests': self.requests, 'timeouts': self.timeouts, 'heartbeats': self.heartbeats}
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for client in idle:
+            client.close()
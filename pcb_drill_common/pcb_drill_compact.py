@@ -0,0 +1,155 @@
+#!/usr/bin/env python2.7
+
+"""
+pcb_drill_compact.py - squeeze G-code for streaming over a slow serial link: no comments, short numbers
+and no G0/G1 words that repeat what the machine already has
+"""
+
+import argparse
+import re
+
+# Digits after the decimal point kept for X, Y, Z and F
+COMPACT_PRECISION = 3
+_MOTION = {"G0": "G0", "G00": "G0", "G1": "G1", "G01": "G1"}
+_COMMENT = re.compile(r'\([^)]*\)')
+
+
+def checksum(line):
+    """ RepRap/Marlin line checksum: XOR of every byte """
+    value = 0
+    for character in line:
+        value ^= ord(character)
+    return value
+
+
+def format_number(value, precision=COMPACT_PRECISION):
+    """ Shortest text for value at precision, e.g. 12.7, -.5, 3000 """
+    text = "{0:.{1}f}".format(value, precision)
+    if "." in text:
+        text = text.rstrip("0").rstrip(".")
+    if text.startswith("0."):
+        text = text[1:]
+    elif text.startswith("-0."):
+        text = "-" + text[2:]
+    if text in ("-0", "", "-"):
+        text = "0"
+    return text
+
+
+class GCodeCompactor(object):
+    """ Compact G-code line by line, keeping track of the modal X, Y, Z and F the machine has.
+        Anything other than G0/G1 and M codes (homing, canned cycles, unit changes, ...) is passed
+        through untouched and forgets what is known, so the output always moves the same way."""
+
+    def __init__(self, precision=COMPACT_PRECISION, checksums=False):
+        """ Compactor
+        Arguments:
+            precision - digits after the decimal point for X, Y, Z and F words
+            checksums - number every line and add a checksum (N1 G1 X1*23) after an M110 N0
+        """
+        self._precision = precision
+        self._checksums = checksums
+        self._modal = {}
+        self._relative = False
+        self._line_number = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def feed(self, text):
+        """ Compact text (one or more complete lines), returns the compact text """
+        lines = []
+        for line in text.splitlines():
+            line = self.compact(line)
+            if line is not None:
+                lines.append(line)
+        self.bytes_in += len(text)
+        if not lines:
+            return ""
+        compact = "\n".join(lines) + "\n"
+        self.bytes_out += len(compact)
+        return compact
+
+    def compact(self, line):
+        """ The compact form of one line (without a line ending) or None when it can be dropped """
+        code = line.split(";", 1)[0].split("*", 1)[0]
+        if "(" in code:
+            code = _COMMENT.sub("", code)
+        words = code.upper().split()
+        if words and words[0].startswith("N"):
+            words = words[1:]
+        if not words:
+            return None
+        motion = _MOTION.get(words[0])
+        if motion is not None:
+            words = self._motion_words(motion, words[1:])
+            if words is None:
+                return None
+        else:
+            self._track(words)
+        return self._number(" ".join(words))
+
+    def _motion_words(self, motion, words):
+        """ Drop the X, Y, Z and F words of a G0/G1 the machine already has, None if nothing is left """
+        modal = self._modal
+        kept = [motion]
+        for word in words:
+            letter = word[0]
+            if letter in "XYZF":
+                text = format_number(float(word[1:]), self._precision)
+                # Relative moves repeat on purpose
+                if letter == "F" or not self._relative:
+                    if modal.get(letter) == text:
+                        continue
+                    modal[letter] = text
+                word = letter + text
+            kept.append(word)
+        if len(kept) == 1:
+            return None
+        return kept
+
+    def _track(self, words):
+        """ Keep the modal state right for any other command """
+        if words[0].startswith("M") or words[0] in ("G4", "G04"):
+            # Pauses, spindle, etc. don't move the head
+            return
+        for word in words:
+            if word in ("G90", "G91"):
+                self._relative = word == "G91"
+        # Homing, canned cycles, unit changes, ... leave the position unknown
+        self._modal.clear()
+
+    def _number(self, line):
+        if not self._checksums:
+            return line
+        if self._line_number == 0:
+            prefix = "M110 N0\n"
+        else:
+            prefix = ""
+        self._line_number += 1
+        line = "N{0} {1}".format(self._line_number, line)
+        return "{0}{1}*{2}".format(prefix, line, checksum(line))
+
+
+def compact_lines(lines, precision=COMPACT_PRECISION, checksums=False):
+    """ Yield the compact form of each line that is kept (with a line ending) """
+    compactor = GCodeCompactor(precision, checksums)
+    for line in lines:
+        line = compactor.compact(line.rstrip("\r\n"))
+        if line is not None:
+            yield line + "\n"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact G-code for streaming over serial")
+    parser.add_argument('input', help="G-code file")
+    parser.add_argument('output', help="compact G-code file")
+    parser.add_argument('--precision', type=int, default=COMPACT_PRECISION, help="digits after the decimal point")
+    parser.add_argument('--checksums', action='store_true', help="add line numbers and checksums")
+    args = parser.parse_args()
+    compactor = GCodeCompactor(args.precision, args.checksums)
+    with open(args.input) as input_file, open(args.output, "w") as output_file:
+        for line in input_file:
+            output_file.write(compactor.feed(line))
+    print "{0}: {1} bytes -> {2} bytes ({3:.0%} smaller)".format(
+        args.input, compactor.bytes_in, compactor.bytes_out,
+        1 - float(compactor.bytes_out) / max(compactor.bytes_in, 1))
@@ -0,0 +1,228 @@
+#!/usr/bin/env python2.7
+
+"""
+pcb_drill_cycles.py - the moves that drill each hole: plain plunge/retract, a short clearance
+retract between nearby holes or G81/G83 canned cycles
+"""
+
+import math
+
+try:
+    import numpy
+except ImportError:
+    # Only needed for DrillCycle.full_retracts on numpy hole arrays
+    numpy = None
+
+from pcb_drill_tools import DrillTool
+
+# Default plunge and retract for jobs without a tool table
+DRILL_COMMAND = "G1 Z-.5 F100"
+RETRACT_COMMAND = "G1 Z3.0 F3000"
+# Depth and feeds behind DRILL_COMMAND/RETRACT_COMMAND for the cycles that need numbers
+_DEFAULT_TOOL = DrillTool(0, 0.0)
+
+# Z the drill lifts to between nearby holes
+DEFAULT_CLEARANCE_HEIGHT = 0.5
+# XY moves longer than this get a full retract
+DEFAULT_LONG_MOVE = 10.0
+# Depth drilled per peck by G83
+DEFAULT_PECK_DEPTH = 0.2
+
+
+def _segment_crosses(zone, x1, y1, x2, y2):
+    """ Does the move from (x1, y1) to (x2, y2) pass over zone (min_x, min_y, max_x, max_y)?
+        (Liang-Barsky clipping)"""
+    min_x, min_y, max_x, max_y = zone
+    dx = x2 - x1
+    dy = y2 - y1
+    enter, leave = 0.0, 1.0
+    for p, q in ((-dx, x1 - min_x), (dx, max_x - x1), (-dy, y1 - min_y), (dy, max_y - y1)):
+        if p == 0:
+            if q < 0:
+                return False
+        else:
+            t = float(q) / p
+            if p < 0:
+                enter = max(enter, t)
+            else:
+                leave = min(leave, t)
+    return enter <= leave
+
+
+def _segments_cross(zone, x1, y1, x2, y2):
+    """ _segment_crosses for numpy arrays of moves, returns a bool array """
+    min_x, min_y, max_x, max_y = zone
+    dx = x2 - x1
+    dy = y2 - y1
+    enter = numpy.zeros(len(x1))
+    leave = numpy.ones(len(x1))
+    crosses = numpy.ones(len(x1), dtype=bool)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        for p, q in ((-dx, x1 - min_x), (dx, max_x - x1), (-dy, y1 - min_y), (dy, max_y - y1)):
+            parallel = p == 0
+            crosses &= ~(parallel & (q < 0))
+            t = q / p
+            enter = numpy.where(~parallel & (p < 0), numpy.maximum(enter, t), enter)
+            leave = numpy.where(~parallel & (p > 0), numpy.minimum(leave, t), leave)
+    return crosses & (enter <= leave)
+
+
+class DrillCycle(object):
+    """ Base drill cycle: plunge and retract all the way after every hole (the original gcode).
+        Subclasses lift the drill less between nearby holes. A move gets a full retract when it is
+        the first in a section, longer than long_move or passes over a keep out zone (e.g. a clamp)."""
+
+    name = "plunge"
+
+    def __init__(self, clearance_height=DEFAULT_CLEARANCE_HEIGHT, long_move=DEFAULT_LONG_MOVE,
+                 keep_out_zones=(), peck_depth=DEFAULT_PECK_DEPTH):
+        """ Drill cycle
+        Arguments:
+            clearance_height - Z the drill lifts to between nearby holes
+            long_move - XY moves longer than this get a full retract
+            keep_out_zones - (min_x, min_y, max_x, max_y) areas the drill must not cross low
+            peck_depth - depth per peck (G83 only)
+        """
+        self.clearance_height = float(clearance_height)
+        self.long_move = float(long_move)
+        self.keep_out_zones = [tuple(float(value) for value in zone) for zone in keep_out_zones]
+        self.peck_depth = float(peck_depth)
+
+    def full_retract(self, previous, hole):
+        """ Does the move from previous (None at the start of a section) to hole need a full retract? """
+        if previous is None:
+            return True
+        if math.hypot(hole[0] - previous[0], hole[1] - previous[1]) > self.long_move:
+            return True
+        for zone in self.keep_out_zones:
+            if _segment_crosses(zone, previous[0], previous[1], hole[0], hole[1]):
+                return True
+        return False
+
+    def full_retracts(self, holes, previous):
+        """ full_retract for every hole of a numpy array, returns a bool array """
+        first = previous is None
+        if first:
+            previous = holes[0, :2]
+        x1 = numpy.concatenate([[previous[0]], holes[:-1, 0]])
+        y1 = numpy.concatenate([[previous[1]], holes[:-1, 1]])
+        full = numpy.hypot(holes[:, 0] - x1, holes[:, 1] - y1) > self.long_move
+        for zone in self.keep_out_zones:
+            full |= _segments_cross(zone, x1, y1, holes[:, 0], holes[:, 1])
+        full[0] |= first
+        return full
+
+    def commands(self, tool):
+        """ (drill, retract) commands of tool (None for the default feeds) """
+        if tool is None:
+            return DRILL_COMMAND, RETRACT_COMMAND
+        return tool.drill_command, tool.retract_command
+
+    def hole_commands(self, location, x, y, tool, full_retract):
+        """ (command, comment) pairs that drill one hole
+        Arguments:
+            location - the move to the hole, e.g. G1 X1.0 Y2.0
+            x, y - the hole's coordinates as they are written in location
+            tool - DrillTool with the feeds to use (None for the default feeds)
+            full_retract - True when the drill must be all the way up before moving
+        """
+        drill_command, retract_command = self.commands(tool)
+        return [(location, "Drill hole location"),
+                (drill_command, "Drill hole"),
+                (retract_command, "Retract drill to safe position")]
+
+    def end_commands(self, tool):
+        """ (command, comment) pairs after the last hole drilled with tool """
+        return []
+
+
+class ClearanceCycle(DrillCycle):
+    """ Retract to clearance_height after each hole and only lift all the way before long moves """
+
+    name = "clearance"
+
+    def hole_commands(self, location, x, y, tool, full_retract):
+        drill_command, retract_command = self.commands(tool)
+        commands = []
+        if full_retract:
+            commands.append((retract_command, "Retract drill for a long move"))
+        commands.append((location, "Drill hole location"))
+        commands.append((drill_command, "Drill hole"))
+        commands.append(("G1 Z{0:g} F{1:g}".format(self.clearance_height, (tool or _DEFAULT_TOOL).retract_feed),
+                         "Retract drill to clearance height"))
+        return commands
+
+    def end_commands(self, tool):
+        return [(self.commands(tool)[1], "Retract drill to safe position")]
+
+
+class CannedCycle(DrillCycle):
+    """ G81 canned drilling cycle returning to clearance_height (G99) between nearby holes.
+        Only for firmware that has canned cycles (e.g. LinuxCNC, grbl forks), Marlin does not."""
+
+    name = "g81"
+    g_code = "G81"
+
+    def _cycle_words(self, tool):
+        tool = tool or _DEFAULT_TOOL
+        return "Z{0:g} R{1:g} F{2:g}".format(tool.depth, self.clearance_height, tool.plunge_feed)
+
+    def hole_commands(self, location, x, y, tool, full_retract):
+        if not full_retract:
+            # The cycle is modal, a new location drills the next hole
+            return [("X{0} Y{1}".format(x, y), "Drill hole (canned cycle)")]
+        return [("G80", "Cancel drilling cycle"),
+                (self.commands(tool)[1], "Retract drill for a long move"),
+                ("G99 {0} X{1} Y{2} {3}".format(self.g_code, x, y, self._cycle_words(tool)),
+                 "Drill hole (canned cycle)")]
+
+    def end_commands(self, tool):
+        return [("G80", "Cancel drilling cycle"),
+                (self.commands(tool)[1], "Retract drill to safe position")]
+
+
+class PeckCycle(CannedCycle):
+    """ G83 peck drilling: like G81 but clears chips every peck_depth """
+
+    name = "g83"
+    g_code = "G83"
+
+    def _cycle_words(self, tool):
+        return "{0} Q{1:g}".format(CannedCycle._cycle_words(self, tool), self.peck_depth)
+
+
+DRILL_CYCLES = {
+    DrillCycle.name: DrillCycle,
+    ClearanceCycle.name: ClearanceCycle,
+    CannedCycle.name: CannedCycle,
+    PeckCycle.name: PeckCycle,
+}
+
+
+def get_drill_cycle(cycle, **kwargs):
+    """ Turn a cycle name (see DRILL_CYCLES), DrillCycle or None into a DrillCycle
+    Arguments:
+        cycle - name, DrillCycle or None for the plain plunge/retract
+        **kwargs - DrillCycle options (clearance_height, long_move, keep_out_zones, peck_depth)
+    """
+    if cycle is None:
+        return DrillCycle(**kwargs)
+    if isinstance(cycle, DrillCycle):
+        return cycle
+    if cycle not in DRILL_CYCLES:
+        raise ValueError("Unknown drill cycle {0}, expected one of {1}".format(
+            cycle, ", ".join(sorted(DRILL_CYCLES))))
+    return DRILL_CYCLES[cycle](**kwargs)
+
+
+def parse_keep_out_zones(text):
+    """ Parse keep out zones from the config file, e.g. 0 0 20 10, 180 0 200 10 """
+    zones = []
+    for entry in text.split(","):
+        fields = entry.split()
+        if len(fields) == 0:
+            continue
+        if len(fields) != 4:
+            raise ValueError("Keep out zone {0!r} should look like min_x min_y max_x max_y".format(entry))
+        zones.append(tuple(float(field) for field in fields))
+    return zones
@@ -0,0 +1,389 @@
+#!/usr/bin/env python2.7
+
+"""
+pcb_drill_estimate.py - simulate G-code to estimate how long a job will take on the machine
+"""
+
+import argparse
+import math
+import re
+
+# Letter/number words such as G1, X-.5, F3000
+_WORD = re.compile(r'([A-Z])\s*([-+]?(?:\d+\.?\d*|\.\d+))')
+# Parsed lines kept around; drill jobs repeat the same plunge/retract lines over and over
+_PARSE_CACHE_SIZE = 4096
+_MISSING = object()
+MM_PER_INCH = 25.4
+
+
+class MachineLimits(object):
+    """ Axis limits of the drill (a modified Prusa i3) """
+
+    def __init__(self, max_feed_xy=12000.0, max_feed_z=300.0, acceleration_xy=1000.0,
+                 acceleration_z=100.0, homing_feed_xy=3000.0, homing_feed_z=180.0):
+        """ Machine limits
+        Arguments:
+            max_feed_xy, max_feed_z - fastest feed per axis in mm/min (also used for G0)
+            acceleration_xy, acceleration_z - acceleration per axis in mm/s^2
+            homing_feed_xy, homing_feed_z - feed used by G28 in mm/min
+        """
+        self.max_feed_xy = float(max_feed_xy)
+        self.max_feed_z = float(max_feed_z)
+        self.acceleration_xy = float(acceleration_xy)
+        self.acceleration_z = float(acceleration_z)
+        self.homing_feed_xy = float(homing_feed_xy)
+        self.homing_feed_z = float(homing_feed_z)
+
+
+class GCodeSimulator(object):
+    """ Follow a G-code program move by move (G0/G1/G4/G20/G21/G28/G90/G91, F words, M0/M1/M42
+        and G80/G81/G83/G98/G99 canned cycles) and add up the time each move takes with a
+        trapezoidal velocity profile.
+        Every move starts and ends at rest, which is what a drill job does anyway.
+        A hole is a canned cycle hole or a move down through Z0, the surface of the board."""
+
+    def __init__(self, limits=None):
+        self._limits = limits if limits is not None else MachineLimits()
+        self._cache = {}
+        self.reset()
+
+    def reset(self):
+        self.position = [0.0, 0.0, 0.0]
+        self.absolute = True
+        self.scale = 1.0
+        self.feed = 3000.0
+        self.motion = 1
+        # (depth, R plane, peck) of the active canned cycle
+        self.canned = None
+        self.canned_initial_z = 0.0
+        self.canned_return_initial = True
+        self.spindle_on = False
+        self.time = 0.0
+        self.xy_travel = 0.0
+        self.z_travel = 0.0
+        self.moves = 0
+        self.pauses = 0
+        self.lines = 0
+        self.holes = 0
+        # (min x, min y, max x, max y) of the holes
+        self.bounds = None
+
+    def _parse(self, line):
+        """ Turn a line into (motion, x, y, z, feed, extra) where each is None when the line
+            does not set it and extra holds the rarer words as (g_codes, m_codes, axes, parameters).
+            Returns None for lines without any code (comments, blank lines)"""
+        code = line.split(";", 1)[0].split("*", 1)[0]
+        if "(" in code:
+            code = re.sub(r'\([^)]*\)', '', code)
+        code = code.upper()
+        try:
+            # Quick path for the usual space separated words
+            words = [(word[0], float(word[1:])) for word in code.split()]
+        except ValueError:
+            words = [(letter, float(value)) for letter, value in _WORD.findall(code)]
+        motion = feed = None
+        g_codes = []
+        m_codes = []
+        axes = {}
+        parameters = {}
+        for letter, value in words:
+            if letter == "G":
+                if value in (0, 1):
+                    motion = int(value)
+                else:
+                    g_codes.append(value)
+            elif letter == "M":
+                m_codes.append(value)
+            elif letter in "XYZ":
+                axes[letter] = value
+            elif letter == "F":
+                feed = value
+            elif letter != "N":
+                parameters[letter] = value
+        if motion is None and feed is None and not (g_codes or m_codes or axes or parameters):
+            return None
+        extra = None
+        if g_codes or m_codes:
+            extra = (g_codes, m_codes, axes, parameters)
+            if 28 in g_codes:
+                # G28 axis words name the axes to home, they are not a move
+                axes = {}
+        return (motion, axes.get("X"), axes.get("Y"), axes.get("Z"), feed, extra)
+
+    def run(self, lines):
+        """ Simulate lines (a string, list of lines or an open file) and return the estimate"""
+        if isinstance(lines, basestring):
+            lines = lines.splitlines()
+        cache = self._cache
+        parse = self._parse
+        limits = self._limits
+        max_speed_xy = limits.max_feed_xy / 60.0
+        max_speed_z = limits.max_feed_z / 60.0
+        acceleration_xy = limits.acceleration_xy
+        acceleration_z = limits.acceleration_z
+        rapid_feed = max(limits.max_feed_xy, limits.max_feed_z)
+        sqrt = math.sqrt
+        # The loop works on locals, _execute_extra works on the attributes
+        x, y, z = self.position
+        absolute, scale, feed, motion = self.absolute, self.scale, self.feed, self.motion
+        time, xy_travel, z_travel, moves, count = self.time, self.xy_travel, self.z_travel, self.moves, self.lines
+        canned = self.canned
+        for line in lines:
+            count += 1
+            if line[:1] == ";":
+                continue
+            if line[:1] == "N":
+                # Line numbers make every line unique, drop them so the cache works
+                line = line.partition(" ")[2]
+            command = cache.get(line, _MISSING)
+            if command is _MISSING:
+                command = parse(line)
+                # XY moves are nearly always unique, everything else repeats
+                if (command is None or (command[1] is None and command[2] is None)) and \
+                        len(cache) < _PARSE_CACHE_SIZE:
+                    cache[line] = command
+            if command is None:
+                continue
+            line_motion, line_x, line_y, line_z, line_feed, extra = command
+            if extra is not None:
+                self.position = [x, y, z]
+                self.absolute, self.scale, self.feed, self.motion = absolute, scale, feed, motion
+                self.time, self.xy_travel, self.z_travel, self.moves = time, xy_travel, z_travel, moves
+                self._execute_extra(extra)
+                x, y, z = self.position
+                absolute, scale, feed, motion = self.absolute, self.scale, self.feed, self.motion
+                time, xy_travel, z_travel, moves = self.time, self.xy_travel, self.z_travel, self.moves
+                canned = self.canned
+            if line_feed is not None:
+                feed = line_feed * scale
+            if line_motion is not None:
+                # G0/G1 end a canned cycle
+                motion = line_motion
+                canned = self.canned = None
+            if line_x is None and line_y is None and line_z is None:
+                continue
+            if canned is not None:
+                if line_x is None and line_y is None:
+                    continue
+                self.position = [x, y, z]
+                self.feed = feed
+                self.time, self.xy_travel, self.z_travel, self.moves = time, xy_travel, z_travel, moves
+                self._canned_hole(line_x, line_y)
+                x, y, z = self.position
+                time, xy_travel, z_travel, moves = self.time, self.xy_travel, self.z_travel, self.moves
+                continue
+            # Plain G0/G1 move
+            if absolute:
+                dx = line_x * scale - x if line_x is not None else 0.0
+                dy = line_y * scale - y if line_y is not None else 0.0
+                dz = line_z * scale - z if line_z is not None else 0.0
+            else:
+                dx = line_x * scale if line_x is not None else 0.0
+                dy = line_y * scale if line_y is not None else 0.0
+                dz = line_z * scale if line_z is not None else 0.0
+            x += dx
+            y += dy
+            z += dz
+            moves += 1
+            if dz < 0 and z < 0 <= z - dz:
+                self._hole(x, y)
+            xy = sqrt(dx * dx + dy * dy)
+            xy_travel += xy
+            z_travel += abs(dz)
+            distance = sqrt(xy * xy + dz * dz)
+            if distance == 0:
+                continue
+            # Same as move_time, inlined as this is the hot path
+            speed = (rapid_feed if motion == 0 else feed) / 60.0
+            if speed <= 0:
+                continue
+            if dz == 0:
+                # The axis moving furthest is the one that limits an XY move
+                ratio = distance / max(abs(dx), abs(dy))
+                if speed > max_speed_xy * ratio:
+                    speed = max_speed_xy * ratio
+                acceleration = acceleration_xy * ratio
+            elif xy == 0:
+                if speed > max_speed_z:
+                    speed = max_speed_z
+                acceleration = acceleration_z
+            else:
+                acceleration = float("inf")
+                for delta, max_speed, max_acceleration in ((dx, max_speed_xy, acceleration_xy),
+                                                           (dy, max_speed_xy, acceleration_xy),
+                                                           (dz, max_speed_z, acceleration_z)):
+                    if delta != 0:
+                        share = abs(delta) / distance
+                        speed = min(speed, max_speed / share)
+                        acceleration = min(acceleration, max_acceleration / share)
+            if distance >= speed * speed / acceleration:
+                time += distance / speed + speed / acceleration
+            else:
+                time += 2.0 * sqrt(distance / acceleration)
+        self.position = [x, y, z]
+        self.absolute, self.scale, self.feed, self.motion = absolute, scale, feed, motion
+        self.time, self.xy_travel, self.z_travel, self.moves, self.lines = time, xy_travel, z_travel, moves, count
+        return self.estimate()
+
+    def execute(self, line):
+        """ Simulate one line of G-code """
+        self.run([line])
+
+    def _execute_extra(self, extra):
+        """ G4/G20/G21/G28/G90/G91 and M words """
+        g_codes, m_codes, axes, parameters = extra
+        for m_code in m_codes:
+            if m_code in (0, 1):
+                self.pauses += 1
+            elif m_code == 42:
+                self.spindle_on = parameters.get("S", 0) > 0
+        for g_code in g_codes:
+            if g_code == 4:
+                self.time += parameters.get("P", 0) / 1000.0 + parameters.get("S", 0)
+            elif g_code == 20:
+                self.scale = MM_PER_INCH
+            elif g_code == 21:
+                self.scale = 1.0
+            elif g_code == 28:
+                self._home(axes)
+            elif g_code == 80:
+                self.canned = None
+            elif g_code in (81, 83):
+                previous = self.canned or (None, None, None)
+                depth = axes["Z"] * self.scale if "Z" in axes else previous[0]
+                r_plane = parameters["R"] * self.scale if "R" in parameters else previous[1]
+                peck = parameters["Q"] * self.scale if g_code == 83 and "Q" in parameters else None
+                if depth is None or r_plane is None:
+                    raise ValueError("G{0:g} needs Z and R words".format(g_code))
+                if self.canned is None:
+                    self.canned_initial_z = self.position[2]
+                self.canned = (depth, r_plane, peck)
+            elif g_code == 98:
+                self.canned_return_initial = True
+            elif g_code == 99:
+                self.canned_return_initial = False
+            elif g_code == 90:
+                self.absolute = True
+            elif g_code == 91:
+                self.absolute = False
+
+    def _home(self, axes):
+        """ G28 - the named axes (or all of them) go back to 0 at homing speed"""
+        limits = self._limits
+        target = list(self.position)
+        for index, letter in enumerate("XYZ"):
+            if not axes or letter in axes:
+                target[index] = 0.0
+        feed = limits.homing_feed_xy if target[2] == self.position[2] else limits.homing_feed_z
+        self._move(target[0] - self.position[0], target[1] - self.position[1], target[2] - self.position[2], feed)
+
+    def _move(self, dx, dy, dz, feed):
+        """ Account for one straight move """
+        if dx == 0 and dy == 0 and dz == 0:
+            return
+        self.position = [self.position[0] + dx, self.position[1] + dy, self.position[2] + dz]
+        self.moves += 1
+        self.xy_travel += math.hypot(dx, dy)
+        self.z_travel += abs(dz)
+        self.time += self.move_time(dx, dy, dz, feed)
+
+    def _hole(self, x, y):
+        self.holes += 1
+        if self.bounds is None:
+            self.bounds = (x, y, x, y)
+        else:
+            self.bounds = (min(self.bounds[0], x), min(self.bounds[1], y),
+                           max(self.bounds[2], x), max(self.bounds[3], y))
+
+    def _canned_hole(self, x, y):
+        """ One hole of the active G81/G83 cycle at x, y (either may be None).
+            Z and R are always taken as absolute."""
+        depth, r_plane, peck = self.canned
+        rapid = max(self._limits.max_feed_xy, self._limits.max_feed_z)
+        position = self.position
+        if self.absolute:
+            x = position[0] if x is None else x * self.scale
+            y = position[1] if y is None else y * self.scale
+        else:
+            x = position[0] + (x or 0.0) * self.scale
+            y = position[1] + (y or 0.0) * self.scale
+        if position[2] < r_plane:
+            self._move(0.0, 0.0, r_plane - position[2], rapid)
+        self._move(x - self.position[0], y - self.position[1], 0.0, rapid)
+        self._hole(x, y)
+        self._move(0.0, 0.0, r_plane - self.position[2], rapid)
+        if peck:
+            reached = r_plane
+            while reached > depth:
+                # Back down to the last depth, feed one peck deeper and clear the chips
+                target = max(depth, reached - peck)
+                self._move(0.0, 0.0, reached - self.position[2], rapid)
+                self._move(0.0, 0.0, target - reached, self.feed)
+                self._move(0.0, 0.0, r_plane - target, rapid)
+                reached = target
+        else:
+            self._move(0.0, 0.0, depth - r_plane, self.feed)
+        retract_to = self.canned_initial_z if self.canned_return_initial else r_plane
+        self._move(0.0, 0.0, retract_to - self.position[2], rapid)
+
+    def move_time(self, dx, dy, dz, feed):
+        """ Seconds for a move that starts and stops at rest
+        Arguments:
+            dx, dy, dz - move in mm
+            feed - requested feed in mm/min
+        """
+        distance = math.sqrt(dx * dx + dy * dy + dz * dz)
+        if distance == 0 or feed <= 0:
+            return 0.0
+        limits = self._limits
+        speed = feed / 60.0
+        acceleration = float("inf")
+        # Each axis limits the move in proportion to its share of the distance
+        for delta, max_feed, max_acceleration in ((dx, limits.max_feed_xy, limits.acceleration_xy),
+                                                  (dy, limits.max_feed_xy, limits.acceleration_xy),
+                                                  (dz, limits.max_feed_z, limits.acceleration_z)):
+            if delta != 0:
+                share = abs(delta) / distance
+                speed = min(speed, max_feed / 60.0 / share)
+                acceleration = min(acceleration, max_acceleration / share)
+        if distance >= speed * speed / acceleration:
+            # Trapezoid: accelerate, cruise, decelerate
+            return distance / speed + speed / acceleration
+        # Triangle: never reaches the requested speed
+        return 2.0 * math.sqrt(distance / acceleration)
+
+    def estimate(self):
+        """ Totals so far as a dict (time in seconds, travel in mm) """
+        return {'time': self.time, 'xy_travel': self.xy_travel, 'z_travel': self.z_travel,
+                'moves': self.moves, 'pauses': self.pauses, 'lines': self.lines, 'holes': self.holes,
+                'bounds': self.bounds}
+
+
+def estimate(lines, limits=None):
+    """ Estimate a G-code program (a string, list of lines or an open file)
+        Returns a dict with time (seconds), xy_travel, z_travel (mm), moves, pauses, lines, holes and
+        bounds (min x, min y, max x, max y of the holes, None without holes)"""
+    return GCodeSimulator(limits).run(lines)
+
+
+def format_duration(seconds):
+    """ e.g. 1h 02m 03s """
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return "{0}h {1:02}m {2:02}s".format(hours, minutes, seconds)
+    if minutes:
+        return "{0}m {1:02}s".format(minutes, seconds)
+    return "{0}s".format(seconds)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estimate how long G-code takes to run")
+    parser.add_argument('filename', nargs='+', help="G-code file(s)")
+    args = parser.parse_args()
+    for filename in args.filename:
+        with open(filename) as gcode_file:
+            result = estimate(gcode_file)
+        print "{0}: {1} ({2} moves, {3:.1f} mm XY, {4:.1f} mm Z, {5} pauses)".format(
+            filename, format_duration(result['time']), result['moves'], result['xy_travel'],
+            result['z_travel'], result['pauses'])
@@ -0,0 +1,287 @@
+#!/usr/bin/env python2.7
+
+"""
+pcb_drill_excellon.py - read holes straight from Excellon or Gerber X2 drill files instead of a solder mask image
+"""
+
+import argparse
+import math
+import re
+
+from pcb_drill_tools import DrillTool, ToolTable
+
+MM_PER_INCH = 25.4
+# Spacing of the holes drilled along a slot as a fraction of the tool diameter
+DEFAULT_SLOT_STEP = 0.5
+
+# Excellon tool definition, e.g. T1C0.800 or T01F00S00C0.0315
+_EXCELLON_TOOL = re.compile(r'^T(\d+)(?:[A-BD-Z][-+]?[\d.]*)*C([\d.]+)')
+_EXCELLON_XY = re.compile(r'X([-+]?[\d.]+)|Y([-+]?[\d.]+)')
+# Gerber words end with * and extended commands are wrapped in %
+_GERBER_BLOCK = re.compile(r'%([^%]*)%|([^*%]*)\*')
+_GERBER_FORMAT = re.compile(r'^FS([LT])([AI])X(\d)(\d)Y(\d)(\d)')
+_GERBER_APERTURE = re.compile(r'^ADD(\d+)C,([\d.]+)')
+_GERBER_OPERATION = re.compile(r'^(?:G0?([123]))?(?:X([-+]?\d+))?(?:Y([-+]?\d+))?(?:D0?([123]))?$')
+
+
+class DrillFile(object):
+    """ Holes and slots read from a drill file, always in mm """
+
+    def __init__(self):
+        # Tool number -> diameter
+        self.tools = {}
+        # (x, y, diameter)
+        self.holes = []
+        # (x1, y1, x2, y2, diameter)
+        self.slots = []
+
+    def drill_holes(self, slot_step=DEFAULT_SLOT_STEP):
+        """ Holes for PcbDrillGCode.drill_holes(): every hole plus a row of holes along each slot
+        Arguments:
+            slot_step - distance between slot holes as a fraction of the tool diameter
+        """
+        holes = list(self.holes)
+        for slot in self.slots:
+            holes.extend(slot_holes(slot, slot_step))
+        return holes
+
+    def tool_table(self):
+        """ A ToolTable with the file's tools (None if it defines none) """
+        if len(self.tools) == 0:
+            return None
+        return ToolTable([DrillTool(number, diameter) for number, diameter in self.tools.iteritems()])
+
+
+def slot_holes(slot, slot_step=DEFAULT_SLOT_STEP):
+    """ Evenly spaced (x, y, diameter) holes covering slot (x1, y1, x2, y2, diameter) end to end """
+    x1, y1, x2, y2, diameter = slot
+    length = math.hypot(x2 - x1, y2 - y1)
+    step = diameter * slot_step
+    count = int(math.ceil(length / step)) if step > 0 else 0
+    if count == 0:
+        return [(x1, y1, diameter)]
+    return [(x1 + (x2 - x1) * index / count, y1 + (y2 - y1) * index / count, diameter)
+            for index in xrange(count + 1)]
+
+
+def _parse_number(text, integer_digits, decimal_digits, omitted):
+    """ Coordinate text to a number
+    Arguments:
+        integer_digits, decimal_digits - the file's coordinate format for numbers without a '.'
+        omitted - 'leading' or 'trailing', the zeros the file leaves out
+    """
+    if "." in text:
+        return float(text)
+    if omitted == "leading":
+        return int(text) / float(10 ** decimal_digits)
+    digits = text.lstrip("+-")
+    value = int(digits) / float(10 ** (len(digits) - integer_digits))
+    return -value if text.startswith("-") else value
+
+
+def parse_excellon(text):
+    """ Parse an Excellon drill file (a string or list of lines) into a DrillFile.
+        Handles METRIC/INCH (and M71/M72), LZ/TZ and the KiCad/Altium format comments,
+        G90/G91, G85 slots and routed slots (G00 ... M15 G01 ... M16)."""
+    if isinstance(text, basestring):
+        text = text.splitlines()
+    drill_file = DrillFile()
+    scale = MM_PER_INCH
+    integer_digits, decimal_digits = 2, 4
+    format_given = False
+    # TZ (trailing zeros kept) unless the file says otherwise
+    omitted = "leading"
+    absolute = True
+    diameter = None
+    x = y = 0.0
+    route_down = False
+    route_mode = False
+    holes = drill_file.holes
+    slots = drill_file.slots
+    match_xy = _EXCELLON_XY.findall
+
+    def coordinates(line, x, y):
+        for x_text, y_text in match_xy(line):
+            if x_text:
+                value = _parse_number(x_text, integer_digits, decimal_digits, omitted) * scale
+                x = value if absolute else x + value
+            else:
+                value = _parse_number(y_text, integer_digits, decimal_digits, omitted) * scale
+                y = value if absolute else y + value
+        return x, y
+
+    for line in text:
+        line = line.strip()
+        if not line:
+            continue
+        first = line[0]
+        if first == "X" or first == "Y":
+            # The hot path: plain drill hits
+            if "G85" in line:
+                begin, _, end = line.partition("G85")
+                x1, y1 = coordinates(begin, x, y)
+                x, y = coordinates(end, x1, y1)
+                slots.append((x1, y1, x, y, diameter))
+                continue
+            if route_down:
+                x2, y2 = coordinates(line, x, y)
+                slots.append((x, y, x2, y2, diameter))
+                x, y = x2, y2
+                continue
+            x, y = coordinates(line, x, y)
+            if not route_mode:
+                holes.append((x, y, diameter))
+            continue
+        upper = line.upper()
+        if first == ";":
+            if not format_given:
+                # ;FILE_FORMAT=4:4 (KiCad) or ;FORMAT={2:4/ absolute / inch / keep zeros} (Altium)
+                match = re.match(r';\s*(?:FILE_)?FORMAT\s*=\s*\{?\s*(\d+):(\d+)', upper)
+                if match is not None:
+                    integer_digits, decimal_digits = int(match.group(1)), int(match.group(2))
+                    format_given = True
+            continue
+        if first == "T" and upper[1:2].isdigit():
+            match = _EXCELLON_TOOL.match(upper)
+            number = int(re.match(r'T(\d+)', upper).group(1))
+            if match is not None:
+                # A definition also selects the tool (some files define tools in the body)
+                drill_file.tools[number] = float(match.group(2)) * scale
+            diameter = drill_file.tools.get(number)
+            if number != 0 and diameter is None:
+                raise ValueError("Tool T{0} is used before it is defined".format(number))
+            continue
+        if upper.startswith("METRIC") or upper.startswith("INCH") or upper in ("M71", "M72"):
+            metric = upper.startswith("METRIC") or upper == "M71"
+            scale = 1.0 if metric else MM_PER_INCH
+            if not format_given:
+                integer_digits, decimal_digits = (3, 3) if metric else (2, 4)
+            fields = upper.split(",")
+            if "LZ" in fields:
+                omitted = "trailing"
+            elif "TZ" in fields:
+                omitted = "leading"
+            for field in fields[1:]:
+                if "." in field and field.replace("0", "").replace(".", "") == "":
+                    # A template such as 000.000 gives the digits
+                    integer_digits, decimal_digits = [len(part) for part in field.split(".")]
+                    format_given = True
+            continue
+        if upper.startswith("G90"):
+            absolute = True
+        elif upper.startswith("G91"):
+            absolute = False
+        elif upper.startswith("G00"):
+            route_mode = True
+            route_down = False
+            x, y = coordinates(line[3:], x, y)
+        elif upper.startswith("G05") or upper.startswith("G81"):
+            route_mode = route_down = False
+        elif upper.startswith("M15"):
+            route_down = True
+        elif upper.startswith("M16") or upper.startswith("M17"):
+            route_down = False
+        elif upper.startswith("G01") and route_mode:
+            x2, y2 = coordinates(line[3:], x, y)
+            if route_down:
+                slots.append((x, y, x2, y2, diameter))
+            x, y = x2, y2
+        elif upper in ("M30", "M00"):
+            break
+    return drill_file
+
+
+def parse_gerber_drill(text):
+    """ Parse a Gerber X2 drill layer into a DrillFile: D03 flashes of circular apertures
+        are holes and D01 draws are slots"""
+    if not isinstance(text, basestring):
+        text = "".join(text)
+    drill_file = DrillFile()
+    scale = 1.0
+    integer_digits, decimal_digits, omitted, absolute = 3, 6, "leading", True
+    diameter = None
+    x = y = 0.0
+    operation = "2"
+    circular = False
+    for match in _GERBER_BLOCK.finditer(text):
+        extended, word = match.groups()
+        if extended is not None:
+            for command in extended.split("*"):
+                command = command.strip()
+                if command.startswith("MO"):
+                    scale = MM_PER_INCH if command == "MOIN" else 1.0
+                elif command.startswith("FS"):
+                    fields = _GERBER_FORMAT.match(command)
+                    if fields is None:
+                        raise ValueError("Unsupported format {0!r}".format(command))
+                    omitted = "leading" if fields.group(1) == "L" else "trailing"
+                    absolute = fields.group(2) == "A"
+                    integer_digits, decimal_digits = int(fields.group(3)), int(fields.group(4))
+                elif command.startswith("ADD"):
+                    aperture = _GERBER_APERTURE.match(command)
+                    if aperture is None:
+                        raise ValueError("Only circular drill apertures are supported, not {0!r}".format(command))
+                    drill_file.tools[int(aperture.group(1))] = float(aperture.group(2)) * scale
+            continue
+        word = word.strip()
+        if not word or word.startswith("G04"):
+            continue
+        if word.startswith("G54"):
+            word = word[3:]
+        if word.startswith("D") and int(word[1:]) >= 10:
+            diameter = drill_file.tools.get(int(word[1:]))
+            if diameter is None:
+                raise ValueError("Aperture {0} is used before it is defined".format(word))
+            continue
+        if word == "M02":
+            break
+        fields = _GERBER_OPERATION.match(word)
+        if fields is None:
+            continue
+        interpolation, x_text, y_text, code = fields.groups()
+        if interpolation is not None:
+            circular = interpolation != "1"
+        if x_text is None and y_text is None and code is None:
+            continue
+        new_x, new_y = x, y
+        if x_text is not None:
+            value = _parse_number(x_text, integer_digits, decimal_digits, omitted) * scale
+            new_x = value if absolute else x + value
+        if y_text is not None:
+            value = _parse_number(y_text, integer_digits, decimal_digits, omitted) * scale
+            new_y = value if absolute else y + value
+        if code is not None:
+            operation = code
+        if operation == "3":
+            drill_file.holes.append((new_x, new_y, diameter))
+        elif operation == "1":
+            if circular:
+                raise ValueError("Circular routed slots are not supported")
+            drill_file.slots.append((x, y, new_x, new_y, diameter))
+        x, y = new_x, new_y
+    return drill_file
+
+
+def read_drill_file(text):
+    """ Parse Excellon or Gerber X2 drill text, whichever it is """
+    if isinstance(text, basestring):
+        sample = text[:4096]
+    else:
+        text = list(text)
+        sample = "".join(text[:64])
+    if "%FS" in sample or "%MO" in sample or "%TF" in sample:
+        return parse_gerber_drill(text)
+    return parse_excellon(text)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List the holes in Excellon or Gerber X2 drill files")
+    parser.add_argument('filename', nargs='+', help="drill file(s)")
+    args = parser.parse_args()
+    for filename in args.filename:
+        with open(filename) as drill:
+            drill_file = read_drill_file(drill.read())
+        print "{0}: {1} holes, {2} slots, tools {3}".format(
+            filename, len(drill_file.holes), len(drill_file.slots),
+            ", ".join("T{0} {1:g}mm".format(number, diameter)
+                      for number, diameter in sorted(drill_file.tools.iteritems())))
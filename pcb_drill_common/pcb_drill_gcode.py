@@ -1,24 +1,60 @@
 #!/usr/bin/env python2.7
 
 import argparse
+import math
 import StringIO
 
+try:
+    import numpy
+except ImportError:
+    # Bulk formatting of hole arrays is optional
+    numpy = None
+
+from pcb_drill_path import HoleOrdering, get_hole_ordering, travel_distance, array_travel_distance
+from pcb_drill_tools import ToolTable
+from pcb_drill_cycles import get_drill_cycle
+from pcb_drill_compact import COMPACT_PRECISION, GCodeCompactor
+
 # TODO read default prefix and postfix from a file
 
 CALIBRATE_HOLES = ((0.0, 0.0), (30.0, 0.0), (0.0, 20.0))
 
+# Program sections yielded by PcbDrillGCode._iter_sections
+_PREFIX, _BODY, _POSTFIX = range(3)
+
+# Holes rendered at once by the bulk (numpy array) path
+BULK_CHUNK_SIZE = 8192
+# Marks a value slot (h = hole number, x, y, n = line number) while building the bulk template
+_SLOT = "\x00{0}\x00"
+
 
 class PcbDrillGCode(object):
     """ Generate G-Code for Drilling
         Thanks to Mike Smith who wrote the original gcode """
 
-    def __init__(self, prefix="", postfix="", line_numbers=True, verbose_comments=True):
+    def __init__(self, prefix="", postfix="", line_numbers=True, verbose_comments=True,
+                 hole_ordering=None, coordinate_precision=None, tool_table=None, drill_cycle=None,
+                 compact=False, checksums=False):
         """ G Code Generator
         Arguments:
             prefix - one line per gcode - prefix gcode
             postfix - one line per gcode - postfix gcode
             line_numbers - include N000 line numbers (defaults True)
             verbose_commands (defaults True) - prints additional info
+            hole_ordering - None (drill in the given order), a name from
+                pcb_drill_path.HOLE_ORDERINGS or a callable(holes, start)
+            coordinate_precision - digits after the decimal point for XY coordinates
+                (defaults None which prints them with str()). Needed for the bulk path that
+                renders numpy N x 2 hole arrays in batches.
+            tool_table - ToolTable (or list of DrillTool) for jobs drilled with several bits.
+                Holes given as (x, y, diameter) are grouped onto the closest tool and
+                each tool gets its own section starting with a tool change pause.
+            drill_cycle - None (plunge and retract all the way after every hole), a name from
+                pcb_drill_cycles.DRILL_CYCLES or a DrillCycle. The clearance and canned cycles only
+                lift the drill a little between nearby holes.
+            compact - strip the output for streaming over serial: no comments or line numbers,
+                coordinate_precision (default 3) digits and no repeated G0/G1 words (see size_reduction)
+            checksums - with compact, number every line and add RepRap checksums
         """
         self._prefix = StringIO.StringIO(prefix)
         self._postfix = StringIO.StringIO(postfix)
@@ -29,6 +65,18 @@ class PcbDrillGCode(object):
         self._holes = []
         self._predrill_locations = []
         self._postdrill_locations = []
+        self._hole_ordering = get_hole_ordering(hole_ordering)
+        self._ordering_start = None
+        self._travel_distance = None
+        self._precision = coordinate_precision
+        if tool_table is not None and not isinstance(tool_table, ToolTable):
+            tool_table = ToolTable(tool_table)
+        self._tool_table = tool_table
+        self._drill_cycle = get_drill_cycle(drill_cycle)
+        self._compact = compact
+        self._checksums = checksums
+        self._size_reduction = None
+        self._current_line_number = 1
         self._prefix_comments = StringIO.StringIO()
         self._postfix_comments = StringIO.StringIO()
 
@@ -80,7 +128,7 @@ class PcbDrillGCode(object):
     
     def comment(self, comment):
         """ User friendly comment; guess if we want before or after drill_holes if we have holes defined"""
-        if len(self._holes) == 0:
+        if not self._has_holes():
             # Assuming that we want a comment before drill holes
             self._comment(self._prefix_comments, comment)
         else:
@@ -90,19 +138,26 @@ class PcbDrillGCode(object):
         """Add a comment ; to the gcode
         Arguments:
             inline_comment - if True then this is an inline comment with detail"""
+        stringio_buffer.write(self._comment_text(comment, inline_comment))
+
+    def _comment_text(self, comment, inline_comment=False):
+        """ The text _comment would write """
         if comment is None or comment == "":
-            return
+            return ""
         if inline_comment:
             # We only suppress inline comments as we consider them extraneous
             if self._verbose_comments:
-                stringio_buffer.write(" ; {0}".format(comment))
+                return " ; {0}".format(comment)
+            return ""
         else:
-            stringio_buffer.write("; {0}\n".format(comment))
+            return "; {0}\n".format(comment)
 
     def _command(self, stringio_buffer, command, comment=""):
-        stringio_buffer.write(command)
-        self._comment(stringio_buffer, comment, inline_comment=True)
-        stringio_buffer.write("\n")
+        stringio_buffer.write(self._command_text(command, comment))
+
+    def _command_text(self, command, comment=""):
+        """ The line _command would write """
+        return command + self._comment_text(comment, inline_comment=True) + "\n"
 
     @property
     def drill_hole_format(self):
@@ -115,104 +170,449 @@ class PcbDrillGCode(object):
     def drill_hole_format(self):
         raise AttributeError("drill_hole_format cannot be deleted")
     
+    @property
+    def hole_ordering(self):
+        return self._hole_ordering
+    @hole_ordering.setter
+    def hole_ordering(self, value):
+        """ None, a name from pcb_drill_path.HOLE_ORDERINGS or a callable(holes, start)"""
+        self._hole_ordering = get_hole_ordering(value)
+    @hole_ordering.deleter
+    def hole_ordering(self):
+        raise AttributeError("hole_ordering cannot be deleted")
+
+    @property
+    def ordering_start(self):
+        """ Where the head is before the 1st hole. When not set this is the last
+            pre drill location or home (0, 0)"""
+        if self._ordering_start is not None:
+            return self._ordering_start
+        if len(self._predrill_locations) > 0:
+            return tuple(self._predrill_locations[-1])
+        return (0.0, 0.0)
+    @ordering_start.setter
+    def ordering_start(self, value):
+        self._ordering_start = value
+    @ordering_start.deleter
+    def ordering_start(self):
+        raise AttributeError("ordering_start cannot be deleted")
+
+    @property
+    def travel_distance(self):
+        """ (original, ordered) XY travel distance of the holes from the last generated program"""
+        if self._travel_distance is None:
+            raise ValueError("You must call generate before the travel_distance property becomes available")
+        return self._travel_distance
+
+    @property
+    def size_reduction(self):
+        """ (full, compact) size in bytes of the last generated compact program"""
+        if self._size_reduction is None:
+            raise ValueError("size_reduction is only available after generating with compact=True")
+        return self._size_reduction
+
     def drill_holes(self, holes):
+        """ holes - sequence of (x, y) or (x, y, diameter). An iterator also works (and is never
+            copied) when the holes are drilled in the given order with one tool. A numpy N x 2
+            (or N x 3) array is rendered in bulk when coordinate_precision is set.
+            Anything with iter_chunks() (e.g. pcb_drill_panel.Panel) is drilled chunk by chunk."""
         # TODO check type
         self._holes = holes
 
+    def _has_holes(self):
+        try:
+            return len(self._holes) > 0
+        except TypeError:
+            # An iterator of holes, assume it has some
+            return True
+
     def seek_predrill_location(self, location):
         self._predrill_locations.append(location)
 
     def seek_postdrill_location(self, location):
         self._postdrill_locations.append(location)
 
+    def iter_lines(self):
+        """ Lazily yield the gcode one line at a time.
+            Memory use stays flat no matter how many holes there are."""
+        for section, text in self._iter_output():
+            for line in text.splitlines(True):
+                yield line
+
+    def write_to(self, fileobj):
+        """ Stream the gcode into fileobj (anything with a write method, e.g. a file or socket.makefile())
+            Returns the number of bytes written"""
+        size = 0
+        for section, text in self._iter_output():
+            fileobj.write(text)
+            size += len(text)
+        return size
+
     def generate(self):
         gcode = StringIO.StringIO()
-        self._current_line_number = 1
-
-        prefix_location = self._prefix.tell()
-        postfix_location = self._postfix.tell()
         gcode_begin_body = None
         gcode_end_body = None
 
-        self._prefix.seek(0)
-        self._postfix.seek(0)
+        for section, text in self._iter_output():
+            if section == _BODY and gcode_begin_body is None:
+                gcode_begin_body = gcode.tell()
+            elif section == _POSTFIX and gcode_end_body is None:
+                gcode_end_body = gcode.tell()
+            gcode.write(text)
 
-        def write_line_number():
-            """write N001 style line numbers on gcode commands"""
-            if self._line_numbers:
-                gcode.write("N{0:03} ".format(self._current_line_number))
-                self._current_line_number += 1
-        def write_area(stringio_area):
-            """ Write an area such as prefix, postfix, etc."""
-            for line in stringio_area.readlines():
+        # Now grab the body section and save for the body property
+        gcode = gcode.getvalue()
+        if gcode_begin_body is None:
+            gcode_begin_body = gcode_end_body
+        if gcode_end_body is None:
+            gcode_end_body = len(gcode)
+        self._body = gcode[gcode_begin_body:gcode_end_body]
+
+        return gcode
+
+    def _iter_output(self):
+        """ _iter_sections, compacted when asked for """
+        if not self._compact:
+            for section, text in self._iter_sections():
+                yield section, text
+            return
+        precision = self._precision if self._precision is not None else COMPACT_PRECISION
+        compactor = GCodeCompactor(precision, self._checksums)
+        for section, text in self._iter_sections():
+            text = compactor.feed(text)
+            if text:
+                yield section, text
+        self._size_reduction = (compactor.bytes_in, compactor.bytes_out)
+
+    def _iter_sections(self):
+        """ Yield (section, text) for the whole program where section is _PREFIX, _BODY or _POSTFIX.
+            text is one or more complete lines"""
+        self._current_line_number = 1
+        line_number = self._line_number
+
+        def area_lines(stringio_area):
+            """ Lines of an area such as prefix, postfix, etc."""
+            for line in stringio_area.getvalue().splitlines(True):
                 if line != "%\n" and not line.startswith(";"):
-                    write_line_number()
-                gcode.write(line)
-        
-        write_area(self._prefix)
+                    line = line_number() + line
+                yield line
 
-        gcode_begin_body = gcode.tell()
+        for line in area_lines(self._prefix):
+            yield _PREFIX, line
 
-        write_area(self._prefix_comments)
+        for line in area_lines(self._prefix_comments):
+            yield _BODY, line
 
         for location in self._predrill_locations:
-            write_line_number()
-            self._command(gcode, self._format.format(*location), "Seek pre drill XY location")
-            
-        for index, hole in enumerate(self._holes):
-            hole_number = index + 1
-            self._comment(gcode, "--- Begin Hole # {0} at position X {1} and Y {2}".format(hole_number, hole[0], hole[1]),
-                        inline_comment=False)
-            write_line_number()
-            self._command(gcode, self._format.format(*hole), "Drill hole location")
-            write_line_number()
-            self._command(gcode, "G1 Z-.5 F100", "Drill hole")
-            write_line_number()
-            self._command(gcode, "G1 Z3.0 F3000", "Retract drill to safe position")
-            self._comment(gcode, "--- End Hole # {0}".format(hole_number,inline_comment=False))
-        if len(self._holes) == 0:
-            self._comment(gcode, "No Drill holes defined", inline_comment=False)
+            yield _BODY, line_number() + self._command_text(self._location_text(location), "Seek pre drill XY location")
+
+        start = self.ordering_start
+        holes = self._holes
+        if numpy is not None and isinstance(holes, numpy.ndarray) and self._precision is None:
+            # str() of numpy floats differs from python floats so go through the list path
+            holes = holes.tolist()
+        if self._tool_table is None:
+            sections = [(None, holes)]
+        elif hasattr(holes, "tool_sections"):
+            sections = holes.tool_sections(self._tool_table)
+        else:
+            sections = self._tool_table.group(holes)
+        hole_number = 0
+        original_travel = 0.0
+        ordered_travel = 0.0
+        for tool, section_holes in sections:
+            if tool is not None:
+                yield _BODY, self._tool_change_text(tool, len(section_holes), line_number)
+            summary = {}
+            for text in self._iter_hole_section(section_holes, tool, start, hole_number, summary):
+                yield _BODY, text
+            if summary['count'] > 0:
+                for command, comment in self._drill_cycle.end_commands(tool):
+                    yield _BODY, line_number() + self._command_text(command, comment)
+            hole_number += summary['count']
+            original_travel += summary['original_travel']
+            ordered_travel += summary['ordered_travel']
+            start = summary['end']
+        if hole_number == 0:
+            yield _BODY, self._comment_text("No Drill holes defined")
+        self._travel_distance = (original_travel, ordered_travel)
 
         for location in self._postdrill_locations:
-            write_line_number()
-            self._command(gcode, self._format.format(*location), "Seek post drill XY location")
-
-        write_area(self._postfix_comments)
-
-        gcode_end_body = gcode.tell()
-        write_area(self._postfix)
-
-        self._prefix.seek(prefix_location)
-        self._postfix.seek(postfix_location)
-
-        # Now grab the body section and save for the body property
-        gcode.seek(gcode_begin_body)
-        self._body = gcode.read(gcode_end_body - gcode_begin_body)
-        
-        return gcode.getvalue()
-
-
-def calibrate_printer(**kwargs):
-    """ Generate gcode to calibrate the "printer" """
+            yield _BODY, line_number() + self._command_text(self._location_text(location), "Seek post drill XY location")
+
+        for line in area_lines(self._postfix_comments):
+            yield _BODY, line
+
+        for line in area_lines(self._postfix):
+            yield _POSTFIX, line
+
+    def _line_number(self):
+        """N001 style line numbers on gcode commands"""
+        if self._line_numbers:
+            number = self._current_line_number
+            self._current_line_number += 1
+            return "N{0:03} ".format(number)
+        return ""
+
+    def _iter_hole_section(self, holes, tool, start, first_hole_number, summary):
+        """ Yield the gcode drilling holes with one tool (None for the single tool job).
+            Once exhausted summary holds the hole count, original and ordered travel and
+            the last location drilled"""
+        if hasattr(holes, "iter_chunks"):
+            for text in self._iter_chunked_section(holes, tool, start, first_hole_number, summary):
+                yield text
+            return
+        line_number = self._line_number
+        bulk = numpy is not None and isinstance(holes, numpy.ndarray)
+        ordering_name = getattr(self._hole_ordering, "name", "custom")
+        if ordering_name == HoleOrdering.name:
+            # Leave holes alone so an iterator of holes is streamed without a copy
+            original_travel = None
+        else:
+            hole_list = holes.tolist() if bulk else list(holes)
+            holes = self._hole_ordering(hole_list, start)
+            original_travel = travel_distance(hole_list, start)
+            if bulk and len(holes) > 0:
+                holes = numpy.array(holes, dtype=float)
+
+        if bulk:
+            count = len(holes)
+            ordered_travel = 0.0
+            end = start
+            if count > 0:
+                for text in self._bulk_hole_text(holes, first_hole_number, tool):
+                    yield text
+                ordered_travel = array_travel_distance(holes, start)
+                end = (holes[-1, 0], holes[-1, 1])
+        else:
+            count = 0
+            ordered_travel = 0.0
+            end = start
+            full_retract = self._drill_cycle.full_retract
+            previous = None
+            for hole in holes:
+                count += 1
+                ordered_travel += math.hypot(hole[0] - end[0], hole[1] - end[1])
+                end = hole
+                x, y = self._coordinates(hole)
+                yield self._hole_text(first_hole_number + count, x, y, line_number, tool,
+                                      full_retract(previous, hole))
+                previous = hole
+        if original_travel is None:
+            original_travel = ordered_travel
+        elif count > 0:
+            yield self._ordering_comment(ordering_name, original_travel, ordered_travel)
+        summary.update(count=count, original_travel=original_travel, ordered_travel=ordered_travel, end=end)
+
+    def _iter_chunked_section(self, holes, tool, start, first_hole_number, summary):
+        """ _iter_hole_section for holes that come in numpy chunks (see Panel.iter_chunks).
+            The ordering is applied chunk by chunk so only one chunk is held at a time, which is
+            why both paths comment on the ordering after the holes."""
+        ordering_name = getattr(self._hole_ordering, "name", "custom")
+        ordering = None if ordering_name == HoleOrdering.name else self._hole_ordering
+        bulk = self._precision is not None
+        count = 0
+        ordered_travel = 0.0
+        end = start
+        for chunk in holes.iter_chunks(ordering, start):
+            if len(chunk) == 0:
+                continue
+            previous = end if count > 0 else None
+            if bulk:
+                for text in self._bulk_hole_text(chunk, first_hole_number + count, tool, previous):
+                    yield text
+            else:
+                full_retracts = self._drill_cycle.full_retracts(chunk, previous)
+                for hole_number, (hole, full_retract) in enumerate(zip(chunk.tolist(), full_retracts),
+                                                                   first_hole_number + count + 1):
+                    yield self._hole_text(hole_number, hole[0], hole[1], self._line_number, tool, full_retract)
+            count += len(chunk)
+            ordered_travel += array_travel_distance(chunk, end)
+            end = (chunk[-1, 0], chunk[-1, 1])
+        if ordering is None:
+            original_travel = ordered_travel
+        else:
+            original_travel = holes.travel_distance(start)
+            if count > 0:
+                yield self._ordering_comment(ordering_name, original_travel, ordered_travel)
+        summary.update(count=count, original_travel=original_travel, ordered_travel=ordered_travel, end=end)
+
+    def _ordering_comment(self, ordering_name, original_travel, ordered_travel):
+        """ Comment after a section's holes on how much travel the ordering saved """
+        return self._comment_text("Hole ordering {0}: XY travel {1:.1f} reduced to {2:.1f}".format(
+                                  ordering_name, original_travel, ordered_travel))
+
+    def _tool_change_text(self, tool, count, line_number):
+        """ Pause so the operator can put in the drill bit for tool """
+        return (self._comment_text("--- Tool {0} for {1} holes".format(tool, count)) +
+                line_number() + self._command_text(tool.retract_command, "Retract drill for tool change") +
+                line_number() + self._command_text("M42 P23 S0", "turns the spindle off") +
+                line_number() + self._command_text("M0 Load {0} drill".format(tool), "Pause for tool change") +
+                line_number() + self._command_text("M42 P23 S255", "turns the spindle on"))
+
+    def _coordinates(self, location):
+        """ XY of location, as text when coordinate_precision is set """
+        if self._precision is None:
+            return location[0], location[1]
+        return ("{0:.{1}f}".format(location[0], self._precision),
+                "{0:.{1}f}".format(location[1], self._precision))
+
+    def _location_text(self, location):
+        return self._format.format(*self._coordinates(location))
+
+    def _hole_text(self, hole_number, x, y, line_number, tool=None, full_retract=True):
+        """ The gcode block that drills one hole
+        Arguments:
+            x, y - coordinates (already formatted when coordinate_precision is set)
+            line_number - callable returning the line number prefix for each command
+            tool - DrillTool with the feeds to use (None for the default feeds)
+            full_retract - the move to this hole needs the drill all the way up (see DrillCycle)"""
+        commands = self._drill_cycle.hole_commands(self._format.format(x, y), x, y, tool, full_retract)
+        return (self._comment_text("--- Begin Hole # {0} at position X {1} and Y {2}".format(hole_number, x, y)) +
+                "".join(line_number() + self._command_text(command, comment) for command, comment in commands) +
+                self._comment_text("--- End Hole # {0}".format(hole_number)))
+
+    def _bulk_hole_text(self, holes, first_hole_number=0, tool=None, previous=None):
+        """ Yield the hole blocks for an N x 2 numpy array, BULK_CHUNK_SIZE holes at a time.
+            Numbers are rendered straight into byte arrays and the text is byte for byte
+            what _hole_text produces for the same precision.
+            previous - the hole drilled before holes (None at the start of a section)"""
+        def line_number():
+            if self._line_numbers:
+                return "N" + _SLOT.format("n") + " "
+            return ""
+        # One template for holes after a full retract and one for the rest
+        templates = []
+        for full_retract in (True, False):
+            block = self._hole_text(_SLOT.format("h"), _SLOT.format("x"), _SLOT.format("y"),
+                                    line_number, tool, full_retract)
+            # Splitting on the slot marker alternates literal text and slot names
+            templates.append(block.split("\x00"))
+        single = templates[0] == templates[1]
+        lines_per_hole = [parts[1::2].count("n") for parts in templates]
+        for begin in xrange(0, len(holes), BULK_CHUNK_SIZE):
+            chunk = holes[begin:begin + BULK_CHUNK_SIZE]
+            count = len(chunk)
+            first = first_hole_number + begin + 1
+            fields = {'h': _ascii_digits(numpy.arange(first, first + count), 1),
+                      'x': _ascii_fixed_point(chunk[:, 0], self._precision),
+                      'y': _ascii_fixed_point(chunk[:, 1], self._precision)}
+            if single:
+                lines = numpy.repeat(lines_per_hole[0], count)
+            else:
+                full_retracts = self._drill_cycle.full_retracts(chunk, previous)
+                lines = numpy.where(full_retracts, lines_per_hole[0], lines_per_hole[1])
+            previous = chunk[-1, :2]
+            # Line number of each hole's first command
+            line_numbers = numpy.cumsum(lines) - lines + self._current_line_number
+            if self._line_numbers:
+                self._current_line_number += int(lines.sum())
+            text = _render_rows(templates[0], fields, line_numbers)
+            if not single:
+                short = _render_rows(templates[1], fields, line_numbers)
+                width = max(text.shape[1], short.shape[1])
+                text = numpy.where(full_retracts[:, None], _pad_rows(text, width), _pad_rows(short, width))
+            text = text.ravel()
+            yield text[text != 0].tostring()
+
+
+def _render_rows(parts, fields, line_numbers):
+    """ Fill a bulk template (literal text alternating with slot names) row by row into a
+        (rows, width) uint8 array, 0 bytes are padding"""
+    columns = []
+    for index, part in enumerate(parts):
+        if index % 2 == 0:
+            columns.append(numpy.frombuffer(part, dtype=numpy.uint8))
+        elif part == "n":
+            columns.append(_ascii_digits(line_numbers, 3))
+            line_numbers = line_numbers + 1
+        else:
+            columns.append(fields[part])
+    # Lay the columns side by side (literal text is broadcast down every row)
+    text = numpy.empty((len(line_numbers), sum(column.shape[-1] for column in columns)), dtype=numpy.uint8)
+    offset = 0
+    for column in columns:
+        width = column.shape[-1]
+        text[:, offset:offset + width] = column
+        offset += width
+    return text
+
+
+def _pad_rows(text, width):
+    """ Widen a (rows, columns) uint8 array to width with 0 bytes """
+    if text.shape[1] == width:
+        return text
+    return numpy.hstack([text, numpy.zeros((len(text), width - text.shape[1]), dtype=numpy.uint8)])
+
+
+def _ascii_digits(values, min_digits):
+    """ ASCII digits of non negative integers right aligned in a (len(values), width) uint8 array.
+        Leading zeros beyond min_digits are 0 bytes so they can be squeezed out afterwards
+        (i.e. "%0{min_digits}d")"""
+    largest = int(numpy.max(values))
+    # 32 bit division is noticeably quicker on the Pi and covers any sane hole count
+    dtype = numpy.uint32 if largest < 2 ** 32 else numpy.int64
+    values = numpy.asarray(values, dtype=dtype)[:, None]
+    width = max(min_digits, len(str(largest)))
+    powers = 10 ** numpy.arange(width - 1, -1, -1).astype(dtype)
+    digits = values // powers
+    digits %= 10
+    digits = digits.astype(numpy.uint8)
+    digits += ord("0")
+    if width > min_digits:
+        leading = digits[:, :width - min_digits]
+        leading[values < powers[:width - min_digits]] = 0
+    return digits
+
+def _ascii_fixed_point(values, precision):
+    """ ASCII "%.{precision}f" of floats as a uint8 array laid out like _ascii_digits """
+    magnitude = numpy.abs(values)
+    scale = 10 ** precision
+    scaled = magnitude * scale
+    rounded = numpy.rint(scaled).astype(numpy.int64)
+    # Only values within float noise of a rounding tie could round differently to
+    # python's correctly rounded formatting, so let python format those few
+    ties = numpy.abs(scaled - numpy.floor(scaled) - 0.5) < 1e-9 + scaled * 1e-15
+    for index in numpy.flatnonzero(ties):
+        rounded[index] = int(("%.{0}f".format(precision) % magnitude[index]).replace(".", ""))
+    columns = [numpy.where(numpy.signbit(values), ord("-"), 0).astype(numpy.uint8)[:, None],
+               _ascii_digits(rounded // scale, 1)]
+    if precision > 0:
+        columns.append(numpy.tile(numpy.uint8(ord(".")), (len(values), 1)))
+        columns.append(_ascii_digits(rounded % scale, precision))
+    return numpy.hstack(columns)
+
+
+def _finish(generator, fileobj):
+    """ Stream the gcode into fileobj if one was given, otherwise return it as a string """
+    if fileobj is not None:
+        generator.write_to(fileobj)
+        return None
+    return generator.generate()
+
+def calibrate_printer(fileobj=None, **kwargs):
+    """ Generate gcode to calibrate the "printer" (streamed into fileobj when given) """
     generator = PcbDrillGCode(**kwargs)
     generator.comment("I hope this works")
     generator.drill_holes(CALIBRATE_HOLES)
     generator.comment("That should do it")
-    return generator.generate() 
+    return _finish(generator, fileobj)
 
 def eject_bed(*args, **kwargs):
-    """ Write gcode to eject bed """
+    """ Write gcode to eject bed (streamed into the fileobj keyword argument when given) """
+    fileobj = kwargs.pop('fileobj', None)
     generator = PcbDrillGCode(*args,**kwargs)
     generator.comment("This will eject the bed")
     generator.seek_predrill_location((0, 180))
-    return generator.generate() 
+    return _finish(generator, fileobj)
 
 def retract_bed(*args, **kwargs):
-    """ Write gcode to retract bed """
+    """ Write gcode to retract bed (streamed into the fileobj keyword argument when given) """
+    fileobj = kwargs.pop('fileobj', None)
     generator = PcbDrillGCode(*args, **kwargs)
     generator.comment("This will retract the bed")
     generator.seek_predrill_location((0, 20))
-    return generator.generate() 
+    return _finish(generator, fileobj)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,199 @@
+#!/usr/bin/env python2.7
+
+"""
+pcb_drill_jobs.py - run long commands on a pool of worker threads as jobs with an id, so the daemon
+keeps answering quick commands. Jobs report progress by stage and can be cancelled.
+"""
+
+import threading
+import time
+import traceback
+import uuid
+import Queue
+
+# Finished jobs kept for job_status/job_result, the oldest go first
+DEFAULT_KEEP_FINISHED = 100
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+_current = threading.local()
+
+
+class JobCancelled(Exception):
+    """ Raised inside a job at its next report_progress after job_cancel """
+    pass
+
+
+def report_progress(stage, fraction=None):
+    """ Tell whoever polls the job running in this thread which stage it is in (does nothing outside
+        a job). Raises JobCancelled when the job was cancelled, so long commands stop between stages.
+    Arguments:
+        stage - short description, e.g. "detecting holes"
+        fraction - how far along the whole job is (0.0 - 1.0) if known
+    """
+    job = getattr(_current, 'job', None)
+    if job is None:
+        return
+    if job.cancel_requested:
+        raise JobCancelled("Job {0} was cancelled during {1}".format(job.id, job.stage))
+    job.stage = stage
+    if fraction is not None:
+        job.progress = float(fraction)
+
+
+class Job(object):
+    """ One command run by JobQueue """
+
+    def __init__(self, command, function, kwargs, request_id=None):
+        self.id = uuid.uuid4().hex
+        self.command = command
+        self.request_id = request_id
+        self.state = QUEUED
+        self.stage = None
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.exception = None
+        self.cancel_requested = False
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._function = function
+        self._kwargs = kwargs
+        self._done = threading.Event()
+
+    def run(self):
+        _current.job = self
+        try:
+            if self.cancel_requested:
+                raise JobCancelled("Job {0} was cancelled before it started".format(self.id))
+            self.started = time.time()
+            self.state = RUNNING
+            self.result = self._function(**self._kwargs)
+            self.progress = 1.0
+            self.state = DONE
+        except JobCancelled as error:
+            self.error = str(error)
+            self.state = CANCELLED
+        except Exception as error:
+            self.error = str(error)
+            self.exception = "!! ".join(traceback.format_exc().splitlines(True))
+            self.state = FAILED
+        finally:
+            _current.job = None
+            self.finished = time.time()
+            self._function = self._kwargs = None
+            self._done.set()
+
+    def wait(self, timeout=None):
+        """ Wait until the job finished, returns whether it did """
+        self._done.wait(timeout)
+        return self._done.is_set()
+
+    def status(self):
+        """ What job_status reports """
+        now = time.time()
+        status = {'job_id': self.id, 'command': self.command, 'state': self.state, 'stage': self.stage,
+                  'progress': self.progress, 'queued': (self.started or self.finished or now) - self.created}
+        if self.started is not None:
+            status['elapsed'] = (self.finished or now) - self.started
+        if self.error is not None:
+            status['error'] = self.error
+        return status
+
+
+class JobQueue(object):
+    """ Run jobs on a fixed number of worker threads, first come first served """
+
+    def __init__(self, workers=2, keep_finished=DEFAULT_KEEP_FINISHED):
+        """ Job queue
+        Arguments:
+            workers - jobs run at the same time (the concurrency limit)
+            keep_finished - finished jobs remembered for job_status/job_result
+        """
+        self._queue = Queue.Queue()
+        self._jobs = {}
+        # Client request id: job, a request sent again gets the job it already started
+        self._requests = {}
+        self._finished = []
+        self._keep_finished = keep_finished
+        self._lock = threading.Lock()
+        self._workers = []
+        for number in xrange(max(1, int(workers))):
+            worker = threading.Thread(target=self._work, name="pcb_drill_job_{0}".format(number))
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            job.run()
+            with self._lock:
+                self._finished.append(job.id)
+                while len(self._finished) > self._keep_finished:
+                    forgotten = self._jobs.pop(self._finished.pop(0), None)
+                    if forgotten is not None:
+                        self._requests.pop(forgotten.request_id, None)
+
+    def submit(self, command, function, kwargs=None, request_id=None):
+        """ Queue function(**kwargs), returns the Job
+            request_id - the client's id of the request, submitting it again returns the same Job
+                         instead of queueing another (e.g. a request retried after a timeout)"""
+        with self._lock:
+            if request_id is not None and request_id in self._requests:
+                return self._requests[request_id]
+            job = Job(command, function, kwargs or {}, request_id)
+            self._jobs[job.id] = job
+            if request_id is not None:
+                self._requests[request_id] = job
+        self._queue.put(job)
+        return job
+
+    def get(self, job_id):
+        """ Job by id, raises KeyError for unknown (or long forgotten) jobs """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            raise KeyError("Unknown job {0}".format(job_id))
+        return job
+
+    def status(self, job_id):
+        return self.get(job_id).status()
+
+    def result(self, job_id):
+        """ Status plus the result once the job is done (the exception when it failed) """
+        job = self.get(job_id)
+        status = job.status()
+        if job.state == DONE:
+            status['result'] = job.result
+        elif job.state == FAILED:
+            status['exception'] = job.exception
+        return status
+
+    def cancel(self, job_id):
+        """ Cancel a job: queued jobs never start, running jobs stop at their next report_progress """
+        job = self.get(job_id)
+        if job.state not in FINISHED_STATES:
+            job.cancel_requested = True
+        return job.status()
+
+    def jobs(self):
+        """ Status of every job that is queued, running or recently finished (oldest first) """
+        with self._lock:
+            jobs = sorted(self._jobs.values(), key=lambda job: job.created)
+        return [job.status() for job in jobs]
+
+    def stop(self):
+        """ Let the workers finish their current job and exit """
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python2.7
+
+"""
+pcb_drill_library.py - index of the G-code library in a SQLite database next to the files, so listing,
+searching and showing thousands of archived jobs does not read them all. A refresh only stats the files
+and analyses (hash, hole count, bounding box, run time estimate) the ones that are new or changed since the
+last one, a file with the contents of one already indexed is not analysed again. Files are shown a page of
+lines at a time from a byte offset instead of being read whole.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from pcb_drill_estimate import GCodeSimulator
+
+# Name of the index in the library directory, hidden and not a .gcode file so it is never listed
+INDEX_NAME = ".pcb_drill_library.sqlite"
+# Bump when the files table changes, older indexes are rebuilt
+SCHEMA_VERSION = 1
+# Seconds between refreshes, listings in between use the index as it is
+DEFAULT_REFRESH_INTERVAL = 5.0
+DEFAULT_PAGE_SIZE = 50
+# Lines and bytes shown per preview page
+PREVIEW_LINES = 500
+PREVIEW_BYTES = 256 * 1024
+EXTENSION = ".gcode"
+ORDERS = {'filename': "filename", 'mtime': "mtime DESC", 'size': "size DESC", 'holes': "holes DESC",
+          'time': "time DESC"}
+
+_SCHEMA = """CREATE TABLE IF NOT EXISTS files (
+    filename TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    sha1 TEXT NOT NULL,
+    holes INTEGER,
+    min_x REAL, min_y REAL, max_x REAL, max_y REAL,
+    time REAL,
+    moves INTEGER,
+    xy_travel REAL,
+    z_travel REAL,
+    pauses INTEGER,
+    lines INTEGER,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS files_sha1 ON files (sha1);
+CREATE INDEX IF NOT EXISTS files_mtime ON files (mtime);
+"""
+# Columns copied from a file with the same contents
+_ANALYSIS = ("holes", "min_x", "min_y", "max_x", "max_y", "time", "moves", "xy_travel", "z_travel", "pauses",
+             "lines", "error")
+_BLOCK_SIZE = 1024 * 1024
+
+
+def file_sha1(filename):
+    """ Hex sha1 of a file's contents, read a block at a time """
+    digest = hashlib.sha1()
+    with open(filename, "rb") as input_file:
+        for block in iter(lambda: input_file.read(_BLOCK_SIZE), ""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def analyse(filename):
+    """ Index columns of a G-code file from simulating it line by line (see pcb_drill_estimate) """
+    try:
+        with open(filename, "rb") as gcode_file:
+            found = GCodeSimulator().run(gcode_file)
+    except ValueError as error:
+        # Not G-code the simulator understands, it is still listed
+        return {'error': str(error)}
+    bounds = found['bounds'] or (None, None, None, None)
+    return {'holes': found['holes'], 'min_x': bounds[0], 'min_y': bounds[1], 'max_x': bounds[2],
+            'max_y': bounds[3], 'time': found['time'], 'moves': found['moves'], 'xy_travel': found['xy_travel'],
+            'z_travel': found['z_travel'], 'pauses': found['pauses'], 'lines': found['lines'], 'error': None}
+
+
+def _like(text):
+    """ LIKE pattern matching text anywhere, with its wildcards escaped """
+    return "%" + text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+class GCodeLibrary(object):
+    """ The .gcode files under a directory and their SQLite index """
+
+    def __init__(self, directory, index=None, refresh_interval=DEFAULT_REFRESH_INTERVAL):
+        """ G-code library
+        Arguments:
+            directory - the library, searched recursively
+            index - the SQLite database (default INDEX_NAME in directory)
+            refresh_interval - seconds refresh() skips the scan after the last one
+        """
+        self.directory = os.path.abspath(directory)
+        self.index = index or os.path.join(self.directory, INDEX_NAME)
+        self.refresh_interval = float(refresh_interval)
+        self._lock = threading.Lock()
+        self._refreshed = 0
+        with self._connect() as connection:
+            if connection.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                connection.execute("DROP TABLE IF EXISTS files")
+                connection.execute("PRAGMA user_version = {0}".format(SCHEMA_VERSION))
+            connection.executescript(_SCHEMA)
+
+    def _connect(self):
+        # One connection per call, so every Flask thread has its own
+        connection = sqlite3.connect(self.index, timeout=10)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def path(self, filename):
+        """ Full path of a library file, None when filename would leave the library """
+        full_path = os.path.abspath(os.path.join(self.directory, filename))
+        if not full_path.startswith(self.directory + os.path.sep):
+            return None
+        return full_path
+
+    def _scan(self):
+        """ {filename relative to the library: stat} of every .gcode file """
+        found = {}
+        for dirname, dirnames, filenames in os.walk(self.directory):
+            for name in filenames:
+                if name.lower().endswith(EXTENSION):
+                    full_path = os.path.join(dirname, name)
+                    try:
+                        found[os.path.relpath(full_path, self.directory)] = os.stat(full_path)
+                    except OSError:
+                        # Removed while scanning
+                        pass
+        return found
+
+    def refresh(self, force=False):
+        """ Bring the index up to date with the files, at most every refresh_interval seconds unless force.
+            Returns counts of added, updated, removed and unchanged files (None when skipped). """
+        with self._lock:
+            if not force and time.time() - self._refreshed < self.refresh_interval:
+                return None
+            counts = {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 0}
+            files = self._scan()
+            with self._connect() as connection:
+                indexed = dict((row['filename'], (row['size'], row['mtime']))
+                               for row in connection.execute("SELECT filename, size, mtime FROM files"))
+                for filename in set(indexed) - set(files):
+                    connection.execute("DELETE FROM files WHERE filename = ?", (filename,))
+                    counts['removed'] += 1
+                for filename, stat in sorted(files.iteritems()):
+                    if indexed.get(filename) == (stat.st_size, stat.st_mtime):
+                        counts['unchanged'] += 1
+                        continue
+                    counts['updated' if filename in indexed else 'added'] += 1
+                    self._index_file(connection, filename, stat)
+            self._refreshed = time.time()
+            return counts
+
+    def _index_file(self, connection, filename, stat):
+        full_path = os.path.join(self.directory, filename)
+        try:
+            entry = {'sha1': file_sha1(full_path)}
+            same = connection.execute("SELECT * FROM files WHERE sha1 = ? LIMIT 1", (entry['sha1'],)).fetchone()
+            if same is not None:
+                # A copy of a file already indexed
+                entry.update((column, same[column]) for column in _ANALYSIS)
+            else:
+                entry.update(analyse(full_path))
+        except IOError:
+            # Removed or unreadable, the next refresh tries again
+            return
+        entry.update({'filename': filename, 'size': stat.st_size, 'mtime': stat.st_mtime})
+        columns = sorted(entry)
+        connection.execute("INSERT OR REPLACE INTO files ({0}) VALUES ({1})".format(
+            ", ".join(columns), ", ".join("?" * len(columns))), [entry[column] for column in columns])
+
+    def query(self, search="", page=1, page_size=DEFAULT_PAGE_SIZE, order="filename"):
+        """ (entries, total) of one page of the files whose name contains search
+        Arguments:
+            search - text the filename contains, empty for every file
+            page - page number from 1
+            page_size - entries per page
+            order - a key of ORDERS
+        """
+        if order not in ORDERS:
+            raise ValueError("Unknown order {0}, expected one of {1}".format(order, ", ".join(sorted(ORDERS))))
+        pattern = _like(search)
+        with self._connect() as connection:
+            total = connection.execute("SELECT COUNT(*) FROM files WHERE filename LIKE ? ESCAPE '\\'",
+                                       (pattern,)).fetchone()[0]
+            rows = connection.execute("SELECT * FROM files WHERE filename LIKE ? ESCAPE '\\' ORDER BY {0}, "
+                                      "filename LIMIT ? OFFSET ?".format(ORDERS[order]),
+                                      (pattern, page_size, (max(1, page) - 1) * page_size)).fetchall()
+        return [dict(row) for row in rows], total
+
+    def get(self, filename):
+        """ Index entry of a file as a dict, None when it is not indexed """
+        with self._connect() as connection:
+            row = connection.execute("SELECT * FROM files WHERE filename = ?", (filename,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def preview(self, filename, offset=0, max_lines=PREVIEW_LINES, max_bytes=PREVIEW_BYTES):
+        """ (text, next offset) of up to max_lines lines (at most max_bytes) from byte offset, next offset
+            is None at the end of the file """
+        full_path = self.path(filename)
+        if full_path is None:
+            raise IOError("{0} is outside of the library".format(filename))
+        lines = []
+        read = 0
+        with open(full_path, "rb") as gcode_file:
+            gcode_file.seek(max(0, offset))
+            while len(lines) < max_lines and read < max_bytes:
+                line = gcode_file.readline(max_bytes - read)
+                if not line:
+                    return "".join(lines), None
+                lines.append(line)
+                read += len(line)
+            next_offset = gcode_file.tell()
+            if not gcode_file.read(1):
+                next_offset = None
+        return "".join(lines), next_offset
@@ -0,0 +1,224 @@
+#!/usr/bin/env python2.7
+
+"""
+pcb_drill_overlays.py - render and save debug overlay images (detected holes, crops, keypoint matches,
+differences) on a background thread, so vision commands answer with their numbers straight away and
+the web app fetches each overlay once its status is ready. Overlays are PNG or JPEG, optionally
+downscaled to a preview size.
+"""
+
+import collections
+import logging
+import os
+import threading
+import traceback
+import Queue
+
+try:
+    import numpy
+except ImportError:
+    # Only needed for overlays of arrays, SimpleCV and PIL images are written by PIL
+    numpy = None
+
+try:
+    from PIL import Image
+except ImportError:
+    try:
+        # PIL 1.1.7 installs as top level modules
+        import Image
+    except ImportError:
+        # Only PNG overlays of arrays can be written without PIL
+        Image = None
+
+if numpy is not None:
+    from pcb_drill_raster import PngWriter
+
+log = logging.getLogger('pcb_drilld')
+
+# format: (extension, mime type)
+OVERLAY_FORMATS = {'png': (".png", "image/png"), 'jpeg': (".jpg", "image/jpeg")}
+
+PENDING = "pending"
+READY = "ready"
+FAILED = "failed"
+# Overlays whose status is remembered, the oldest finished ones go first
+DEFAULT_KEEP = 200
+
+
+def _as_array_or_pil(image):
+    """ PIL image or numpy array of a PIL image, SimpleCV image or array """
+    if hasattr(image, 'getPIL'):
+        # SimpleCV
+        return image.getPIL()
+    return image
+
+
+class OverlayWriter(object):
+    """ Queue of overlays to render, written by background threads in the configured format """
+
+    def __init__(self, directory, image_format="png", quality=85, max_size=0, workers=1, finished=None,
+                 keep=DEFAULT_KEEP):
+        """ Overlay writer
+        Arguments:
+            directory - where overlays are written
+            image_format - png or jpeg (see OVERLAY_FORMATS)
+            quality - JPEG quality (1-95)
+            max_size - longest side of an overlay in pixels, bigger ones are downscaled (0 keeps the size)
+            workers - background threads, 0 renders right away in submit
+            finished - callable(path) for every written overlay, e.g. to set its permissions
+            keep - overlays whose status is remembered
+        """
+        image_format = image_format.lower()
+        if image_format == "jpg":
+            image_format = "jpeg"
+        if image_format not in OVERLAY_FORMATS:
+            raise ValueError("Unknown overlay format {0}, expected one of {1}".format(
+                image_format, ", ".join(sorted(OVERLAY_FORMATS))))
+        if image_format != "png" and Image is None:
+            raise ImportError("{0} overlays need PIL".format(image_format))
+        self._directory = directory
+        self.image_format = image_format
+        self.quality = int(quality)
+        self.max_size = int(max_size)
+        self._finished = finished
+        self._keep = keep
+        # filename: [state, error, event], oldest first
+        self._overlays = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._queue = Queue.Queue()
+        self._workers = []
+        for number in xrange(int(workers)):
+            worker = threading.Thread(target=self._work, name="pcb_drill_overlay_{0}".format(number))
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    @property
+    def extension(self):
+        return OVERLAY_FORMATS[self.image_format][0]
+
+    @property
+    def mime_type(self):
+        return OVERLAY_FORMATS[self.image_format][1]
+
+    @property
+    def parameters(self):
+        """ Options that change what an overlay looks like, e.g. for cache keys """
+        return {'format': self.image_format, 'quality': self.quality, 'max_size': self.max_size}
+
+    def filename(self, name, extension=None):
+        """ name with the overlay format's extension (or extension) instead of its own """
+        base, old_extension = os.path.splitext(name)
+        if old_extension.lower() not in (".png", ".jpg", ".jpeg"):
+            base = name
+        return base + (extension or self.extension)
+
+    def save(self, image, output, image_format=None):
+        """ Write image (PIL image, SimpleCV image or RGB/gray array) to output (path or file object)
+            downscaled to max_size, in image_format (the writer's format when None) """
+        image_format = (image_format or self.image_format).upper()
+        image = _as_array_or_pil(image)
+        if Image is None:
+            if image_format != "PNG" or numpy is None:
+                raise ImportError("{0} overlays need PIL".format(image_format))
+            self._save_array(numpy.asarray(image), output)
+            return
+        if not hasattr(image, 'save'):
+            image = Image.fromarray(numpy.ascontiguousarray(image))
+        if self.max_size > 0 and max(image.size) > self.max_size:
+            image = image.copy()
+            image.thumbnail((self.max_size, self.max_size), Image.ANTIALIAS)
+        if image_format == "JPEG":
+            image.convert("RGB").save(output, image_format, quality=self.quality)
+        else:
+            image.save(output, image_format)
+
+    def _save_array(self, image, output):
+        """ PNG of an array without PIL, downscaled by skipping pixels """
+        if self.max_size > 0 and max(image.shape[:2]) > self.max_size:
+            step = -(-max(image.shape[:2]) // self.max_size)
+            image = image[::step, ::step]
+        if image.ndim == 2:
+            image = numpy.dstack((image, image, image))
+        output_file = open(output, "wb") if isinstance(output, basestring) else output
+        try:
+            writer = PngWriter(output_file, image.shape[1], image.shape[0])
+            writer.write(image[..., :3])
+            writer.close()
+        finally:
+            if output_file is not output:
+                output_file.close()
+
+    def submit(self, filename, render, done=None):
+        """ Render an overlay in the background
+        Arguments:
+            filename - overlay name in directory (see filename())
+            render - callable(path) that writes the overlay, e.g. lambda path: writer.save(image, path)
+            done - callable() run after the overlay was written, e.g. to cache it
+        """
+        with self._lock:
+            self._overlays.pop(filename, None)
+            self._overlays[filename] = [PENDING, None, threading.Event()]
+            self._forget()
+        if self._workers:
+            self._queue.put((filename, render, done))
+        else:
+            self._render(filename, render, done)
+
+    def _forget(self):
+        finished = [name for name, (state, error, event) in self._overlays.iteritems() if state != PENDING]
+        for name in finished[:max(0, len(self._overlays) - self._keep)]:
+            del self._overlays[name]
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            self._render(*item)
+
+    def _render(self, filename, render, done):
+        path = os.path.join(self._directory, filename)
+        state, error = READY, None
+        try:
+            # Written under another name first so a half written overlay is never served
+            render(path + ".tmp")
+            os.rename(path + ".tmp", path)
+            if self._finished is not None:
+                self._finished(path)
+            if done is not None:
+                done()
+        except Exception as exception:
+            state, error = FAILED, str(exception)
+            log.error("Rendering overlay {0} failed: {1}".format(filename, traceback.format_exc()))
+        with self._lock:
+            entry = self._overlays.get(filename)
+            if entry is not None:
+                entry[0], entry[1] = state, error
+                entry[2].set()
+
+    def status(self, filename):
+        """ {'state': pending, ready or failed (error says why)}, None for overlays never submitted """
+        with self._lock:
+            entry = self._overlays.get(filename)
+        if entry is None:
+            return None
+        status = {'filename': filename, 'state': entry[0]}
+        if entry[1] is not None:
+            status['error'] = entry[1]
+        return status
+
+    def wait(self, filename, timeout=None):
+        """ Wait for an overlay, returns its status """
+        with self._lock:
+            entry = self._overlays.get(filename)
+        if entry is not None:
+            entry[2].wait(timeout)
+        return self.status(filename)
+
+    def stop(self):
+        """ Finish the queued overlays and stop the workers """
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python2.7
+
+"""
+pcb_drill_panel.py - step and repeat one board's holes into a panel without re-running vision
+"""
+
+import math
+import time
+
+import numpy
+
+from pcb_drill_path import HoleOrdering, array_travel_distance
+
+
+class Panel(object):
+    """ A grid of copies of one board's holes.
+        PcbDrillGCode.drill_holes() takes a Panel directly: it is drilled one chunk at a time
+        (see iter_chunks) so memory use depends on the size of a panel row, not the panel."""
+
+    def __init__(self, holes, columns, rows, pitch_x, pitch_y, rotation=0.0, origin=(0.0, 0.0)):
+        """ Panel
+        Arguments:
+            holes - the board's holes as (x, y) or (x, y, diameter) (e.g. PcbDrillRPC._drill_holes)
+            columns, rows - number of copies along X and Y
+            pitch_x, pitch_y - distance between copies
+            rotation - degrees each copy is turned about the board's centre, either one
+                angle for every copy or a sequence of columns * rows angles (row by row)
+            origin - where the first copy's board coordinates start
+        """
+        self._holes = numpy.array(holes, dtype=float).reshape(len(holes), -1)
+        self.columns = int(columns)
+        self.rows = int(rows)
+        if self.columns < 1 or self.rows < 1:
+            raise ValueError("A panel needs at least one row and one column")
+        self.pitch_x = float(pitch_x)
+        self.pitch_y = float(pitch_y)
+        if numpy.isscalar(rotation):
+            rotation = [rotation] * (self.columns * self.rows)
+        if len(rotation) != self.columns * self.rows:
+            raise ValueError("Expected {0} rotations, one per copy".format(self.columns * self.rows))
+        self._rotations = [float(angle) for angle in rotation]
+        self._origin = (float(origin[0]), float(origin[1]))
+        if len(self._holes) > 0:
+            self._center = (self._holes[:, :2].min(axis=0) + self._holes[:, :2].max(axis=0)) / 2.0
+        else:
+            self._center = numpy.zeros(2)
+
+    def __len__(self):
+        return len(self._holes) * self.columns * self.rows
+
+    def __iter__(self):
+        """ Every hole as a tuple, copy by copy """
+        for chunk in self.iter_chunks():
+            for hole in chunk.tolist():
+                yield tuple(hole)
+
+    def copy(self, column, row):
+        """ The holes of one copy as a numpy array """
+        holes = self._holes.copy()
+        angle = math.radians(self._rotations[row * self.columns + column])
+        if angle != 0:
+            cos, sin = math.cos(angle), math.sin(angle)
+            x = holes[:, 0] - self._center[0]
+            y = holes[:, 1] - self._center[1]
+            holes[:, 0] = x * cos - y * sin + self._center[0]
+            holes[:, 1] = x * sin + y * cos + self._center[1]
+        holes[:, 0] += self._origin[0] + column * self.pitch_x
+        holes[:, 1] += self._origin[1] + row * self.pitch_y
+        return holes
+
+    def row(self, row):
+        """ All holes in one row of copies as a numpy array """
+        return numpy.vstack([self.copy(column, row) for column in xrange(self.columns)])
+
+    def holes(self):
+        """ Every hole in the panel as one numpy array (only sensible for small panels)"""
+        return numpy.vstack([self.row(row) for row in xrange(self.rows)])
+
+    def iter_chunks(self, ordering=None, start=(0.0, 0.0)):
+        """ Yield the panel's holes as numpy arrays.
+            Without an ordering this is copy by copy. With one each row of copies is ordered
+            as a whole (so paths run across board edges) starting from where the last row ended,
+            which makes the rows snake back and forth across the panel. An ordering with a
+            time_budget (OptimizedOrdering) gets it for the whole panel, each row has an equal
+            share of what is left when it starts."""
+        if ordering is None or getattr(ordering, "name", None) == HoleOrdering.name:
+            for row in xrange(self.rows):
+                for column in xrange(self.columns):
+                    yield self.copy(column, row)
+            return
+        time_budget = getattr(ordering, "time_budget", None)
+        if time_budget is not None:
+            deadline = time.time() + time_budget
+        for row in xrange(self.rows):
+            band = self.row(row)
+            if time_budget is None:
+                ordered = ordering(band.tolist(), start)
+            else:
+                now = time.time()
+                row_deadline = now + max(0.0, deadline - now) / (self.rows - row)
+                ordered = ordering(band.tolist(), start, deadline=row_deadline)
+            ordered = numpy.array(ordered, dtype=float)
+            if len(ordered) == 0:
+                continue
+            start = (ordered[-1, 0], ordered[-1, 1])
+            yield ordered
+
+    def travel_distance(self, start=(0.0, 0.0)):
+        """ XY travel drilling the panel copy by copy in the board's hole order """
+        total = 0.0
+        for chunk in self.iter_chunks():
+            if len(chunk) == 0:
+                continue
+            total += array_travel_distance(chunk, start)
+            start = (chunk[-1, 0], chunk[-1, 1])
+        return total
+
+    def tool_sections(self, tool_table):
+        """ Split the panel by tool: a list of (tool, Panel) with the same layout """
+        sections = []
+        for tool, holes in tool_table.group(self._holes):
+            panel = Panel(holes, self.columns, self.rows, self.pitch_x, self.pitch_y,
+                          self._rotations, self._origin)
+            # Keep rotating about the whole board's centre
+            panel._center = self._center
+            sections.append((tool, panel))
+        return sections
@@ -0,0 +1,348 @@
+#!/usr/bin/env python2.7
+
+"""
+pcb_drill_path.py - order drill holes so the head spends less time in rapid XY travel
+"""
+
+import math
+import time
+
+try:
+    import numpy
+except ImportError:
+    # Only needed for array_travel_distance
+    numpy = None
+
+# Neighbours considered per hole by the improvement passes
+DEFAULT_NEIGHBOURS = 8
+# Seconds the improvement passes may run before we emit what we have
+DEFAULT_TIME_BUDGET = 2.0
+# Ignore gains smaller than this (mm) to avoid flip-flopping on float noise
+_EPSILON = 1e-9
+
+
+def travel_distance(holes, start=None):
+    """ Total XY travel needed to visit holes in the given order
+    Arguments:
+        holes - sequence of (x, y) locations
+        start - (x, y) the head starts from (None skips the leg to the 1st hole)
+    """
+    total = 0.0
+    previous = start
+    for hole in holes:
+        if previous is not None:
+            total += math.hypot(hole[0] - previous[0], hole[1] - previous[1])
+        previous = hole
+    return total
+
+
+def array_travel_distance(holes, start=None):
+    """ travel_distance for a numpy N x 2 (or wider) array of holes """
+    if len(holes) == 0:
+        return 0.0
+    points = holes[:, :2]
+    if start is not None:
+        points = numpy.vstack([numpy.asarray(start, dtype=float).reshape(1, 2), points])
+    deltas = numpy.diff(points, axis=0)
+    return float(numpy.hypot(deltas[:, 0], deltas[:, 1]).sum())
+
+
+class _Grid(object):
+    """ Uniform bucket grid for nearest neighbour lookups on a fixed set of points """
+
+    def __init__(self, points, points_per_cell=2.0):
+        self._points = points
+        xs = [point[0] for point in points]
+        ys = [point[1] for point in points]
+        self._min_x = min(xs)
+        self._min_y = min(ys)
+        width = max(xs) - self._min_x
+        height = max(ys) - self._min_y
+        # Long thin sets (e.g. a row of panel copies) must not get cells sized off the long side
+        span = max(width, height) / len(points)
+        area = max(width, span) * max(height, span)
+        self._cell = math.sqrt(area * points_per_cell / len(points)) or 1.0
+        self._cells = {}
+        for index, point in enumerate(points):
+            self._cells.setdefault(self._key(point), []).append(index)
+
+    def _key(self, point):
+        return (int((point[0] - self._min_x) / self._cell),
+                int((point[1] - self._min_y) / self._cell))
+
+    def __len__(self):
+        return len(self._cells)
+
+    def remove(self, index):
+        """ Drop a point so later lookups skip it """
+        key = self._key(self._points[index])
+        bucket = self._cells[key]
+        bucket.remove(index)
+        if not bucket:
+            del self._cells[key]
+
+    def nearest(self, index, count=1):
+        """ Return up to count (distance, index) pairs closest to points[index] (excluding itself)"""
+        points = self._points
+        x, y = points[index][0], points[index][1]
+        center_x, center_y = self._key(points[index])
+        cells = self._cells
+        found = []
+
+        def visit(bucket):
+            for other in bucket:
+                if other != index:
+                    other_x, other_y = points[other][0], points[other][1]
+                    found.append((math.hypot(other_x - x, other_y - y), other))
+
+        ring = 0
+        while cells:
+            if (2 * ring + 1) ** 2 > 2 * len(cells):
+                # The ring now covers more cells than remain - just look at all of them
+                del found[:]
+                for bucket in cells.itervalues():
+                    visit(bucket)
+                break
+            if ring == 0:
+                bucket = cells.get((center_x, center_y))
+                if bucket is not None:
+                    visit(bucket)
+            else:
+                for dx in xrange(-ring, ring + 1):
+                    for key in ((center_x + dx, center_y - ring), (center_x + dx, center_y + ring)):
+                        bucket = cells.get(key)
+                        if bucket is not None:
+                            visit(bucket)
+                for dy in xrange(-ring + 1, ring):
+                    for key in ((center_x - ring, center_y + dy), (center_x + ring, center_y + dy)):
+                        bucket = cells.get(key)
+                        if bucket is not None:
+                            visit(bucket)
+            # Anything in the next ring is at least ring * cell away
+            if len(found) >= count:
+                found.sort()
+                if found[count - 1][0] <= ring * self._cell:
+                    break
+            ring += 1
+        found.sort()
+        return found[:count]
+
+
+class HoleOrdering(object):
+    """ Base hole ordering: drill holes in the order given.
+        Subclasses return a new list of the same holes in the order to drill them."""
+
+    name = "none"
+
+    def __call__(self, holes, start=None):
+        """ Order holes
+        Arguments:
+            holes - sequence of (x, y) locations
+            start - (x, y) location the head is at before the 1st hole
+        """
+        return list(holes)
+
+
+class NearestNeighbourOrdering(HoleOrdering):
+    """ Greedy ordering: always drill the closest remaining hole next """
+
+    name = "nearest_neighbour"
+
+    def __call__(self, holes, start=None):
+        holes = list(holes)
+        if len(holes) < 3:
+            return self._order_small(holes, start)
+        tour = self._construct(holes, start)
+        return [holes[index] for index in tour]
+
+    def _order_small(self, holes, start):
+        if start is not None and len(holes) == 2 and \
+                math.hypot(holes[1][0] - start[0], holes[1][1] - start[1]) < \
+                math.hypot(holes[0][0] - start[0], holes[0][1] - start[1]):
+            return [holes[1], holes[0]]
+        return holes
+
+    def _construct(self, holes, start):
+        """ Return the nearest neighbour visiting order as indexes into holes """
+        if start is None:
+            current = 0
+        else:
+            current = min(xrange(len(holes)),
+                          key=lambda index: math.hypot(holes[index][0] - start[0],
+                                                       holes[index][1] - start[1]))
+        grid = _Grid(holes)
+        grid.remove(current)
+        tour = [current]
+        for _ in xrange(len(holes) - 1):
+            current = grid.nearest(current)[0][1]
+            grid.remove(current)
+            tour.append(current)
+        return tour
+
+
+class OptimizedOrdering(NearestNeighbourOrdering):
+    """ Nearest neighbour construction followed by 2-opt and Or-opt improvement.
+        Both improvement passes only look at each hole's closest neighbours and
+        stop once time_budget seconds have passed since ordering started (or at deadline,
+        a time.time() passed by callers sharing one budget across several orderings)."""
+
+    name = "optimized"
+
+    def __init__(self, time_budget=DEFAULT_TIME_BUDGET, neighbours=DEFAULT_NEIGHBOURS):
+        self.time_budget = float(time_budget)
+        self.neighbours = int(neighbours)
+
+    def __call__(self, holes, start=None, deadline=None):
+        if deadline is None:
+            deadline = time.time() + self.time_budget
+        holes = list(holes)
+        if len(holes) < 3:
+            return self._order_small(holes, start)
+        tour = self._construct(holes, start)
+        if start is None:
+            start = holes[tour[0]]
+        # The start location is an extra node pinned to the front of the route
+        points = holes + [start]
+        route = [len(holes)] + tour
+        if time.time() < deadline:
+            neighbours = self._neighbour_lists(holes, deadline)
+            if neighbours is not None:
+                improved = True
+                while improved and time.time() < deadline:
+                    improved = self._two_opt(points, route, neighbours, deadline)
+                    improved = self._or_opt(points, route, neighbours, deadline) or improved
+        return [holes[index] for index in route[1:]]
+
+    def _neighbour_lists(self, holes, deadline):
+        """ Closest holes for each hole, nearest first (None if we ran out of time)"""
+        grid = _Grid(holes)
+        neighbours = []
+        for index in xrange(len(holes)):
+            if index % 256 == 0 and time.time() >= deadline:
+                return None
+            neighbours.append([other for _, other in grid.nearest(index, self.neighbours)])
+        return neighbours
+
+    @staticmethod
+    def _two_opt(points, route, neighbours, deadline):
+        """ Reverse route segments while that shortens the path. Returns True if anything changed"""
+        last = len(route) - 1
+        position = [0] * len(route)
+        for index, node in enumerate(route):
+            position[node] = index
+
+        def distance(a, b):
+            return math.hypot(points[a][0] - points[b][0], points[a][1] - points[b][1])
+
+        def reversal_gain(first, end):
+            before = route[first - 1]
+            gain = distance(before, route[first]) - distance(before, route[end])
+            if end < last:
+                after = route[end + 1]
+                gain += distance(route[end], after) - distance(route[first], after)
+            return gain
+
+        changed = False
+        for step, node in enumerate(route[1:]):
+            if step % 64 == 0 and time.time() >= deadline:
+                break
+            for other in neighbours[node]:
+                i = position[node]
+                j = position[other]
+                # Join node to other either through node's successor or its predecessor
+                if j > i:
+                    candidates = ((i + 1, j), (i, j - 1))
+                else:
+                    candidates = ((j + 1, i), (j, i - 1))
+                for first, end in candidates:
+                    if 1 <= first < end and reversal_gain(first, end) > _EPSILON:
+                        route[first:end + 1] = route[first:end + 1][::-1]
+                        for index in xrange(first, end + 1):
+                            position[route[index]] = index
+                        changed = True
+                        break
+        return changed
+
+    @staticmethod
+    def _or_opt(points, route, neighbours, deadline):
+        """ Move runs of 1-3 holes next to one of their neighbours. Returns True if anything changed"""
+        last = len(route) - 1
+        position = [0] * len(route)
+        for index, node in enumerate(route):
+            position[node] = index
+
+        def distance(a, b):
+            return math.hypot(points[a][0] - points[b][0], points[a][1] - points[b][1])
+
+        changed = False
+        for length in (1, 2, 3):
+            first = 1
+            while first + length - 1 <= last:
+                if first % 64 == 0 and time.time() >= deadline:
+                    return changed
+                end = first + length - 1
+                head = route[first]
+                tail = route[end]
+                before = route[first - 1]
+                removal_gain = distance(before, head)
+                if end < last:
+                    after = route[end + 1]
+                    removal_gain += distance(tail, after) - distance(before, after)
+                best = None
+                for node in set(neighbours[head] + neighbours[tail]):
+                    for j in (position[node] - 1, position[node]):
+                        # Insert between route[j] and route[j + 1]
+                        if j < 0 or first - 1 <= j <= end:
+                            continue
+                        left = route[j]
+                        for reverse in (False, True):
+                            near, far = (tail, head) if reverse else (head, tail)
+                            cost = distance(left, near)
+                            if j < last:
+                                right = route[j + 1]
+                                cost += distance(far, right) - distance(left, right)
+                            gain = removal_gain - cost
+                            if gain > _EPSILON and (best is None or gain > best[0]):
+                                best = (gain, j, reverse)
+                if best is None:
+                    first += 1
+                    continue
+                _, j, reverse = best
+                segment = route[first:end + 1]
+                if reverse:
+                    segment.reverse()
+                if j < first:
+                    route[j + 1:end + 1] = segment + route[j + 1:first]
+                    low, high = j + 1, end
+                else:
+                    route[first:j + 1] = route[end + 1:j + 1] + segment
+                    low, high = first, j
+                for index in xrange(low, high + 1):
+                    position[route[index]] = index
+                changed = True
+        return changed
+
+
+HOLE_ORDERINGS = {
+    HoleOrdering.name: HoleOrdering,
+    NearestNeighbourOrdering.name: NearestNeighbourOrdering,
+    OptimizedOrdering.name: OptimizedOrdering,
+}
+
+
+def get_hole_ordering(ordering, **kwargs):
+    """ Turn an ordering name (see HOLE_ORDERINGS), callable or None into a hole ordering callable
+    Arguments:
+        ordering - name, callable(holes, start) or None for drilling in the given order
+        **kwargs - options for the optimized ordering (time_budget, neighbours)
+    """
+    if ordering is None:
+        return HoleOrdering()
+    if callable(ordering):
+        return ordering
+    if ordering not in HOLE_ORDERINGS:
+        raise ValueError("Unknown hole ordering {0}, expected one of {1}".format(
+            ordering, ", ".join(sorted(HOLE_ORDERINGS))))
+    if ordering == OptimizedOrdering.name:
+        return OptimizedOrdering(**kwargs)
+    return HOLE_ORDERINGS[ordering]()
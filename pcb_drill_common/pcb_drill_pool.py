@@ -0,0 +1,159 @@
+#!/usr/bin/env python2.7
+
+"""
+pcb_drill_pool.py - worker processes for vision stages that do not depend on each other (decoding
+the before and after pictures, bands of a big solder mask, ...), so they run on every core of the Pi
+instead of one. Images go to and from the workers as SharedArray: a memory-mapped file, in /dev/shm
+when there is one, of which only the name, shape and type are pickled.
+"""
+
+import importlib
+import logging
+import multiprocessing
+import os
+import tempfile
+
+import numpy
+
+from pcb_drill_blobs import to_gray
+from pcb_drill_camera import read_rgb
+
+log = logging.getLogger('pcb_drilld')
+
+# Where shared arrays are created when /dev/shm is missing: tempfile's directory
+SHARED_MEMORY = "/dev/shm"
+# Imported by every worker when it starts, so no job pays for them
+DEFAULT_WARM_UP = ("numpy", "PIL.Image", "SimpleCV")
+
+
+def default_directory():
+    """ /dev/shm (memory) when there is one, otherwise the temporary directory """
+    if os.path.isdir(SHARED_MEMORY) and os.access(SHARED_MEMORY, os.W_OK):
+        return SHARED_MEMORY
+    return tempfile.gettempdir()
+
+
+class SharedArray(object):
+    """ A numpy array in a memory-mapped file that pickles as its file name, so processes share it
+        instead of copying it """
+
+    def __init__(self, path, shape, dtype=numpy.uint8, offset=0, owner=False):
+        """ Shared array
+        Arguments:
+            path - file the array is in
+            shape, dtype - of the array
+            offset - bytes before the array in the file (e.g. a PGM header)
+            owner - unlink() removes the file
+        """
+        self.path = path
+        self.shape = tuple(int(size) for size in shape)
+        self.dtype = numpy.dtype(dtype).str
+        self.offset = int(offset)
+        self.owner = owner
+        self._array = None
+
+    @classmethod
+    def create(cls, shape, dtype=numpy.uint8, directory=None):
+        """ A new zeroed shared array in directory (see default_directory) """
+        handle, path = tempfile.mkstemp(prefix="pcb_drill_", suffix=".shm", dir=directory or default_directory())
+        try:
+            os.ftruncate(handle, max(1, int(numpy.prod(shape)) * numpy.dtype(dtype).itemsize))
+        finally:
+            os.close(handle)
+        return cls(path, shape, dtype, owner=True)
+
+    @classmethod
+    def from_array(cls, array, directory=None):
+        """ A shared copy of array """
+        array = numpy.asarray(array)
+        shared = cls.create(array.shape, array.dtype, directory)
+        shared.array[...] = array
+        return shared
+
+    @classmethod
+    def from_memmap(cls, memmap):
+        """ The file a numpy.memmap (e.g. pcb_drill_raster.open_pgm) maps, shared as it is """
+        return cls(memmap.filename, memmap.shape, memmap.dtype, memmap.offset)
+
+    @property
+    def array(self):
+        """ The array, mapped on first use in each process """
+        if self._array is None:
+            self._array = numpy.memmap(self.path, dtype=self.dtype, mode="r+" if self.owner else "r",
+                                       offset=self.offset, shape=self.shape)
+        return self._array
+
+    def unlink(self):
+        """ Remove the file of an array this process created, mappings of it stay valid """
+        if self.owner and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_array'] = None
+        return state
+
+
+def _warm_up(modules):
+    """ Worker initializer: import modules once per worker """
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            log.debug("Vision worker warm up: no {0}".format(module))
+
+
+def _ready(_):
+    return os.getpid()
+
+
+class VisionPool(object):
+    """ Worker processes that run vision stages, or this process when there are none """
+
+    def __init__(self, workers=0, warm_up=DEFAULT_WARM_UP, directory=None):
+        """ Vision pool
+        Arguments:
+            workers - processes, 0 runs every stage in this process
+            warm_up - modules every worker imports when it starts
+            directory - where shared arrays are created (see default_directory)
+        """
+        self.workers = int(workers)
+        self.directory = directory or default_directory()
+        self._pool = None
+        if self.workers > 0:
+            self._pool = multiprocessing.Pool(self.workers, _warm_up, (tuple(warm_up),))
+            # Wait for every worker to be warm before the first job
+            self._pool.map(_ready, xrange(self.workers), 1)
+
+    def map(self, function, jobs):
+        """ [function(job) for job in jobs], spread over the workers. function must be a module level
+            function and jobs picklable (pass images as SharedArray)."""
+        if self._pool is None:
+            return map(function, jobs)
+        return self._pool.map(function, jobs, 1)
+
+    def shared(self, array):
+        """ SharedArray copy of array for the workers """
+        return SharedArray.from_array(array, self.directory)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+
+def decode_gray(job):
+    """ Worker stage: (filename, directory) -> SharedArray with the grayscale of an image file.
+        The caller maps it and unlink()s it. """
+    filename, directory = job
+    return SharedArray.from_array(to_gray(read_rgb(filename)), directory)
+
+
+def read_gray(pool, filenames):
+    """ Grayscale arrays of image files, decoded side by side on the pool's workers """
+    images = []
+    for shared in pool.map(decode_gray, [(filename, pool.directory) for filename in filenames]):
+        images.append(numpy.asarray(shared.array))
+        shared.unlink()
+    return images
@@ -0,0 +1,346 @@
+#!/usr/bin/env python2.7
+
+"""
+pcb_drill_raster.py - read and write large images a strip of rows at a time: PNG decoded straight into
+a raw grayscale PGM file that can be memory-mapped, and PNG written from strips, so the memory used
+depends on the strip size rather than on the image size. With PIL each strip's rows are unfiltered by
+its C decoder, without it Paeth and Average filtered rows are undone in Python (about 2s per megapixel).
+"""
+
+import argparse
+import io
+import struct
+import zlib
+
+import numpy
+
+try:
+    from PIL import Image
+except ImportError:
+    try:
+        # PIL 1.1.7 installs as top level modules
+        import Image
+    except ImportError:
+        # Filtered rows are undone with numpy and Python instead
+        Image = None
+
+PNG_SIGNATURE = "\x89PNG\r\n\x1a\n"
+DEFAULT_STRIP_ROWS = 256
+# Compressed bytes read from the file at a time
+_READ_SIZE = 64 * 1024
+# Bytes per pixel for each PNG color type (8 bit samples)
+_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+
+class PngHeader(object):
+    """ What the IHDR chunk of a PNG says """
+
+    def __init__(self, width, height, bit_depth, color_type, interlace):
+        self.width = width
+        self.height = height
+        self.bit_depth = bit_depth
+        self.color_type = color_type
+        self.interlace = interlace
+
+    @property
+    def pixels(self):
+        return self.width * self.height
+
+    @property
+    def row_bytes(self):
+        return (self.width * _CHANNELS[self.color_type] * self.bit_depth + 7) // 8
+
+    @property
+    def pixel_bytes(self):
+        """ Distance (bytes) to the same sample of the pixel on the left, for the filters """
+        return max(1, _CHANNELS[self.color_type] * self.bit_depth // 8)
+
+
+def _chunks(png_file):
+    """ Yield (type, data) of each chunk, IDAT data in pieces of at most _READ_SIZE """
+    if png_file.read(8) != PNG_SIGNATURE:
+        raise ValueError("Not a PNG file")
+    while True:
+        header = png_file.read(8)
+        if len(header) < 8:
+            return
+        length, kind = struct.unpack(">I4s", header)
+        if kind == "IDAT":
+            while length > 0:
+                data = png_file.read(min(length, _READ_SIZE))
+                if not data:
+                    raise ValueError("PNG file is truncated")
+                length -= len(data)
+                yield kind, data
+        else:
+            yield kind, png_file.read(length)
+        png_file.read(4)
+        if kind == "IEND":
+            return
+
+
+def read_png_header(filename):
+    """ PngHeader of a PNG file (only reads the start of the file) """
+    with open(filename, "rb") as png_file:
+        for kind, data in _chunks(png_file):
+            if kind == "IHDR":
+                return PngHeader(*struct.unpack(">IIBBxxB", data[:13]))
+    raise ValueError("{0} has no IHDR chunk".format(filename))
+
+
+def read_png_dpi(source):
+    """ Dots per inch a PNG (filename or file object) was saved at from its pHYs chunk, None when it has
+        none or gives no unit (only reads up to the image data) """
+    png_file = open(source, "rb") if isinstance(source, basestring) else source
+    try:
+        for kind, data in _chunks(png_file):
+            if kind == "pHYs" and len(data) >= 9:
+                x_per_meter, y_per_meter, unit = struct.unpack(">IIB", data[:9])
+                if unit == 1 and x_per_meter > 0 and x_per_meter == y_per_meter:
+                    return x_per_meter * 0.0254
+                return None
+            if kind == "IDAT":
+                return None
+    finally:
+        if png_file is not source:
+            png_file.close()
+    return None
+
+
+def _paeth(line, previous, pixel_bytes):
+    """ Undo the Paeth filter (each byte depends on the one decoded before it) """
+    current = bytearray(line)
+    above = bytearray(previous)
+    for index in xrange(len(current)):
+        if index >= pixel_bytes:
+            left = current[index - pixel_bytes]
+            upper_left = above[index - pixel_bytes]
+        else:
+            left = upper_left = 0
+        up = above[index]
+        estimate = left + up - upper_left
+        distance_left = abs(estimate - left)
+        distance_up = abs(estimate - up)
+        distance_upper_left = abs(estimate - upper_left)
+        if distance_left <= distance_up and distance_left <= distance_upper_left:
+            predictor = left
+        elif distance_up <= distance_upper_left:
+            predictor = up
+        else:
+            predictor = upper_left
+        current[index] = (current[index] + predictor) & 0xff
+    return numpy.frombuffer(bytes(current), dtype=numpy.uint8)
+
+
+def _average(line, previous, pixel_bytes):
+    """ Undo the Average filter """
+    current = bytearray(line)
+    above = bytearray(previous)
+    for index in xrange(len(current)):
+        left = current[index - pixel_bytes] if index >= pixel_bytes else 0
+        current[index] = (current[index] + ((left + above[index]) >> 1)) & 0xff
+    return numpy.frombuffer(bytes(current), dtype=numpy.uint8)
+
+
+def _unfilter(kind, line, previous, pixel_bytes):
+    """ Raw bytes of a filtered PNG row (previous is the raw row above) """
+    if kind == 0:
+        # A copy, so the decompressed block the line points into can go
+        return line.copy()
+    if kind == 1:
+        # Running sum of every pixel_bytes'th byte, wrapping like the filter
+        padded = numpy.zeros(-(-len(line) // pixel_bytes) * pixel_bytes, dtype=numpy.uint8)
+        padded[:len(line)] = line
+        return numpy.cumsum(padded.reshape(-1, pixel_bytes), axis=0, dtype=numpy.uint8).ravel()[:len(line)]
+    if kind == 2:
+        return line + previous
+    if kind == 3:
+        return _average(line, previous, pixel_bytes)
+    if kind == 4:
+        if not previous.any():
+            # Nothing above: Paeth picks the left byte like Sub
+            return _unfilter(1, line, previous, pixel_bytes)
+        return _paeth(line, previous, pixel_bytes)
+    raise ValueError("Unknown PNG filter type {0}".format(kind))
+
+
+def _unfilter_rows_pil(lines, previous, header):
+    """ _unfilter_rows by PIL: the strip is wrapped in a PNG of its own, below the raw row above it
+        (filter type 0) and stored uncompressed, and PIL's decoder undoes the filters """
+    # Palette indices unfilter like gray levels
+    color_type = 0 if header.color_type == 3 else header.color_type
+    data = bytearray("\x00")
+    data.extend(previous.tostring())
+    for line in lines:
+        data.extend(line.tostring())
+    png = (PNG_SIGNATURE +
+           _png_chunk("IHDR", struct.pack(">IIBBBBB", header.width, len(lines) + 1, header.bit_depth,
+                                          color_type, 0, 0, 0)) +
+           _png_chunk("IDAT", zlib.compress(str(data), 0)) + _png_chunk("IEND", ""))
+    image = Image.open(io.BytesIO(png))
+    # PIL 1.1.7 has no tobytes
+    raw = getattr(image, "tobytes", None) or image.tostring
+    return numpy.frombuffer(raw(), dtype=numpy.uint8).reshape(len(lines) + 1, header.row_bytes)[1:]
+
+
+def _unfilter_rows(lines, previous, header):
+    """ Raw rows (2d array) of filtered PNG lines (filter type byte first), previous is the raw row above """
+    if Image is not None and header.bit_depth in (1, 8):
+        return _unfilter_rows_pil(lines, previous, header)
+    rows = []
+    for line in lines:
+        previous = _unfilter(line[0], line[1:], previous, header.pixel_bytes)
+        rows.append(previous)
+    return numpy.array(rows)
+
+
+def _gray_rows(rows, header, palette):
+    """ uint8 grayscale of raw PNG rows (2d array of row bytes) """
+    bit_depth = header.bit_depth
+    channels = _CHANNELS[header.color_type]
+    if bit_depth == 16:
+        # Keep the high byte of each sample
+        samples = rows[:, ::2]
+    elif bit_depth < 8:
+        bits = numpy.unpackbits(rows, axis=1).reshape(len(rows), -1, bit_depth)
+        weights = 1 << numpy.arange(bit_depth - 1, -1, -1)
+        samples = (bits * weights).sum(axis=2)[:, :header.width]
+        if header.color_type == 0:
+            samples = samples * (255 // ((1 << bit_depth) - 1))
+        samples = samples.astype(numpy.uint8)
+    else:
+        samples = rows
+    samples = samples[:, :header.width * channels].reshape(len(rows), header.width, channels)
+    if header.color_type == 3:
+        if palette is None:
+            raise ValueError("Palette PNG without a PLTE chunk")
+        samples = palette[samples[..., 0]]
+    elif header.color_type in (0, 4):
+        return samples[..., 0].copy()
+    # Same weights as OpenCV, a channel at a time to keep the temporaries small
+    gray = numpy.multiply(samples[..., 0], 299, dtype=numpy.uint32)
+    gray += numpy.multiply(samples[..., 1], 587, dtype=numpy.uint32)
+    gray += numpy.multiply(samples[..., 2], 114, dtype=numpy.uint32)
+    gray += 500
+    gray //= 1000
+    return gray.astype(numpy.uint8)
+
+
+def iter_png_strips(filename, strip_rows=DEFAULT_STRIP_ROWS):
+    """ Yield the rows of a PNG file as uint8 grayscale arrays of up to strip_rows rows,
+        decompressing only as much as each strip needs"""
+    with open(filename, "rb") as png_file:
+        header = None
+        palette = None
+        decompressor = zlib.decompressobj()
+        pending = ""
+        previous = None
+        strip = []
+        for kind, data in _chunks(png_file):
+            if kind == "IHDR":
+                header = PngHeader(*struct.unpack(">IIBBxxB", data[:13]))
+                if header.interlace:
+                    raise ValueError("Interlaced PNG files can't be read in strips, save {0} without "
+                                     "interlacing".format(filename))
+                if header.color_type not in _CHANNELS or header.bit_depth not in (1, 2, 4, 8, 16):
+                    raise ValueError("Unsupported PNG color type {0} with bit depth {1}".format(
+                        header.color_type, header.bit_depth))
+                previous = numpy.zeros(header.row_bytes, dtype=numpy.uint8)
+                row_size = header.row_bytes + 1
+            elif kind == "PLTE":
+                palette = numpy.frombuffer(data, dtype=numpy.uint8).reshape(-1, 3)
+            elif kind == "IDAT" or kind == "IEND":
+                if header is None:
+                    raise ValueError("PNG data before the IHDR chunk")
+                while True:
+                    if kind == "IDAT":
+                        # Bound how much a very compressible mask can inflate at once
+                        pending += decompressor.decompress(data, row_size * strip_rows)
+                        data = decompressor.unconsumed_tail
+                    else:
+                        pending += decompressor.flush()
+                    rows = len(pending) // row_size
+                    for index in xrange(rows):
+                        strip.append(numpy.frombuffer(pending, dtype=numpy.uint8, count=row_size,
+                                                      offset=index * row_size))
+                        if len(strip) == strip_rows:
+                            raw = _unfilter_rows(strip, previous, header)
+                            previous = raw[-1]
+                            yield _gray_rows(raw, header, palette)
+                            strip = []
+                    pending = pending[rows * row_size:]
+                    if kind == "IEND" or not data:
+                        break
+        if strip:
+            yield _gray_rows(_unfilter_rows(strip, previous, header), header, palette)
+
+
+def write_pgm_header(output_file, width, height):
+    header = "P5\n{0} {1}\n255\n".format(width, height)
+    output_file.write(header)
+    return len(header)
+
+
+def png_to_pgm(png_filename, pgm_filename, strip_rows=DEFAULT_STRIP_ROWS):
+    """ Decode a PNG file into a grayscale PGM file strip by strip, returns the PngHeader """
+    header = read_png_header(png_filename)
+    with open(pgm_filename, "wb") as pgm_file:
+        write_pgm_header(pgm_file, header.width, header.height)
+        for strip in iter_png_strips(png_filename, strip_rows):
+            pgm_file.write(strip.tostring())
+    return header
+
+
+def open_pgm(filename):
+    """ Memory-map a binary (P5, 8 bit) PGM file as a read only height x width uint8 array """
+    with open(filename, "rb") as pgm_file:
+        fields = []
+        offset = 0
+        while len(fields) < 4:
+            line = pgm_file.readline()
+            if not line:
+                raise ValueError("{0} is not a complete PGM file".format(filename))
+            offset += len(line)
+            fields.extend(line.split("#", 1)[0].split())
+    if fields[0] != "P5" or int(fields[3]) != 255:
+        raise ValueError("{0} is not an 8 bit binary PGM file".format(filename))
+    width, height = int(fields[1]), int(fields[2])
+    return numpy.memmap(filename, dtype=numpy.uint8, mode="r", offset=offset, shape=(height, width))
+
+
+def _png_chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+
+class PngWriter(object):
+    """ Write an 8 bit RGB PNG file a strip of rows at a time """
+
+    def __init__(self, output_file, width, height, level=6):
+        self._output_file = output_file
+        self._width = width
+        self._compressor = zlib.compressobj(level)
+        output_file.write(PNG_SIGNATURE)
+        output_file.write(_png_chunk("IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+
+    def write(self, rows):
+        """ Add rows (height x width x 3 uint8 array) """
+        rows = numpy.asarray(rows, dtype=numpy.uint8).reshape(len(rows), self._width * 3)
+        # Filter type 0 (none) in front of each row
+        filtered = numpy.zeros((len(rows), self._width * 3 + 1), dtype=numpy.uint8)
+        filtered[:, 1:] = rows
+        data = self._compressor.compress(filtered.tostring())
+        if data:
+            self._output_file.write(_png_chunk("IDAT", data))
+
+    def close(self):
+        self._output_file.write(_png_chunk("IDAT", self._compressor.flush()))
+        self._output_file.write(_png_chunk("IEND", ""))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Decode a PNG into a grayscale PGM without loading it whole")
+    parser.add_argument('png', help="PNG file")
+    parser.add_argument('pgm', help="PGM file to write")
+    args = parser.parse_args()
+    header = png_to_pgm(args.png, args.pgm)
+    print "{0}: {1} x {2} pixels".format(args.pgm, header.width, header.height)
@@ -0,0 +1,356 @@
+#!/usr/bin/env python2.7
+
+"""
+pcb_drill_registration.py - find where a board (e.g. its solder mask) lies in a camera picture with FFTs:
+the rotation and scale come from phase correlation of the log-polar magnitude spectra of small pyramid
+levels, the translation from phase correlation once the board is rotated and scaled, and the estimate
+is refined at full resolution in a window around the board only. The result is an affine transform from
+board pixels to picture pixels.
+"""
+
+import math
+
+import numpy
+
+from pcb_drill_blobs import to_gray
+
+# Longest side of the pyramid level the rotation, scale and translation are first estimated on
+DEFAULT_COARSE_SIZE = 256
+# Full resolution refinement passes, fewer once no board corner moves more than REFINE_SETTLED pixels
+REFINE_PASSES = 4
+REFINE_SETTLED = 0.1
+# The refinement lines up REFINE_GRID x REFINE_GRID patches of REFINE_PATCH pixels spread over the board
+REFINE_GRID = 4
+REFINE_PATCH = 128
+# Patches that match worse than this have nothing to line up
+MIN_PATCH_PEAK = 0.1
+
+
+def normalize(image):
+    """ float grayscale with zero mean and unit deviation, so padding with zeros adds no edges """
+    gray = to_gray(image).astype(numpy.float32)
+    gray -= gray.mean()
+    deviation = gray.std()
+    if deviation > 0:
+        gray /= deviation
+    return gray
+
+
+def downsample(image):
+    """ Half the size, each pixel the mean of 2 x 2 """
+    height, width = image.shape[0] // 2 * 2, image.shape[1] // 2 * 2
+    image = image[:height, :width]
+    return (image[0::2, 0::2] + image[1::2, 0::2] + image[0::2, 1::2] + image[1::2, 1::2]) / 4.0
+
+
+def pyramid(image, max_size=1):
+    """ [image, image / 2, image / 4, ...] down to the first level whose longest side is at most max_size """
+    levels = [image]
+    while max(levels[-1].shape) > max_size and min(levels[-1].shape) >= 16:
+        levels.append(downsample(levels[-1]))
+    return levels
+
+
+def _fast_size(size):
+    """ Smallest size >= size that only has the factors 2, 3 and 5 (fast FFTs) """
+    while True:
+        rest = size
+        for factor in (2, 3, 5):
+            while rest % factor == 0:
+                rest //= factor
+        if rest == 1:
+            return size
+        size += 1
+
+
+def _hann(shape):
+    return numpy.outer(numpy.hanning(shape[0]), numpy.hanning(shape[1])).astype(numpy.float32)
+
+
+def _peak_offset(values, index):
+    """ Sub-pixel offset of a peak from a parabola through it and its neighbours (wrapping around) """
+    left, center, right = values[index - 1], values[index], values[(index + 1) % len(values)]
+    denominator = left - 2 * center + right
+    if denominator >= 0:
+        return 0.0
+    return float(0.5 * (left - right) / denominator)
+
+
+def phase_correlation(a, b, shape=None):
+    """ (dx, dy, peak) such that a(x, y) ~ b(x - dx, y - dy), a and b zero padded to shape (default the
+        shape of a); shifts wrap around the padded shape, peak is 1 for a perfect match """
+    shape = shape or a.shape
+    cross = numpy.fft.fft2(a, shape) * numpy.conj(numpy.fft.fft2(b, shape))
+    cross /= numpy.abs(cross) + 1e-9
+    correlation = numpy.fft.ifft2(cross).real
+    y, x = numpy.unravel_index(int(numpy.argmax(correlation)), correlation.shape)
+    dy = y + _peak_offset(correlation[:, x], y)
+    dx = x + _peak_offset(correlation[y, :], x)
+    return dx, dy, float(correlation[y, x])
+
+
+def _wrap(shift, size, below):
+    """ Shift in [-below, size - below) of one found modulo size """
+    return shift - size if shift >= size - below else shift
+
+
+def _bilinear(image, x, y, fill=0.0):
+    """ image sampled at float coordinates, fill outside """
+    height, width = image.shape
+    x0 = numpy.floor(x).astype(numpy.int64)
+    y0 = numpy.floor(y).astype(numpy.int64)
+    fx = (x - x0).astype(numpy.float32)
+    fy = (y - y0).astype(numpy.float32)
+    inside = (x0 >= 0) & (y0 >= 0) & (x0 < width - 1) & (y0 < height - 1)
+    x0 = numpy.where(inside, x0, 0)
+    y0 = numpy.where(inside, y0, 0)
+    top = image[y0, x0] * (1 - fx) + image[y0, x0 + 1] * fx
+    bottom = image[y0 + 1, x0] * (1 - fx) + image[y0 + 1, x0 + 1] * fx
+    return numpy.where(inside, top * (1 - fy) + bottom * fy, fill).astype(numpy.float32)
+
+
+def warp_affine(image, matrix, shape, fill=0.0):
+    """ image moved by matrix (2 x 3, image pixels to output pixels) into an array of shape """
+    inverse = numpy.linalg.inv(numpy.vstack([matrix, [0, 0, 1]]))
+    y, x = numpy.mgrid[:shape[0], :shape[1]].astype(numpy.float32)
+    source_x = inverse[0, 0] * x + inverse[0, 1] * y + inverse[0, 2]
+    source_y = inverse[1, 0] * x + inverse[1, 1] * y + inverse[1, 2]
+    return _bilinear(image, source_x, source_y, fill)
+
+
+def log_polar_spectrum(image, size, angles=360):
+    """ High-passed magnitude spectrum of image (zero padded to size x size) resampled with angle
+        (0 to pi, the spectrum is symmetric) down the rows and log radius across the columns.
+        Returns the resampled spectrum and the log base of the columns. """
+    windowed = image * _hann(image.shape)
+    magnitude = numpy.abs(numpy.fft.fftshift(numpy.fft.fft2(windowed, (size, size))))
+    # Low frequencies (the board's outline and lighting) dominate otherwise
+    frequency = numpy.fft.fftshift(numpy.fft.fftfreq(size))
+    cosines = numpy.outer(numpy.cos(numpy.pi * frequency), numpy.cos(numpy.pi * frequency))
+    magnitude *= (1.0 - cosines) * (2.0 - cosines)
+    radii = size // 2
+    base = math.exp(math.log(radii) / radii)
+    theta = numpy.arange(angles) * numpy.pi / angles
+    radius = base ** numpy.arange(radii)
+    x = size // 2 + numpy.outer(numpy.cos(theta), radius)
+    y = size // 2 - numpy.outer(numpy.sin(theta), radius)
+    return _bilinear(magnitude.astype(numpy.float32), x, y), base
+
+
+def rotation_scale(template, image, angles=360):
+    """ (angle in radians, scale, peak) that turn template into image, up to a half turn """
+    size = _fast_size(max(template.shape + image.shape))
+    polar_template, base = log_polar_spectrum(template, size, angles)
+    polar_image, base = log_polar_spectrum(image, size, angles)
+    d_radius, d_angle, peak = phase_correlation(polar_image, polar_template)
+    d_angle = _wrap(d_angle, angles, angles // 2)
+    d_radius = _wrap(d_radius, polar_image.shape[1], polar_image.shape[1] // 2)
+    # A bigger board has a smaller spectrum
+    return -d_angle * math.pi / angles, base ** -d_radius, peak
+
+
+def similarity(angle, scale, dx=0.0, dy=0.0):
+    """ 2 x 3 matrix that rotates by angle, scales and moves by (dx, dy) """
+    cos, sin = scale * math.cos(angle), scale * math.sin(angle)
+    return numpy.array([[cos, -sin, dx], [sin, cos, dy]])
+
+
+def _compose(outer, inner):
+    """ 2 x 3 matrix of outer after inner """
+    return numpy.dot(numpy.vstack([outer, [0, 0, 1]]), numpy.vstack([inner, [0, 0, 1]]))[:2]
+
+
+def _level(factor):
+    """ Pyramid level pixels (factor times smaller) to full resolution pixels """
+    return numpy.array([[factor, 0, (factor - 1) / 2.0], [0, factor, (factor - 1) / 2.0]])
+
+
+def _level_inverse(factor):
+    return numpy.array([[1.0 / factor, 0, (1 - factor) / (2.0 * factor)],
+                        [0, 1.0 / factor, (1 - factor) / (2.0 * factor)]])
+
+
+def transform_points(matrix, points):
+    """ (x, y) points moved by a 2 x 3 matrix """
+    points = numpy.asarray(points, dtype=float).reshape(-1, 2)
+    return numpy.dot(points, numpy.asarray(matrix)[:, :2].T) + numpy.asarray(matrix)[:, 2]
+
+
+def _corners(shape):
+    height, width = shape[:2]
+    return [(0, 0), (width - 1, 0), (width - 1, height - 1), (0, height - 1)]
+
+
+def _translate(template, image, rotation):
+    """ rotation (2 x 3, no translation) with the translation that best puts template on image, and its peak """
+    corners = transform_points(rotation, _corners(template.shape))
+    left, top = numpy.floor(corners.min(axis=0))
+    right, bottom = numpy.ceil(corners.max(axis=0))
+    placed = rotation.copy()
+    placed[:, 2] -= (left, top)
+    warped = warp_affine(template, placed, (int(bottom - top) + 1, int(right - left) + 1))
+    # Padded by the warped board, so shifts in [-board, image) do not wrap onto each other
+    shape = (_fast_size(image.shape[0] + warped.shape[0]), _fast_size(image.shape[1] + warped.shape[1]))
+    dx, dy, peak = phase_correlation(image, warped, shape)
+    placed[:, 2] += (_wrap(dx, shape[1], warped.shape[1]), _wrap(dy, shape[0], warped.shape[0]))
+    return placed, peak
+
+
+def _fit_affine(sources, targets):
+    """ 2 x 3 least squares affine transform from sources to targets ((x, y) arrays) """
+    design = numpy.column_stack([sources, numpy.ones(len(sources))])
+    return numpy.linalg.lstsq(design, targets, rcond=-1)[0].T
+
+
+def _spans_plane(points):
+    """ Whether an affine transform can be fitted to points: three or more, not all on a line """
+    return len(points) >= 3 and numpy.linalg.matrix_rank(numpy.column_stack([points, numpy.ones(len(points))])) == 3
+
+
+def _refine(template_levels, image, matrix, margin, grid=REFINE_GRID, patch=REFINE_PATCH):
+    """ matrix (full resolution) corrected by how far patches of the board are off in a window around
+        it in the picture, and the mean peak of the patches that matched """
+    corners = transform_points(matrix, _corners(template_levels[0].shape))
+    left, top = numpy.maximum(numpy.floor(corners.min(axis=0)) - margin, 0).astype(int)
+    right, bottom = numpy.minimum(numpy.ceil(corners.max(axis=0)) + margin + 1,
+                                  (image.shape[1], image.shape[0])).astype(int)
+    if right - left < 16 or bottom - top < 16:
+        return matrix, 0.0
+    window = image[top:bottom, left:right]
+    # Warp from the template level about the size the board has in the picture, not to alias
+    scale = math.sqrt(abs(numpy.linalg.det(matrix[:, :2])))
+    level = 0
+    while level + 1 < len(template_levels) and scale * 2 ** (level + 1) <= 1.0:
+        level += 1
+    placed = _compose(matrix, _level(2 ** level))
+    placed[:, 2] -= (left, top)
+    warped = warp_affine(template_levels[level], placed, window.shape)
+    size = min(patch, window.shape[0], window.shape[1])
+    hann = _hann((size, size))
+    # Patch centres on a grid over the board itself (the corners of its bounding box may be bed)
+    height, width = template_levels[0].shape
+    centres = [(x, y) for y in numpy.linspace(0, height - 1, grid + 2)[1:-1]
+               for x in numpy.linspace(0, width - 1, grid + 2)[1:-1]]
+    sources, targets, peaks = [], [], []
+    for x, y in transform_points(matrix, centres) - (left, top):
+        x = int(min(max(round(x) - size // 2, 0), window.shape[1] - size))
+        y = int(min(max(round(y) - size // 2, 0), window.shape[0] - size))
+        area = (slice(y, y + size), slice(x, x + size))
+        dx, dy, peak = phase_correlation(window[area] * hann, warped[area] * hann)
+        dx, dy = _wrap(dx, size, size // 2), _wrap(dy, size, size // 2)
+        # Plain board or plain bed has nothing to line up, and the estimate is off by a few pixels only
+        if peak < MIN_PATCH_PEAK or max(abs(dx), abs(dy)) > margin:
+            continue
+        center = (x + left + size / 2.0, y + top + size / 2.0)
+        sources.append(center)
+        targets.append((center[0] + dx, center[1] + dy))
+        peaks.append(peak)
+    if not peaks:
+        return matrix, 0.0
+    sources = numpy.array(sources)
+    targets = numpy.array(targets)
+    if _spans_plane(sources):
+        correction = _fit_affine(sources, targets)
+        # Once more without the patches that disagree with the rest
+        residual = numpy.hypot(*(transform_points(correction, sources) - targets).T)
+        agree = residual <= max(1.0, 3 * numpy.median(residual))
+        if not agree.all() and _spans_plane(sources[agree]):
+            correction = _fit_affine(sources[agree], targets[agree])
+    else:
+        correction = numpy.array([[1.0, 0, 0], [0, 1.0, 0]])
+        correction[:, 2] = (targets - sources).mean(axis=0)
+    return _compose(correction, matrix), float(numpy.mean(peaks))
+
+
+class Registration(object):
+    """ Where a board is in a picture """
+
+    def __init__(self, matrix, confidence, template_shape):
+        """ Registration
+        Arguments:
+            matrix - 2 x 3 affine transform from board pixels to picture pixels
+            confidence - phase correlation peak of the final refinement (0-1)
+            template_shape - shape of the board image
+        """
+        self.matrix = numpy.asarray(matrix, dtype=float)
+        self.confidence = confidence
+        self.template_shape = template_shape
+
+    @property
+    def angle(self):
+        """ Rotation in radians """
+        return math.atan2(self.matrix[1, 0], self.matrix[0, 0])
+
+    @property
+    def scale(self):
+        """ Picture pixels per board pixel """
+        return math.sqrt(abs(numpy.linalg.det(self.matrix[:, :2])))
+
+    @property
+    def corners(self):
+        """ Board corners in the picture: top left, top right, bottom right, bottom left """
+        return transform_points(self.matrix, _corners(self.template_shape)).tolist()
+
+    def transform(self, points):
+        """ Board pixels to picture pixels """
+        return transform_points(self.matrix, points).tolist()
+
+    def crop(self, image):
+        """ The board cut out of the picture (uint8 grayscale), straightened to the board image's shape """
+        board = warp_affine(to_gray(image).astype(numpy.float32),
+                            numpy.linalg.inv(numpy.vstack([self.matrix, [0, 0, 1]]))[:2], self.template_shape[:2])
+        return numpy.clip(board + 0.5, 0, 255).astype(numpy.uint8)
+
+    def to_dict(self):
+        return {'matrix': self.matrix.tolist(), 'angle': self.angle, 'scale': self.scale,
+                'translation': self.matrix[:, 2].tolist(), 'corners': self.corners,
+                'confidence': self.confidence}
+
+
+def register(template, image, coarse_size=DEFAULT_COARSE_SIZE, angles=360):
+    """ Registration of a board image (template) in a picture (image), both grayscale or RGB arrays.
+        Check its confidence: a low one means the board was not found.
+    Arguments:
+        template - the board, e.g. its solder mask
+        image - the picture with the board somewhere in it, rotated and scaled
+        coarse_size - longest side of the picture's pyramid level the first estimate is made on
+        angles - angle steps in a half turn of the log-polar spectra
+    """
+    template = normalize(template)
+    image = normalize(image)
+    image_levels = pyramid(image, coarse_size)
+    coarse_image = image_levels[-1]
+    # The board no bigger than the coarse picture, so the scale to find is about 1 or less
+    template_levels = pyramid(template, max(coarse_image.shape))
+    coarse_template = template_levels[-1]
+    angle, scale, _ = rotation_scale(coarse_template, coarse_image, angles)
+    best = None
+    # Magnitude spectra are the same for a half turn, try both
+    for turn in (angle, angle + math.pi):
+        placed, peak = _translate(coarse_template, coarse_image, similarity(turn, scale))
+        if best is None or peak > best[1]:
+            best = (placed, peak)
+    image_factor = 2 ** (len(image_levels) - 1)
+    template_factor = 2 ** (len(template_levels) - 1)
+    matrix = _compose(_level(image_factor), _compose(best[0], _level_inverse(template_factor)))
+    confidence = best[1]
+    corners = transform_points(matrix, _corners(template.shape))
+    for _ in xrange(REFINE_PASSES):
+        matrix, confidence = _refine(template_levels, image, matrix, 2 * image_factor + 4)
+        moved, corners = corners, transform_points(matrix, _corners(template.shape))
+        if numpy.abs(corners - moved).max() < REFINE_SETTLED:
+            break
+    return Registration(matrix, confidence, template.shape)
+
+
+def draw_outline(rgb, points, color=(255, 0, 255)):
+    """ Draw the closed polygon through points (x, y) on an RGB array """
+    height, width = rgb.shape[:2]
+    points = numpy.asarray(points, dtype=float)
+    for start, end in zip(points, numpy.roll(points, -1, axis=0)):
+        steps = int(max(abs(end - start))) + 1
+        x = numpy.round(numpy.linspace(start[0], end[0], steps)).astype(int)
+        y = numpy.round(numpy.linspace(start[1], end[1], steps)).astype(int)
+        inside = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+        rgb[y[inside], x[inside]] = color
+    return rgb
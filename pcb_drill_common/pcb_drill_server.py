@@ -0,0 +1,165 @@
+#!/usr/bin/env python2.7
+
+"""
+pcb_drill_server.py - serve an RPC object's public methods over ZeroMQ with the command protocol of
+PcbDrillClient (JSON, or an envelope plus raw image frames, see pcb_drill_transport): one REP socket,
+or a ROUTER front end with a pool of worker threads behind a DEALER so several clients are served at once
+"""
+
+import logging
+import sys
+import threading
+import time
+import traceback
+
+import zmq
+
+from pcb_drill_jobs import JobQueue
+from pcb_drill_transport import recv_message, send_message
+
+log = logging.getLogger('pcb_drilld')
+
+# rep: one request at a time, router: server_workers requests at a time
+SERVER_MODES = ("rep", "router")
+# Where the ROUTER front end hands requests to the workers
+WORKERS_ADDRESS = "inproc://pcb_drill_workers"
+
+
+def _locked(method, lock):
+    """ method that holds lock while it runs """
+    def locked_method(**kwargs):
+        with lock:
+            return method(**kwargs)
+    locked_method.__doc__ = method.__doc__
+    return locked_method
+
+
+class PcbDrillServer(object):
+    """ Run the actual server """
+    def __init__(self, rpc, job_workers=2, mode="rep", workers=4, job_commands=(), resources=None):
+        """ Server
+        Arguments:
+            rpc - object whose public methods are the commands
+            job_workers - slow commands run at the same time
+            mode - rep or router (see SERVER_MODES)
+            workers - threads answering requests in router mode
+            job_commands - commands run on the job queue, they answer with a job id
+            resources - {resource: commands}, commands sharing a resource (e.g. the camera) never
+                        run at the same time
+        """
+        if mode not in SERVER_MODES:
+            raise ValueError("Unknown server mode {0}, expected one of {1}".format(mode, ", ".join(SERVER_MODES)))
+        log.info("Starting PcbDrillServer...")
+        self._mode = mode
+        self._workers = max(1, int(workers))
+        self._job_commands = frozenset(job_commands)
+        self._methods = self._get_rpc_methods(rpc, resources or {})
+        self._jobs = JobQueue(int(job_workers))
+        self._methods.update({'job_status': self._jobs.status, 'job_result': self._jobs.result,
+                              'job_cancel': self._jobs.cancel, 'job_list': self._jobs.jobs})
+        # Heartbeat of pooled clients (see pcb_drill_client.ClientPool)
+        self._methods.setdefault('ping', self._ping)
+        self._context = zmq.Context()
+        if mode == "router":
+            self._socket = self._context.socket(zmq.ROUTER)
+        else:
+            self._socket = self._context.socket(zmq.REP)
+
+    def _request(self, socket):
+        # Binary arguments arrive as buffers over the received frames
+        request, envelope = recv_message(socket)
+        ascii_request = {}
+        for k,v in request.items():
+            if hasattr(k, 'encode') and hasattr(v, 'encode'):
+                ascii_request[k.encode("utf8")] = v.encode("utf8")
+            else:
+                # Handles ints and other things
+                ascii_request[k] = v
+        return ascii_request, envelope
+
+    def _response(self, socket, data, envelope=None):
+        # Binary values in data (e.g. rendered images) go back as frames of their own, in the
+        # envelope format the request came in
+        send_message(socket, data, envelope)
+
+    def _ping(self):
+        return "pong"
+
+    def _execute(self, request):
+        command = request['command']
+        del request['command']
+        # Same for every attempt of a request a client sends again (see PcbDrillClient)
+        request_id = request.pop('request_id', None)
+        kwargs = request
+        log.info("Command: " + str(command) + " Arguments: " + str(kwargs))
+        start_time = time.time()
+        if command in self._job_commands:
+            # Poll job_status/job_result with the job id for progress and the output
+            job = self._jobs.submit(command, self._methods[command], kwargs, request_id)
+            return {'success': True, 'output': job.status(), 'job_id': job.id,
+                    'time': time.time() - start_time}
+        response = self._methods[command](**kwargs)
+        end_time = time.time()
+        duration = end_time - start_time
+
+        return {'success': True, 'output': response, 'time': duration}
+
+    def _get_rpc_methods(self, rpc, resources):
+        methods = {}
+        log.info("rpc = " + str(rpc))
+        for method in dir(rpc):
+            if not method.startswith("_") and \
+                callable(getattr(rpc, method)):
+                methods[method] = getattr(rpc, method)
+        for resource, commands in resources.iteritems():
+            lock = threading.RLock()
+            for command in commands:
+                if command in methods:
+                    methods[command] = _locked(methods[command], lock)
+        log.info("Currently supporing the following methods:" \
+                 + " ".join(sorted(methods.keys())))
+        return methods
+
+    def bind(self, address):
+        """ ZeroMQ Binding """
+        self._socket.bind(address)
+
+    def _serve(self, socket):
+        """ Answer requests on a REP socket forever """
+        while True:
+            response = {'error': 'premature exit'}
+            envelope = None
+            try:
+                request, envelope = self._request(socket)
+                response = self._execute(request)
+                # Fall through to finally
+            except Exception as error:
+                exception_output = traceback.format_exception(*sys.exc_info())
+                response = {'success': False, 'error': str(error),
+                            'exception': "!! ".join(exception_output)}
+                log.exception(error)
+            finally:
+                self._response(socket, response, envelope)
+
+    def _worker(self):
+        socket = self._context.socket(zmq.REP)
+        socket.connect(WORKERS_ADDRESS)
+        self._serve(socket)
+
+    def run(self):
+        if self._mode == "rep":
+            self._serve(self._socket)
+            return
+        backend = self._context.socket(zmq.DEALER)
+        # inproc needs the bind before the workers connect
+        backend.bind(WORKERS_ADDRESS)
+        for number in xrange(self._workers):
+            worker = threading.Thread(target=self._worker, name="pcb_drill_worker_{0}".format(number))
+            worker.daemon = True
+            worker.start()
+        log.info("Serving with {0} workers".format(self._workers))
+        if hasattr(zmq, 'proxy'):
+            zmq.proxy(self._socket, backend)
+        else:
+            # pyzmq before 13
+            zmq.device(zmq.QUEUE, self._socket, backend)
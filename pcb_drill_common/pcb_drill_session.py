@@ -0,0 +1,251 @@
+#!/usr/bin/env python2.7
+
+"""
+pcb_drill_session.py - bounded store for the daemon's per session and per file state (holes, tool tables,
+solder masks). Entries unused for longer than a time to live are dropped. When the store is over its
+memory budget the least recently used entries are spilled to disk and loaded back when asked for again.
+"""
+
+import array
+import cPickle
+import collections
+import hashlib
+import os
+import threading
+import time
+
+# Default memory budget in bytes
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+# Default seconds an entry may go unused before it is dropped
+DEFAULT_TTL = 24 * 60 * 60
+_SPILL_SUFFIX = ".pickle"
+
+
+class HoleArray(object):
+    """ Holes as one array per column (x, y and maybe diameter), about 8 bytes a number instead of
+        a tuple of Python objects per hole. A column with None values (e.g. the diameters of a drill
+        file without tools) keeps NaN in their place and a mask of where the None values were. """
+
+    def __init__(self, holes):
+        holes = list(holes)
+        widths = set(len(hole) for hole in holes)
+        if len(widths) > 1:
+            raise ValueError("Holes mix {0} values per hole".format(" and ".join(str(width) for width in sorted(widths))))
+        self._columns = []
+        # Per column None or an array of 1 where the hole's value is None
+        self._missing = []
+        for column in zip(*holes):
+            if any(value is None for value in column):
+                self._missing.append(array.array('B', [value is None for value in column]))
+                column = [float('nan') if value is None else value for value in column]
+            else:
+                self._missing.append(None)
+            self._columns.append(array.array(_typecode(column), column))
+
+    def __len__(self):
+        return len(self._columns[0]) if self._columns else 0
+
+    @property
+    def nbytes(self):
+        return sum(column.itemsize * len(column) for column in self._columns + filter(None, self._missing))
+
+    def holes(self):
+        """ The holes as a list of tuples, as they were given """
+        columns = []
+        for column, missing in zip(self._columns, self._missing):
+            values = column.tolist()
+            if missing is not None:
+                values = [None if gone else value for value, gone in zip(values, missing)]
+            columns.append(values)
+        return zip(*columns)
+
+
+def _typecode(column):
+    """ array typecode that keeps column's values as they are: ints stay ints """
+    if all(isinstance(value, (int, long)) and not isinstance(value, bool) for value in column):
+        return 'l'
+    return 'd'
+
+
+def _size_of(value):
+    """ Bytes value takes in memory, near enough for a budget """
+    if hasattr(value, 'nbytes'):
+        return value.nbytes
+    if isinstance(value, basestring):
+        return len(value)
+    return len(cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL))
+
+
+class SessionStore(object):
+    """ Dictionary with a time to live and a memory budget, entries over the budget go to disk """
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL, clock=time.time):
+        """ Session store
+        Arguments:
+            directory - where entries over the budget are spilled (created if missing, emptied at
+                        start up), None drops them instead
+            max_bytes - memory budget, the most recently used entry is always kept in memory
+            ttl - seconds an entry may go unused before it is dropped (0 keeps entries forever)
+            clock - time source, for tests
+        """
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._clock = clock
+        # key: [value, size, last used], least recently used first
+        self._entries = collections.OrderedDict()
+        # key: (last used, path), for entries on disk
+        self._spilled = {}
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.reloads = 0
+        if directory is not None:
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            # Spilled entries of an earlier daemon belong to sessions that are gone
+            for name in os.listdir(directory):
+                if name.endswith(_SPILL_SUFFIX):
+                    os.remove(os.path.join(directory, name))
+
+    def namespace(self, name):
+        """ View of the entries whose keys are (name, key), so several kinds of state share one budget """
+        return SessionNamespace(self, name)
+
+    def _spill_path(self, key):
+        return os.path.join(self._directory, hashlib.sha1(repr(key)).hexdigest() + _SPILL_SUFFIX)
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._discard(key)
+            size = _size_of(value)
+            self._entries[key] = [value, size, self._clock()]
+            self._bytes += size
+            self._expire()
+            self._evict()
+
+    def __getitem__(self, key):
+        with self._lock:
+            self._expire()
+            entry = self._entries.pop(key, None)
+            if entry is None and key in self._spilled:
+                entry = self._reload(key)
+            if entry is None:
+                self.misses += 1
+                raise KeyError(key)
+            entry[2] = self._clock()
+            self._entries[key] = entry
+            self.hits += 1
+            self._evict()
+            return entry[0]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        with self._lock:
+            self._expire()
+            return key in self._entries or key in self._spilled
+
+    def __delitem__(self, key):
+        with self._lock:
+            if not self._discard(key):
+                raise KeyError(key)
+
+    def __len__(self):
+        with self._lock:
+            self._expire()
+            return len(self._entries) + len(self._spilled)
+
+    def _discard(self, key):
+        """ Forget key wherever it is, returns whether it was there """
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+            return True
+        spilled = self._spilled.pop(key, None)
+        if spilled is not None:
+            try:
+                os.remove(spilled[1])
+            except OSError:
+                pass
+            return True
+        return False
+
+    def _reload(self, key):
+        """ Entry for a spilled key back from disk, None if its file is gone """
+        path = self._spilled.pop(key)[1]
+        try:
+            with open(path, "rb") as spill_file:
+                value = cPickle.load(spill_file)
+            os.remove(path)
+        except (IOError, OSError, EOFError, cPickle.UnpicklingError):
+            return None
+        self.reloads += 1
+        size = _size_of(value)
+        self._bytes += size
+        return [value, size, self._clock()]
+
+    def _expire(self):
+        if self._ttl <= 0:
+            return
+        oldest = self._clock() - self._ttl
+        expired = []
+        # Least recently used first, stop at the first entry still in use
+        for key, entry in self._entries.iteritems():
+            if entry[2] >= oldest:
+                break
+            expired.append(key)
+        expired.extend(key for key, (last_used, path) in self._spilled.iteritems() if last_used < oldest)
+        for key in expired:
+            self._discard(key)
+            self.expirations += 1
+
+    def _evict(self):
+        """ Spill (or drop) least recently used entries until the rest fit in the budget """
+        while self._bytes > self._max_bytes and len(self._entries) > 1:
+            key, (value, size, last_used) = self._entries.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+            if self._directory is not None:
+                path = self._spill_path(key)
+                with open(path, "wb") as spill_file:
+                    cPickle.dump(value, spill_file, cPickle.HIGHEST_PROTOCOL)
+                self._spilled[key] = (last_used, path)
+
+    def stats(self):
+        """ Counters and sizes, e.g. for the daemon's session_stats command """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'expirations': self.expirations, 'reloads': self.reloads,
+                    'entries': len(self._entries), 'spilled': len(self._spilled),
+                    'bytes': self._bytes, 'max_bytes': self._max_bytes}
+
+
+class SessionNamespace(object):
+    """ One kind of state in a SessionStore, used like a dictionary """
+
+    def __init__(self, store, name):
+        self._store = store
+        self._name = name
+
+    def __setitem__(self, key, value):
+        self._store[(self._name, key)] = value
+
+    def __getitem__(self, key):
+        return self._store[(self._name, key)]
+
+    def get(self, key, default=None):
+        return self._store.get((self._name, key), default)
+
+    def __contains__(self, key):
+        return (self._name, key) in self._store
+
+    def __delitem__(self, key):
+        del self._store[(self._name, key)]
@@ -0,0 +1,216 @@
+#!/usr/bin/env python2.7
+
+"""
+pcb_drill_stream.py - live camera preview for browsers. A FrameProducer in the daemon captures and
+encodes each frame once and publishes it on a ZeroMQ XPUB socket, only while someone subscribes. A
+FrameRelay in the web app keeps one subscription for all its viewers and hands each of them the newest
+frame as an MJPEG (multipart/x-mixed-replace) stream: slow viewers skip frames instead of lagging.
+"""
+
+import json
+import logging
+import threading
+import time
+
+import zmq
+
+log = logging.getLogger('pcb_drilld')
+
+TOPIC = "preview"
+# Separates the frames of a multipart/x-mixed-replace response
+BOUNDARY = "pcb_drill_frame"
+MIMETYPE = "multipart/x-mixed-replace; boundary=" + BOUNDARY
+DEFAULT_WIDTH = 640
+DEFAULT_HEIGHT = 480
+DEFAULT_FPS = 10
+DEFAULT_QUALITY = 70
+# Frames queued for a subscriber before newer ones are dropped
+HIGH_WATER_MARK = 2
+# Seconds the relay stays subscribed after its last viewer left
+RELAY_LINGER = 5.0
+# Seconds a viewer waits for a frame before its stream ends
+FRAME_TIMEOUT = 10.0
+
+
+class Frame(object):
+    """ One encoded preview frame """
+
+    def __init__(self, sequence, timestamp, width, height, content_type, data):
+        self.sequence = sequence
+        self.timestamp = timestamp
+        self.width = width
+        self.height = height
+        self.content_type = content_type
+        self.data = data
+
+    def to_frames(self):
+        """ ZeroMQ message parts: topic, JSON header, image bytes """
+        header = {'sequence': self.sequence, 'timestamp': self.timestamp, 'width': self.width,
+                  'height': self.height, 'content_type': self.content_type}
+        return [TOPIC, json.dumps(header), self.data]
+
+    @classmethod
+    def from_frames(cls, frames):
+        header = json.loads(frames[1])
+        return cls(header['sequence'], header['timestamp'], header['width'], header['height'],
+                   header['content_type'], frames[2])
+
+
+class FrameProducer(object):
+    """ Publishes camera frames at a steady rate while anyone subscribes """
+
+    def __init__(self, camera, address, width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, fps=DEFAULT_FPS,
+                 quality=DEFAULT_QUALITY, context=None):
+        """ Frame producer
+        Arguments:
+            camera - pcb_drill_camera.CameraService
+            address - where the XPUB socket binds, e.g. tcp://*:5556
+            width, height - frame size
+            fps - frames per second at most
+            quality - JPEG quality (1-95)
+            context - ZeroMQ context (default the shared instance)
+        """
+        self._camera = camera
+        self.width = int(width)
+        self.height = int(height)
+        self.fps = float(fps)
+        self.quality = int(quality)
+        self._socket = (context or zmq.Context.instance()).socket(zmq.XPUB)
+        self._socket.setsockopt(zmq.SNDHWM, HIGH_WATER_MARK)
+        self._socket.setsockopt(zmq.LINGER, 0)
+        self._socket.bind(address)
+        self._stopped = threading.Event()
+        self.watching = False
+        self.frames = 0
+        self.errors = 0
+        self._thread = threading.Thread(target=self._run, name="pcb_drill_preview")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        interval = 1.0 / self.fps
+        next_frame = time.time()
+        poller = zmq.Poller()
+        poller.register(self._socket, zmq.POLLIN)
+        try:
+            while not self._stopped.is_set():
+                wait = max(0.0, next_frame - time.time()) if self.watching else 0.5
+                if poller.poll(wait * 1000):
+                    # \x01 topic when the first subscriber arrives, \x00 topic when the last leaves
+                    self.watching = self._socket.recv()[:1] == "\x01"
+                    log.info("Preview stream {0}".format("started" if self.watching else "stopped"))
+                    next_frame = time.time()
+                    continue
+                if not self.watching or time.time() < next_frame:
+                    continue
+                next_frame = max(next_frame + interval, time.time())
+                self._publish()
+        finally:
+            self._socket.close()
+
+    def _publish(self):
+        try:
+            data, content_type = self._camera.capture_jpeg(self.width, self.height, self.quality)
+        except Exception as error:
+            # The camera may be busy or gone, the next frame tries again
+            self.errors += 1
+            log.error("Preview capture failed: {0}".format(error))
+            return
+        self.frames += 1
+        frame = Frame(self.frames, time.time(), self.width, self.height, content_type, data)
+        self._socket.send_multipart(frame.to_frames(), copy=False)
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def stats(self):
+        return {'watching': self.watching, 'frames': self.frames, 'errors': self.errors,
+                'width': self.width, 'height': self.height, 'fps': self.fps}
+
+
+class FrameRelay(object):
+    """ One subscription to a FrameProducer shared by every viewer of this process, open while there are
+        viewers (and RELAY_LINGER seconds after) """
+
+    def __init__(self, address, context=None, linger=RELAY_LINGER):
+        """ Frame relay
+        Arguments:
+            address - the producer's socket, e.g. tcp://localhost:5556
+            context - ZeroMQ context (default the shared instance)
+            linger - seconds to stay subscribed without viewers
+        """
+        self._address = address
+        self._context = context or zmq.Context.instance()
+        self._linger = float(linger)
+        self._condition = threading.Condition()
+        self._frame = None
+        self._viewers = 0
+        self._thread = None
+
+    def _run(self):
+        socket = self._context.socket(zmq.SUB)
+        socket.setsockopt(zmq.RCVHWM, HIGH_WATER_MARK)
+        socket.setsockopt(zmq.LINGER, 0)
+        socket.setsockopt(zmq.SUBSCRIBE, TOPIC)
+        socket.connect(self._address)
+        poller = zmq.Poller()
+        poller.register(socket, zmq.POLLIN)
+        idle_since = None
+        try:
+            while True:
+                if poller.poll(250):
+                    frame = Frame.from_frames(socket.recv_multipart())
+                    with self._condition:
+                        self._frame = frame
+                        self._condition.notify_all()
+                with self._condition:
+                    if self._viewers:
+                        idle_since = None
+                    elif idle_since is None:
+                        idle_since = time.time()
+                    elif time.time() - idle_since >= self._linger:
+                        self._thread = None
+                        self._frame = None
+                        return
+        finally:
+            socket.close()
+
+    def frames(self, timeout=FRAME_TIMEOUT):
+        """ Generator of the newest frame each time there is a new one, ends when no frame arrives
+            within timeout seconds """
+        with self._condition:
+            self._viewers += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="pcb_drill_preview_relay")
+                self._thread.daemon = True
+                self._thread.start()
+        try:
+            sequence = None
+            while True:
+                with self._condition:
+                    deadline = time.time() + timeout
+                    while self._frame is None or self._frame.sequence == sequence:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            return
+                        self._condition.wait(remaining)
+                    frame = self._frame
+                sequence = frame.sequence
+                yield frame
+        finally:
+            with self._condition:
+                self._viewers -= 1
+
+    @property
+    def viewers(self):
+        return self._viewers
+
+
+def mjpeg_parts(frames):
+    """ Body of a multipart/x-mixed-replace response (see MIMETYPE) showing frames one after another """
+    for frame in frames:
+        yield "--{0}\r\nContent-Type: {1}\r\nContent-Length: {2}\r\n\r\n".format(
+            BOUNDARY, frame.content_type, len(frame.data))
+        yield frame.data
+        yield "\r\n"
@@ -0,0 +1,146 @@
+#!/usr/bin/env python2.7
+
+"""
+pcb_drill_tools.py - drill bits (tools) and sorting holes onto them by diameter
+"""
+
+import bisect
+import math
+
+try:
+    import numpy
+except ImportError:
+    # Only needed to group numpy hole arrays
+    numpy = None
+
+MM_PER_INCH = 25.4
+
+
+def equivalent_diameter(area):
+    """ Diameter of the circle with the same area (e.g. of a blob) """
+    return 2.0 * math.sqrt(area / math.pi)
+
+
+def diameters_to_mm(holes, mm_per_pixel):
+    """ (x, y, diameter) holes of a solder mask, diameters in pixels, with the diameters in mm so a tool
+        table in mm can sort them. x and y stay as they are. With mm_per_pixel None (the scale is not known)
+        the diameters are dropped and every hole goes to the smallest tool."""
+    if mm_per_pixel is None:
+        return [tuple(hole[:2]) for hole in holes]
+    return [tuple(hole[:2]) + (hole[2] * mm_per_pixel,) if len(hole) > 2 else tuple(hole) for hole in holes]
+
+
+class DrillTool(object):
+    """ One drill bit and the feeds used to drill with it """
+
+    def __init__(self, number, diameter, depth=-0.5, plunge_feed=100, retract_height=3.0, retract_feed=3000):
+        """ Drill tool
+        Arguments:
+            number - tool number (T1, T2, ...)
+            diameter - bit diameter in the same units as the hole coordinates
+            depth - Z to plunge to
+            plunge_feed - feed rate while drilling
+            retract_height - Z to retract to after each hole
+            retract_feed - feed rate while retracting
+        """
+        self.number = int(number)
+        self.diameter = float(diameter)
+        self.depth = depth
+        self.plunge_feed = plunge_feed
+        self.retract_height = retract_height
+        self.retract_feed = retract_feed
+
+    @property
+    def drill_command(self):
+        return "G1 Z{0:g} F{1:g}".format(self.depth, self.plunge_feed)
+
+    @property
+    def retract_command(self):
+        return "G1 Z{0:g} F{1:g}".format(self.retract_height, self.retract_feed)
+
+    def __str__(self):
+        return "T{0} ({1:g})".format(self.number, self.diameter)
+
+    def __repr__(self):
+        return "DrillTool({0}, {1!r})".format(self.number, self.diameter)
+
+
+class ToolTable(object):
+    """ The drill bits available for a job. Each hole goes to the tool with the closest diameter."""
+
+    def __init__(self, tools):
+        if len(tools) == 0:
+            raise ValueError("A tool table needs at least one tool")
+        self._tools = sorted(tools, key=lambda tool: tool.diameter)
+        # A hole is closest to tool i when its diameter is below boundary i
+        self._boundaries = [(smaller.diameter + larger.diameter) / 2.0
+                            for smaller, larger in zip(self._tools, self._tools[1:])]
+
+    def __iter__(self):
+        return iter(self._tools)
+
+    def __len__(self):
+        return len(self._tools)
+
+    def tool_for(self, diameter):
+        """ Closest tool for a hole diameter (the smallest tool when diameter is None)"""
+        if diameter is None:
+            return self._tools[0]
+        return self._tools[bisect.bisect_left(self._boundaries, diameter)]
+
+    def group(self, holes):
+        """ Sort holes onto tools in a single pass over the holes.
+        Arguments:
+            holes - sequence of (x, y, diameter) ((x, y) holes go to the smallest tool)
+                    or a numpy N x 3 / N x 2 array
+        Returns a list of (tool, holes) in ascending tool diameter, skipping unused tools.
+        """
+        if numpy is not None and isinstance(holes, numpy.ndarray):
+            return self._group_array(holes)
+        groups = [[] for tool in self._tools]
+        boundaries = self._boundaries
+        for hole in holes:
+            if len(hole) > 2:
+                groups[bisect.bisect_left(boundaries, hole[2])].append(hole)
+            else:
+                groups[0].append(hole)
+        return [(tool, group) for tool, group in zip(self._tools, groups) if len(group) > 0]
+
+    def _group_array(self, holes):
+        if holes.shape[1] > 2:
+            indexes = numpy.searchsorted(numpy.array(self._boundaries), holes[:, 2])
+        else:
+            indexes = numpy.zeros(len(holes), dtype=int)
+        # Stable so holes keep their relative order within a tool
+        order = numpy.argsort(indexes, kind='mergesort')
+        counts = numpy.bincount(indexes, minlength=len(self._tools))
+        groups = []
+        begin = 0
+        for tool, count in zip(self._tools, counts):
+            if count > 0:
+                groups.append((tool, holes[order[begin:begin + count]]))
+            begin += count
+        return groups
+
+
+def parse_tool_table(text):
+    """ Parse a tool table from the config file, e.g.
+            T1 0.8, T2 1.0 plunge_feed=80, T3 1.2 depth=-1.6
+        Returns None for an empty table"""
+    tools = []
+    for entry in text.split(","):
+        fields = entry.split()
+        if len(fields) == 0:
+            continue
+        if len(fields) < 2 or not fields[0].upper().startswith("T"):
+            raise ValueError("Tool table entry {0!r} should look like T1 0.8 [option=value ...]".format(entry))
+        options = {}
+        for field in fields[2:]:
+            name, _, value = field.partition("=")
+            if name not in ("depth", "plunge_feed", "retract_height", "retract_feed"):
+                raise ValueError("Unknown tool option {0!r}".format(name))
+            options[name] = float(value)
+        tools.append(DrillTool(fields[0][1:], fields[1], **options))
+    if len(tools) == 0:
+        return None
+    return ToolTable(tools)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python2.7
+
+"""
+pcb_drill_transport.py - the framing PcbDrillClient and PcbDrillServer speak over ZeroMQ.
+
+A message without binary data is one JSON frame, as it always was. A message with Binary values (e.g. an
+uploaded solder mask or a rendered overlay) is multipart:
+    frame 0 - marker naming the envelope format (msgpack when installed, json otherwise)
+    frame 1 - the envelope: the message with every Binary replaced by {'__binary__': frame number}
+    frame 2.. - the raw bytes, sent and received without copying (copy=False)
+so images never pass through JSON or the disk on their way between the web app and the daemon.
+"""
+
+import json
+
+try:
+    import msgpack
+except ImportError:
+    # The envelope falls back to json, images still travel in their own frames
+    msgpack = None
+
+ENVELOPE_FORMATS = ("msgpack", "json")
+_MARKER = "pcb_drill/1 "
+_PLACEHOLDER = "__binary__"
+
+
+class Binary(object):
+    """ Bytes (str, bytearray, buffer, memoryview or numpy array) to send in a frame of their own """
+
+    def __init__(self, data):
+        self.data = data
+
+    def __len__(self):
+        return len(self.data)
+
+
+def to_bytes(data):
+    """ str copy of a received binary value (memoryview, buffer or str) """
+    if hasattr(data, 'tobytes'):
+        return data.tobytes()
+    return str(data)
+
+
+def default_envelope():
+    """ Envelope format used when none is asked for """
+    return "msgpack" if msgpack is not None else "json"
+
+
+def _pack(envelope, data):
+    if envelope == "msgpack":
+        return msgpack.packb(data)
+    return json.dumps(data)
+
+
+def _unpack(envelope, data):
+    if envelope == "msgpack":
+        if msgpack is None:
+            raise ValueError("Received a msgpack envelope but msgpack is not installed")
+        return msgpack.unpackb(data)
+    return json.loads(data)
+
+
+def _extract(value, frames):
+    """ value with every Binary moved to frames and replaced by a placeholder """
+    if isinstance(value, Binary):
+        frames.append(value.data)
+        return {_PLACEHOLDER: len(frames) + 1}
+    if isinstance(value, dict):
+        return dict((key, _extract(item, frames)) for key, item in value.iteritems())
+    if isinstance(value, (list, tuple)):
+        return [_extract(item, frames) for item in value]
+    return value
+
+
+def _restore(value, frames):
+    """ Undo _extract, placeholders become the frames' buffers """
+    if isinstance(value, dict):
+        if len(value) == 1 and _PLACEHOLDER in value:
+            return frames[value[_PLACEHOLDER]]
+        return dict((key, _restore(item, frames)) for key, item in value.iteritems())
+    if isinstance(value, list):
+        return [_restore(item, frames) for item in value]
+    return value
+
+
+def encode_message(data, envelope=None):
+    """ Frames for data, a single JSON frame unless data holds Binary values
+    Arguments:
+        data - request or response (dict), Binary values may be nested in dicts and lists
+        envelope - msgpack or json (see ENVELOPE_FORMATS), default_envelope() when None
+    """
+    frames = []
+    body = _extract(data, frames)
+    if not frames:
+        return [json.dumps(data)]
+    envelope = envelope or default_envelope()
+    if envelope not in ENVELOPE_FORMATS:
+        raise ValueError("Unknown envelope {0}, expected one of {1}".format(envelope, ", ".join(ENVELOPE_FORMATS)))
+    return [_MARKER + envelope, _pack(envelope, body)] + frames
+
+
+def _frame_bytes(frame):
+    return frame.bytes if hasattr(frame, 'bytes') else frame
+
+
+def _frame_buffer(frame):
+    return frame.buffer if hasattr(frame, 'buffer') else frame
+
+
+def decode_message(frames):
+    """ (message, envelope) of frames from recv_multipart (copy=True or copy=False), envelope is None for
+        a plain JSON frame. Binary values are read only buffers over the received frames (memoryview or
+        str), to_bytes makes a copy if one is needed"""
+    if len(frames) == 1:
+        return json.loads(_frame_bytes(frames[0])), None
+    marker = _frame_bytes(frames[0])
+    if not marker.startswith(_MARKER):
+        raise ValueError("Not a pcb_drill message: {0!r}".format(marker[:40]))
+    envelope = marker[len(_MARKER):]
+    body = _unpack(envelope, _frame_bytes(frames[1]))
+    return _restore(body, [_frame_buffer(frame) for frame in frames]), envelope
+
+
+def send_message(socket, data, envelope=None):
+    """ Send data on a ZeroMQ socket, binary frames without copying """
+    socket.send_multipart(encode_message(data, envelope), copy=False)
+
+
+def recv_message(socket):
+    """ (message, envelope) sent with send_message (or as a plain JSON frame) """
+    return decode_message(socket.recv_multipart(copy=False))
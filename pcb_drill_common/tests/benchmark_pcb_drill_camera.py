@@ -0,0 +1,81 @@
+#!/usr/bin/env python2.7
+
+"""
+benchmark_pcb_drill_camera.py - capture to result latency: from asking for an image to having its holes,
+with the fake camera so it runs on any Linux box, e.g.
+    python benchmark_pcb_drill_camera.py --warm-up 0.5 --exposure 0.03
+cold  - what capture_image used to do: open the camera, capture, write a PNG, read it back, find holes
+warm  - CameraService: the camera stays open and the holes are found in the capture buffer
+burst - warm, averaging a burst of --frames video port captures
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy
+
+# Insert Path for project ../ from here
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pcb_drill_blobs import find_blobs
+from pcb_drill_camera import CameraService, FakeCameraBackend, average_frames, read_rgb, save_image
+
+MODES = ("cold", "warm", "burst")
+
+
+def run_case(mode, shots=10, width=1024, height=768, warm_up=0.5, exposure=0.03, frames=4, source=None):
+    """ Seconds per result and the holes found for one mode """
+    backend = FakeCameraBackend(source, warm_up=warm_up, exposure=exposure)
+    directory = tempfile.mkdtemp()
+    service = CameraService(backend, idle_timeout=60)
+    try:
+        begin = time.time()
+        for shot in xrange(shots):
+            if mode == "cold":
+                backend.open()
+                capture = numpy.empty(backend.frame_shape(width, height), dtype=numpy.uint8)
+                backend.capture(capture, width, height)
+                backend.close()
+                filename = os.path.join(directory, "capture_{0}.png".format(shot))
+                save_image(capture[:height, :width], filename)
+                image = read_rgb(filename)
+            elif mode == "warm":
+                image = service.capture(width, height)
+            else:
+                image = average_frames(service.capture_burst(frames, width, height))
+            holes = find_blobs(image).holes()
+        seconds = (time.time() - begin) / shots
+    finally:
+        service.close()
+        shutil.rmtree(directory)
+    return {'mode': mode, 'seconds': seconds, 'holes': len(holes), 'width': width, 'height': height,
+            'warm_up': warm_up, 'exposure': exposure, 'frames': frames if mode == "burst" else 1}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Capture to result latency with the fake camera")
+    parser.add_argument('--modes', nargs='+', default=MODES, choices=MODES)
+    parser.add_argument('--shots', type=int, default=10, help="results per mode")
+    parser.add_argument('--width', type=int, default=1024)
+    parser.add_argument('--height', type=int, default=768)
+    parser.add_argument('--warm-up', type=float, default=0.5, help="seconds the fake sensor takes to open")
+    parser.add_argument('--exposure', type=float, default=0.03, help="seconds per fake capture")
+    parser.add_argument('--frames', type=int, default=4, help="captures averaged in burst mode")
+    parser.add_argument('--source', help="image the fake camera sees (default: a synthetic board)")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    args = parser.parse_args()
+    results = []
+    for mode in args.modes:
+        result = run_case(mode, args.shots, args.width, args.height, args.warm_up, args.exposure,
+                          args.frames, args.source)
+        results.append(result)
+        print "{0:6} {1:8.1f} ms per result ({2} holes)".format(mode, result['seconds'] * 1000, result['holes'])
+        sys.stdout.flush()
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2, sort_keys=True)
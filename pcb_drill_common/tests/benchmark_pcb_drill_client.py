@@ -0,0 +1,65 @@
+#!/usr/bin/env python2.7
+
+"""
+benchmark_pcb_drill_client.py - per request cost of talking to the daemon from the web app, against a
+local PcbDrillServer answering ping, e.g.
+    python benchmark_pcb_drill_client.py --requests 500
+new    - what the web app used to do: a new context, REQ socket and connect for every request
+pooled - ClientPool: requests borrow an open connection
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+# Insert Path for project ../ from here
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pcb_drill_client import ClientPool, PcbDrillClient
+from load_test_pcb_drill_server import start_server
+
+MODES = ("new", "pooled")
+
+
+def run_case(mode, address, requests=200):
+    """ Seconds per ping round trip for one mode """
+    pool = ClientPool(address)
+    try:
+        begin = time.time()
+        for _ in xrange(requests):
+            if mode == "new":
+                daemon = PcbDrillClient()
+                daemon.connect(address)
+                response = daemon('ping')
+                # The old clients were never closed, closing them here only makes "new" look better
+                daemon.close()
+                daemon._context.term()
+            else:
+                response = pool('ping')
+            if not response.get('success'):
+                raise RuntimeError(response)
+        seconds = (time.time() - begin) / requests
+    finally:
+        pool.close()
+    return {'mode': mode, 'seconds': seconds, 'requests': requests}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per request overhead of daemon connections")
+    parser.add_argument('--modes', nargs='+', default=MODES, choices=MODES)
+    parser.add_argument('--requests', type=int, default=200, help="requests per mode")
+    parser.add_argument('--server-mode', default="router", choices=("rep", "router"))
+    parser.add_argument('--output', help="write the results to this JSON file")
+    args = parser.parse_args()
+    address = start_server(args.server_mode, 2)
+    results = []
+    for mode in args.modes:
+        result = run_case(mode, address, args.requests)
+        results.append(result)
+        print "{0:6} {1:8.3f} ms per request".format(mode, result['seconds'] * 1000)
+        sys.stdout.flush()
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2, sort_keys=True)
@@ -0,0 +1,222 @@
+#!/usr/bin/env python2.7
+
+"""
+benchmark_pcb_drill_gcode.py - how PcbDrillGCode scales from 10 to 1M holes
+
+Writes JSON results that can be kept as a baseline and compared against later runs, e.g.
+    python benchmark_pcb_drill_gcode.py --output baseline.json
+    python benchmark_pcb_drill_gcode.py --baseline baseline.json
+exits with status 1 when a case got slower or bigger than the baseline allows.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import sys
+import time
+
+# Insert Path for project ../ from here
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2: peak memory comes from the resident set size of a child process instead
+    tracemalloc = None
+
+from pcb_drill_gcode import PcbDrillGCode
+
+SIZES = (10, 100, 1000, 10000, 100000, 1000000)
+LAYOUTS = ("uniform", "clustered")
+# generate: list of tuples through generate(), bulk: numpy array through generate()
+MODES = ("generate", "bulk")
+BOARD_WIDTH = 160.0
+BOARD_HEIGHT = 100.0
+# Allowed growth over the baseline before a case counts as a regression
+DEFAULT_TOLERANCE = 0.2
+# Baseline values below these are noise and never count as regressions
+NOISE_FLOOR = {'seconds': 0.001, 'peak_memory_bytes': 1 << 20, 'output_bytes': 0}
+
+
+def uniform_holes(count, seed=1):
+    """ count holes spread evenly over the board """
+    generator = random.Random(seed)
+    return [(generator.uniform(0, BOARD_WIDTH), generator.uniform(0, BOARD_HEIGHT)) for _ in xrange(count)]
+
+
+def _footprint(generator):
+    """ Pin offsets of a random IC footprint: DIP, SOIC style dual rows or a QFP style square """
+    kind = generator.choice(("dip", "dual", "quad"))
+    if kind == "dip":
+        pins, pitch, span = generator.choice((8, 14, 16, 20, 28, 40)), 2.54, 7.62
+    elif kind == "dual":
+        pins, pitch, span = generator.choice((8, 14, 16, 20)), 1.27, 5.4
+    else:
+        pins, pitch = generator.choice((32, 44, 64, 100)), 0.8
+        side = pins // 4
+        length = (side - 1) * pitch
+        offsets = []
+        for index in xrange(side):
+            along = index * pitch - length / 2
+            offsets.extend([(along, -length / 2 - 1), (length / 2 + 1, along),
+                            (-along, length / 2 + 1), (-length / 2 - 1, -along)])
+        return offsets
+    half = pins // 2
+    length = (half - 1) * pitch
+    return ([(index * pitch - length / 2, -span / 2) for index in xrange(half)] +
+            [(index * pitch - length / 2, span / 2) for index in xrange(half)])
+
+
+def clustered_holes(count, seed=1):
+    """ count holes laid out like a real board: IC footprints plus a sprinkling of vias.
+        Bigger counts tile more boards side by side (a panel)."""
+    generator = random.Random(seed)
+    holes = []
+    while len(holes) < count:
+        board = len(holes) // 2000
+        origin_x = (board % 10) * (BOARD_WIDTH + 5)
+        origin_y = (board // 10) * (BOARD_HEIGHT + 5)
+        if generator.random() < 0.2:
+            holes.append((origin_x + generator.uniform(0, BOARD_WIDTH),
+                          origin_y + generator.uniform(0, BOARD_HEIGHT)))
+            continue
+        center_x = origin_x + generator.uniform(10, BOARD_WIDTH - 10)
+        center_y = origin_y + generator.uniform(10, BOARD_HEIGHT - 10)
+        holes.extend((center_x + x, center_y + y) for x, y in _footprint(generator))
+    return holes[:count]
+
+
+def synthetic_holes(layout, count, seed=1):
+    if layout == "uniform":
+        return uniform_holes(count, seed)
+    if layout == "clustered":
+        return clustered_holes(count, seed)
+    raise ValueError("Unknown layout {0}, expected one of {1}".format(layout, ", ".join(LAYOUTS)))
+
+
+def _current_rss():
+    """ Resident set size in bytes right now (Linux) """
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * resource.getpagesize()
+
+
+def run_case(layout, count, mode, ordering=None):
+    """ Time one generate() call, returns a result dict """
+    holes = synthetic_holes(layout, count)
+    precision = None
+    if mode == "bulk":
+        if numpy is None:
+            raise ValueError("The bulk mode needs numpy")
+        holes = numpy.array(holes, dtype=float)
+        precision = 3
+    gcode_generator = PcbDrillGCode(hole_ordering=ordering, coordinate_precision=precision)
+    gcode_generator.drill_holes(holes)
+    if tracemalloc is not None:
+        tracemalloc.start()
+    else:
+        rss_before = _current_rss()
+    begin = time.time()
+    gcode = gcode_generator.generate()
+    seconds = time.time() - begin
+    if tracemalloc is not None:
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    else:
+        # ru_maxrss is in KB on Linux
+        peak_memory = max(0, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 - rss_before)
+    return {'layout': layout, 'holes': count, 'mode': mode, 'ordering': ordering or "none",
+            'seconds': seconds, 'holes_per_second': count / seconds if seconds > 0 else None,
+            'peak_memory_bytes': peak_memory, 'output_bytes': len(gcode)}
+
+
+def _run_case_in_child(queue, args):
+    try:
+        queue.put(run_case(*args))
+    except Exception as error:
+        queue.put({'error': repr(error)})
+
+
+def run_isolated(layout, count, mode, ordering=None):
+    """ run_case in a fresh process so each case's peak memory is its own """
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_run_case_in_child, args=(queue, (layout, count, mode, ordering)))
+    process.start()
+    result = queue.get()
+    process.join()
+    if 'error' in result:
+        raise RuntimeError("{0} {1} {2}: {3}".format(layout, count, mode, result['error']))
+    return result
+
+
+def run_benchmarks(sizes=SIZES, layouts=LAYOUTS, modes=MODES, ordering=None, repeat=1):
+    """ Run every case, keeping the fastest of repeat runs """
+    results = []
+    for mode in modes:
+        for layout in layouts:
+            for count in sizes:
+                runs = [run_isolated(layout, count, mode, ordering) for _ in xrange(repeat)]
+                best = min(runs, key=lambda run: run['seconds'])
+                best['peak_memory_bytes'] = min(run['peak_memory_bytes'] for run in runs)
+                results.append(best)
+                print "{mode:8} {layout:9} {holes:>8} holes {seconds:8.3f}s {peak_memory_bytes:>12} bytes peak " \
+                      "{output_bytes:>11} bytes out".format(**best)
+                sys.stdout.flush()
+    return {'python': platform.python_version(), 'platform': platform.platform(),
+            'machine': platform.machine(), 'numpy': numpy.__version__ if numpy is not None else None,
+            'memory': "tracemalloc" if tracemalloc is not None else "rss",
+            'date': time.strftime("%Y-%m-%d %H:%M:%S"), 'results': results}
+
+
+def compare_results(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """ Cases that are slower, use more memory or write more than baseline (+tolerance)
+        Returns a list of (case, measure, baseline value, new value)"""
+    def key(result):
+        return (result['layout'], result['holes'], result['mode'], result.get('ordering', "none"))
+    baseline_results = dict((key(result), result) for result in baseline['results'])
+    regressions = []
+    for result in results['results']:
+        before = baseline_results.get(key(result))
+        if before is None:
+            continue
+        for measure in ('seconds', 'peak_memory_bytes', 'output_bytes'):
+            if before[measure] < NOISE_FLOOR[measure]:
+                continue
+            if result[measure] > before[measure] * (1 + tolerance):
+                regressions.append((key(result), measure, before[measure], result[measure]))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark PcbDrillGCode.generate()")
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help="hole counts")
+    parser.add_argument('--layouts', nargs='+', default=LAYOUTS, choices=LAYOUTS)
+    parser.add_argument('--modes', nargs='+', default=MODES if numpy is not None else ("generate",), choices=MODES)
+    parser.add_argument('--ordering', default=None, help="hole ordering to benchmark with (default none)")
+    parser.add_argument('--repeat', type=int, default=1, help="runs per case, the fastest is kept")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--baseline', help="compare against results from an earlier --output")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="allowed growth over the baseline (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sizes, args.layouts, args.modes, args.ordering, args.repeat)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare_results(results, json.load(baseline_file), args.tolerance)
+        for case, measure, before, after in regressions:
+            print "REGRESSION {0}: {1} {2} -> {3}".format(" ".join(str(part) for part in case), measure, before, after)
+        if regressions:
+            sys.exit(1)
+        print "No regressions against {0}".format(args.baseline)
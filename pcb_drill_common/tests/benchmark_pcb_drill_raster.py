@@ -0,0 +1,146 @@
+#!/usr/bin/env python2.7
+
+"""
+benchmark_pcb_drill_raster.py - how fast png_to_pgm decodes big solder masks strip by strip, e.g.
+    python benchmark_pcb_drill_raster.py --megapixels 1 9 --output results.json
+    python benchmark_pcb_drill_raster.py --png panel_1200dpi.png
+The synthetic masks are RGB boards with anti-aliased holes, filtered row by row with libpng's adaptive
+heuristic (the filter whose output has the smallest sum of absolute values), so they have the mix of
+Sub, Up, Average and Paeth rows that masks exported by drawing programs have.
+pil    - rows unfiltered by PIL's C decoder (needs PIL)
+python - rows unfiltered with numpy, Paeth and Average rows in Python
+"""
+
+import argparse
+import json
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import zlib
+
+# Insert Path for project ../ from here
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy
+
+import pcb_drill_raster
+from pcb_drill_raster import PNG_SIGNATURE, png_to_pgm
+
+DECODERS = ("pil", "python")
+MEGAPIXELS = (1, 9)
+
+
+def synthetic_mask(width, height, pitch=40, radius=7.5, seed=1):
+    """ height x width x 3 uint8 light board with a grid of dark holes with soft edges and some noise """
+    random = numpy.random.RandomState(seed)
+    y, x = numpy.ogrid[:height, :width]
+    distance = numpy.hypot(x % pitch - pitch / 2.0, y % pitch - pitch / 2.0)
+    # Anti-aliased edge about two pixels wide
+    gray = numpy.clip((distance - radius) * 100.0 + 120.0, 20, 230)
+    board = numpy.empty((height, width, 3), dtype=numpy.uint8)
+    for channel, tint in enumerate((1.0, 0.9, 0.75)):
+        board[..., channel] = numpy.clip(gray * tint + random.randint(-3, 4, (height, width)), 0, 255)
+    return board
+
+
+def _filtered(kind, row, previous, pixel_bytes):
+    """ row (int16 bytes) filtered with PNG filter kind, before wrapping to a byte """
+    left = numpy.zeros_like(row)
+    left[pixel_bytes:] = row[:-pixel_bytes]
+    upper_left = numpy.zeros_like(previous)
+    upper_left[pixel_bytes:] = previous[:-pixel_bytes]
+    if kind == 0:
+        return row
+    if kind == 1:
+        return row - left
+    if kind == 2:
+        return row - previous
+    if kind == 3:
+        return row - ((left + previous) >> 1)
+    estimate = left + previous - upper_left
+    distance_left = numpy.abs(estimate - left)
+    distance_up = numpy.abs(estimate - previous)
+    distance_upper_left = numpy.abs(estimate - upper_left)
+    predictor = numpy.where((distance_left <= distance_up) & (distance_left <= distance_upper_left), left,
+                            numpy.where(distance_up <= distance_upper_left, previous, upper_left))
+    return row - predictor
+
+
+def encode_adaptive_png(output_file, image, level=6):
+    """ Write image (height x width x 3 uint8) as a PNG with libpng's adaptive filter choice per row,
+        returns how many rows got each filter type """
+    height, width = image.shape[:2]
+    compressor = zlib.compressobj(level)
+    output_file.write(PNG_SIGNATURE)
+    output_file.write(pcb_drill_raster._png_chunk("IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+    previous = numpy.zeros(width * 3, dtype=numpy.int16)
+    counts = [0] * 5
+    for row in image.reshape(height, -1).astype(numpy.int16):
+        candidates = [(_filtered(kind, row, previous, 3) & 0xff).astype(numpy.uint8) for kind in xrange(5)]
+        # Bytes as signed values, smallest sum of magnitudes wins
+        sums = [numpy.abs(candidate.view(numpy.int8).astype(numpy.int32)).sum() for candidate in candidates]
+        kind = sums.index(min(sums))
+        counts[kind] += 1
+        data = compressor.compress(chr(kind) + candidates[kind].tostring())
+        if data:
+            output_file.write(pcb_drill_raster._png_chunk("IDAT", data))
+        previous = row
+    output_file.write(pcb_drill_raster._png_chunk("IDAT", compressor.flush()))
+    output_file.write(pcb_drill_raster._png_chunk("IEND", ""))
+    return counts
+
+
+def run_case(png_filename, decoder, directory):
+    """ Seconds png_to_pgm takes for png_filename with one decoder """
+    image_module = pcb_drill_raster.Image
+    if decoder == "python":
+        pcb_drill_raster.Image = None
+    elif image_module is None:
+        raise ValueError("The pil decoder needs PIL")
+    try:
+        begin = time.time()
+        header = png_to_pgm(png_filename, os.path.join(directory, "mask.pgm"))
+        seconds = time.time() - begin
+    finally:
+        pcb_drill_raster.Image = image_module
+    megapixels = header.pixels / 1e6
+    return {'png': os.path.basename(png_filename), 'decoder': decoder, 'megapixels': megapixels,
+            'seconds': seconds, 'seconds_per_megapixel': seconds / megapixels}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Strip by strip PNG decoding speed")
+    parser.add_argument('--megapixels', nargs='+', type=float, default=MEGAPIXELS,
+                        help="sizes of synthetic adaptive filtered masks")
+    parser.add_argument('--png', nargs='+', default=[], help="real PNG masks to decode as well")
+    parser.add_argument('--decoders', nargs='+', default=DECODERS, choices=DECODERS)
+    parser.add_argument('--output', help="write the results to this JSON file")
+    args = parser.parse_args()
+    decoders = [decoder for decoder in args.decoders if decoder != "pil" or pcb_drill_raster.Image is not None]
+    directory = tempfile.mkdtemp()
+    results = []
+    try:
+        pngs = list(args.png)
+        for megapixels in args.megapixels:
+            side = int(round((megapixels * 1e6) ** 0.5))
+            png = os.path.join(directory, "adaptive_{0}.png".format(side))
+            with open(png, "wb") as png_file:
+                counts = encode_adaptive_png(png_file, synthetic_mask(side, side))
+            print "{0}: {1} x {1}, rows by filter (none, sub, up, average, paeth) {2}".format(
+                os.path.basename(png), side, counts)
+            pngs.append(png)
+        for png in pngs:
+            for decoder in decoders:
+                result = run_case(png, decoder, directory)
+                results.append(result)
+                print "{0:24} {1:6} {2:7.1f} Mpx {3:8.2f} s {4:6.2f} s/Mpx".format(
+                    result['png'], decoder, result['megapixels'], result['seconds'], result['seconds_per_megapixel'])
+                sys.stdout.flush()
+    finally:
+        shutil.rmtree(directory)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2, sort_keys=True)
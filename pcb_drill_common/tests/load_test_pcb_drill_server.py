@@ -0,0 +1,101 @@
+#!/usr/bin/env python2.7
+
+"""
+load_test_pcb_drill_server.py - requests per second PcbDrillServer answers for several concurrent
+clients, one REP socket against the ROUTER/DEALER worker pool, e.g.
+    python load_test_pcb_drill_server.py --clients 1 2 4 8 --work 0.02
+Each request does --work seconds of work that releases the GIL (like a camera capture, file I/O or
+numpy), the way most daemon commands spend their time.
+"""
+
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+# Insert Path for project ../ from here
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pcb_drill_client import PcbDrillClient
+from pcb_drill_server import PcbDrillServer
+
+CLIENTS = (1, 2, 4, 8)
+# (mode, server workers)
+SERVERS = (("rep", 1), ("router", 2), ("router", 4), ("router", 8))
+
+
+class LoadTestRPC(object):
+    """ Commands with a known cost """
+
+    def work(self, seconds):
+        time.sleep(float(seconds))
+        return {'slept': seconds}
+
+    def ping(self):
+        return "pong"
+
+
+def _free_port():
+    probe = socket.socket()
+    probe.bind(("127.0.0.1", 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    return port
+
+
+def start_server(mode, workers, rpc=None, resources=None, job_commands=()):
+    """ Serve rpc (LoadTestRPC by default) in a background thread, returns its address """
+    address = "tcp://127.0.0.1:{0}".format(_free_port())
+    server = PcbDrillServer(rpc or LoadTestRPC(), job_workers=1, mode=mode, workers=workers, resources=resources,
+                            job_commands=job_commands)
+    server.bind(address)
+    thread = threading.Thread(target=server.run)
+    thread.daemon = True
+    thread.start()
+    return address
+
+
+def run_clients(address, clients, requests, work):
+    """ clients threads sending requests each, returns requests per second """
+    def client():
+        daemon = PcbDrillClient()
+        daemon.connect(address)
+        for _ in xrange(requests):
+            response = daemon('work', seconds=work)
+            if not response.get('success'):
+                raise RuntimeError(response)
+    threads = [threading.Thread(target=client) for _ in xrange(clients)]
+    begin = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return clients * requests / (time.time() - begin)
+
+
+def run_load_test(clients=CLIENTS, servers=SERVERS, requests=20, work=0.02):
+    results = []
+    for mode, workers in servers:
+        address = start_server(mode, workers)
+        for count in clients:
+            rate = run_clients(address, count, requests, work)
+            results.append({'mode': mode, 'workers': workers, 'clients': count, 'requests_per_second': rate})
+            print "{0:6} {1:>2} workers {2:>2} clients {3:8.1f} requests/s".format(mode, workers, count, rate)
+            sys.stdout.flush()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test PcbDrillServer with concurrent clients")
+    parser.add_argument('--clients', type=int, nargs='+', default=CLIENTS, help="concurrent clients")
+    parser.add_argument('--requests', type=int, default=20, help="requests per client")
+    parser.add_argument('--work', type=float, default=0.02, help="seconds of work per request")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    args = parser.parse_args()
+    results = run_load_test(args.clients, SERVERS, args.requests, args.work)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2, sort_keys=True)
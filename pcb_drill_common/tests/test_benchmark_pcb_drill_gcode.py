@@ -0,0 +1,26 @@
+import unittest
+import sys
+import os
+
+# Insert Path for project ../ from here
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from benchmark_pcb_drill_gcode import compare_results, run_case, synthetic_holes
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_layouts(self):
+        for layout in ("uniform", "clustered"):
+            self.assertEqual(len(synthetic_holes(layout, 1234)), 1234)
+            self.assertEqual(synthetic_holes(layout, 50), synthetic_holes(layout, 50))
+        self.assertRaises(ValueError, synthetic_holes, "spiral", 10)
+
+    def test_compare_results(self):
+        """ Only growth beyond the tolerance on measurable cases is a regression"""
+        result = run_case("clustered", 100, "generate")
+        self.assertEqual(result['holes'], 100)
+        baseline = {'results': [dict(result, seconds=1.0, output_bytes=1000)]}
+        results = {'results': [dict(result, seconds=1.1, output_bytes=2000)]}
+        self.assertEqual([(measure, before, after) for case, measure, before, after
+                          in compare_results(results, baseline)], [('output_bytes', 1000, 2000)])
+        self.assertEqual(compare_results(results, {'results': []}), [])
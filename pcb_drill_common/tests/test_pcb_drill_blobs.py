@@ -0,0 +1,93 @@
+import unittest
+import sys
+import os
+
+# Insert Path for project ../ from here
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import SimpleCV
+except ImportError:
+    SimpleCV = None
+
+if numpy is not None:
+    from pcb_drill_blobs import find_blobs, histogram, otsu_threshold, read_image
+    from pcb_drill_raster import iter_png_strips
+
+SOLDER_MASK = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           '..', '..', 'pcb_drilld', 'tests', 'functional', 'solder_mask_test.png')
+
+
+def flood_fill_blobs(mask):
+    """ (pixels, min_x, min_y) of each 8-connected blob the slow way """
+    height, width = mask.shape
+    seen = numpy.zeros(mask.shape, dtype=bool)
+    blobs = []
+    for y in xrange(height):
+        for x in xrange(width):
+            if not mask[y, x] or seen[y, x]:
+                continue
+            seen[y, x] = True
+            stack = [(y, x)]
+            pixels = []
+            while stack:
+                pixel = stack.pop()
+                pixels.append(pixel)
+                for near_y in xrange(max(pixel[0] - 1, 0), min(pixel[0] + 2, height)):
+                    for near_x in xrange(max(pixel[1] - 1, 0), min(pixel[1] + 2, width)):
+                        if mask[near_y, near_x] and not seen[near_y, near_x]:
+                            seen[near_y, near_x] = True
+                            stack.append((near_y, near_x))
+            blobs.append((len(pixels), min(p[1] for p in pixels), min(p[0] for p in pixels)))
+    return sorted(blobs)
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class TestBlobs(unittest.TestCase):
+    def test_square(self):
+        image = numpy.ones((20, 30), dtype=numpy.uint8) * 255
+        image[5:10, 10:15] = 0
+        blobs = find_blobs(image, threshold=128, min_size=0)
+        self.assertEqual(len(blobs), 1)
+        self.assertEqual(blobs.pixels.tolist(), [25])
+        # Contour through the edge pixel centres is 4x4
+        self.assertEqual(blobs.area.tolist(), [16.0])
+        self.assertEqual(blobs.bounding_box.tolist(), [[10, 5, 5, 5]])
+        self.assertEqual(blobs.centroid.tolist(), [[12.0, 7.0]])
+        self.assertEqual(blobs.coordinates.tolist(), [[12, 7]])
+
+    def test_matches_flood_fill(self):
+        """ Any strip height labels random noise like a plain 8-connected flood fill"""
+        random = numpy.random.RandomState(3)
+        for _ in xrange(5):
+            mask = random.rand(40, 50) < 0.45
+            expected = flood_fill_blobs(mask)
+            for strip_rows in (1, 3, 256):
+                blobs = find_blobs(numpy.where(mask, 0, 255), threshold=0, min_size=0, strip_rows=strip_rows)
+                self.assertEqual(sorted(zip(blobs.pixels.tolist(), blobs.bounding_box[:, 0].tolist(),
+                                            blobs.bounding_box[:, 1].tolist())), expected)
+
+    def test_otsu(self):
+        image = numpy.array([[20] * 10 + [200] * 30])
+        self.assertTrue(20 <= otsu_threshold(histogram(image)) < 200)
+        self.assertEqual(len(find_blobs(numpy.zeros((5, 5), dtype=numpy.uint8), min_size=0)), 1)
+        self.assertEqual(len(find_blobs(numpy.ones((5, 5), dtype=numpy.uint8) * 255, threshold=10)), 0)
+
+    def test_solder_mask(self):
+        """ Decoded by pcb_drill_raster so it runs without PIL"""
+        self.assertEqual(len(find_blobs(numpy.concatenate(list(iter_png_strips(SOLDER_MASK))))), 105)
+
+    @unittest.skipIf(numpy is None or SimpleCV is None, "SimpleCV is not installed")
+    def test_matches_simplecv(self):
+        blobs = SimpleCV.Image(SOLDER_MASK).binarize().findBlobs()
+        expected = sorted((tuple(blob.coordinates()), blob.area()) for blob in blobs)
+        holes = find_blobs(read_image(SOLDER_MASK))
+        got = sorted(zip([tuple(xy) for xy in holes.coordinates.tolist()], holes.area.tolist()))
+        self.assertEqual([xy for xy, _ in got], [xy for xy, _ in expected])
+        for (_, area), (_, expected_area) in zip(got, expected):
+            self.assertAlmostEqual(area, expected_area, delta=1.0)
@@ -0,0 +1,64 @@
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+import time
+
+# Insert Path for project ../ from here
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pcb_drill_cache import ResultCache, cache_key
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache_directory = os.path.join(self.directory, "result_cache")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_key(self):
+        self.assertEqual(cache_key("mask", {'a': 1, 'b': 2}), cache_key("mask", {'b': 2, 'a': 1}))
+        self.assertNotEqual(cache_key("mask", {'a': 1}), cache_key("mask", {'a': 2}))
+        self.assertNotEqual(cache_key("mask", {'a': 1}), cache_key("other mask", {'a': 1}))
+
+    def test_persists(self):
+        overlay = os.path.join(self.directory, "overlay.png")
+        with open(overlay, "w") as overlay_file:
+            overlay_file.write("png")
+        key = cache_key("mask")
+        cache = ResultCache(self.cache_directory)
+        self.assertEqual(cache.get(key), None)
+        cache.put(key, {'holes': [[1, 2, 0.5]]}, {'.png': overlay})
+        # A restarted daemon finds it again
+        cache = ResultCache(self.cache_directory)
+        self.assertEqual(cache.get(key), {'holes': [[1, 2, 0.5]]})
+        with open(cache.file_path(key, ".png")) as cached_overlay:
+            self.assertEqual(cached_overlay.read(), "png")
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+        # Overlays rendered in memory are stored the same way
+        cache.put(key, {'holes': []}, contents={'.png': "in memory png"})
+        with open(cache.file_path(key, ".png")) as cached_overlay:
+            self.assertEqual(cached_overlay.read(), "in memory png")
+
+    def test_least_recently_used_evicted(self):
+        cache = ResultCache(self.cache_directory, max_bytes=300)
+        keys = [cache_key(str(number)) for number in xrange(3)]
+        cache.put(keys[0], {'data': "x" * 100})
+        cache.put(keys[1], {'data': "x" * 100})
+        time.sleep(0.01)
+        cache.get(keys[0])
+        cache.put(keys[2], {'data': "x" * 100})
+        self.assertTrue(keys[0] in cache and keys[2] in cache)
+        self.assertFalse(keys[1] in cache)
+        self.assertEqual(cache.evictions, 1)
+        self.assertTrue(cache.size <= 300)
+        self.assertEqual(len(os.listdir(self.cache_directory)), 2)
+
+    def test_disabled(self):
+        cache = ResultCache(self.cache_directory, max_bytes=0)
+        cache.put(cache_key("mask"), {})
+        self.assertEqual(cache.get(cache_key("mask")), None)
+        self.assertFalse(os.path.exists(self.cache_directory))
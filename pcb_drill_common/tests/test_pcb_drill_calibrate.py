@@ -0,0 +1,72 @@
+import unittest
+import sys
+import os
+
+# Insert Path for project ../ from here
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy
+
+from pcb_drill_calibrate import locate_calibration_holes, order_holes, window_centroid
+
+# CALIBRATE_HOLES at 10 pixels per mm from (300, 400), y down
+HOLES = [(300.3, 400.7), (600.6, 400.2), (300.1, 200.5)]
+
+
+def drilled_bed(holes=HOLES, width=1024, height=768, radius=6):
+    """ Noisy bed before drilling and the same bed with dark holes after """
+    random = numpy.random.RandomState(0)
+    pre = (200 + random.randint(0, 10, (height, width))).astype(numpy.uint8)
+    post = pre.copy()
+    y, x = numpy.ogrid[:height, :width]
+    for hole_x, hole_y in holes:
+        post[(x - hole_x) ** 2 + (y - hole_y) ** 2 <= radius * radius] = 30
+    return pre, post
+
+
+class TestCalibrate(unittest.TestCase):
+    def assertHoles(self, found, expected=HOLES):
+        self.assertEqual(len(found), len(expected))
+        for (x, y), (expected_x, expected_y) in zip(found, expected):
+            self.assertAlmostEqual(x, expected_x, delta=0.5)
+            self.assertAlmostEqual(y, expected_y, delta=0.5)
+
+    def test_coarse_then_roi(self):
+        pre, post = drilled_bed()
+        found = locate_calibration_holes(pre, post)
+        self.assertEqual((found['method'], found['misses']), ("coarse", 0))
+        self.assertHoles(found['holes'])
+        self.assertAlmostEqual(found['pixels_per_mm'], 10.0, delta=0.1)
+        # The next calibration only looks where the last one found the holes
+        found = locate_calibration_holes(pre, post, found['holes'])
+        self.assertEqual(found['method'], "roi")
+        self.assertHoles(found['holes'])
+
+    def test_lighting_change_elsewhere(self):
+        pre, post = drilled_bed()
+        post[:, 800:] -= 60
+        found = locate_calibration_holes(pre, post, [(302, 398), (598, 403), (297, 202)])
+        self.assertEqual(found['method'], "roi")
+        self.assertHoles(found['holes'])
+
+    def test_full_frame_fallback(self):
+        pre, post = drilled_bed()
+        found = locate_calibration_holes(pre, post, [(100, 100), (900, 100), (100, 700)])
+        self.assertEqual((found['method'], found['misses']), ("full_frame", 3))
+        self.assertHoles(found['holes'])
+        # Nothing drilled: no holes and no scale
+        found = locate_calibration_holes(pre, pre)
+        self.assertEqual((found['holes'], found['pixels_per_mm']), ([], None))
+
+    def test_window_recentres(self):
+        pre, post = drilled_bed()
+        # The hole straddles the window's edge, the second look is centred on it
+        x, y = window_centroid(pre, post, (300.3 + 12, 400.7), window=10)
+        self.assertAlmostEqual(x, 300.3, delta=0.5)
+        self.assertEqual(window_centroid(pre, post, (500, 500), window=10), None)
+
+    def test_order_holes(self):
+        ordered, scale = order_holes([HOLES[2], HOLES[0], HOLES[1]])
+        self.assertEqual(ordered, HOLES)
+        self.assertAlmostEqual(scale, 10.0, delta=0.05)
+        self.assertEqual(order_holes(HOLES[:2]), (None, None))
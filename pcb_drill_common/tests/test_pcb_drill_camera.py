@@ -0,0 +1,95 @@
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+import time
+
+# Insert Path for project ../ from here
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy
+
+from pcb_drill_blobs import find_blobs
+from pcb_drill_camera import (CameraService, FakeCameraBackend, average_frames, get_camera_backend,
+                              read_rgb, save_image, synthetic_board)
+
+
+class CountingBackend(FakeCameraBackend):
+    """ Fake camera that counts how often it is opened and closed """
+
+    def __init__(self, **kwargs):
+        FakeCameraBackend.__init__(self, **kwargs)
+        self.opened = 0
+        self.closed = 0
+
+    def open(self):
+        FakeCameraBackend.open(self)
+        self.opened += 1
+
+    def close(self):
+        FakeCameraBackend.close(self)
+        self.closed += 1
+
+
+class TestCameraService(unittest.TestCase):
+    def test_stays_warm_and_reuses_buffers(self):
+        backend = CountingBackend()
+        camera = CameraService(backend, idle_timeout=60, buffers=2)
+        images = [camera.capture(1024, 768) for _ in xrange(4)]
+        self.assertEqual((backend.opened, backend.closed), (1, 0))
+        self.assertEqual(images[0].shape, (768, 1024, 3))
+        # Two buffers taking turns
+        self.assertTrue(images[0].base is images[2].base or images[0].base is images[2])
+        self.assertFalse(images[0].base is images[1].base)
+        self.assertEqual(camera.stats()['buffer_bytes'], 2 * 1024 * 768 * 3)
+        # The synthetic board's holes are found straight in the buffer
+        self.assertEqual(find_blobs(images[3]).holes(), find_blobs(synthetic_board()).holes())
+        camera.close()
+        self.assertEqual(backend.closed, 1)
+
+    def test_idle_timeout(self):
+        backend = CountingBackend()
+        camera = CameraService(backend, idle_timeout=0.05)
+        camera.capture(64, 48)
+        self.assertTrue(camera.is_open)
+        time.sleep(0.2)
+        self.assertFalse(camera.is_open)
+        camera.capture(64, 48)
+        self.assertEqual(backend.opened, 2)
+        camera.close()
+
+    def test_preview_keeps_camera_open(self):
+        backend = CountingBackend()
+        camera = CameraService(backend, idle_timeout=0)
+        camera.start_preview()
+        camera.capture(64, 48)
+        self.assertTrue(camera.is_open)
+        camera.stop_preview()
+        self.assertFalse(camera.is_open)
+
+    def test_burst(self):
+        camera = CameraService(FakeCameraBackend(), idle_timeout=0)
+        burst = camera.capture_burst(3, 64, 48)
+        self.assertEqual(len(burst), 3)
+        numpy.testing.assert_array_equal(average_frames(burst), burst[0])
+        self.assertEqual(camera.stats()['captures'], 3)
+
+
+class TestBackends(unittest.TestCase):
+    def test_file_source(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "board.png")
+            save_image(synthetic_board(160, 120), filename)
+            numpy.testing.assert_array_equal(read_rgb(filename), synthetic_board(160, 120))
+            camera = CameraService(get_camera_backend("fake", source=filename), idle_timeout=0)
+            # Scaled to the resolution asked for
+            self.assertEqual(camera.capture(80, 60).shape, (60, 80, 3))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_get_camera_backend(self):
+        backend = FakeCameraBackend()
+        self.assertTrue(get_camera_backend(backend) is backend)
+        self.assertRaises(ValueError, get_camera_backend, "webcam")
@@ -0,0 +1,80 @@
+import unittest
+import sys
+import os
+import threading
+import time
+
+# Insert Path for project ../ from here
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+try:
+    import zmq
+except ImportError:
+    zmq = None
+
+if zmq is not None:
+    from pcb_drill_client import ClientPool, DaemonTimeout
+    from load_test_pcb_drill_server import _free_port, start_server
+
+
+class SlowStartRPC(object):
+    """ The first answer waits until the test releases it """
+
+    def __init__(self):
+        self.calls = 0
+        self.release = threading.Event()
+        self.slow_answered = threading.Event()
+
+    def answer(self):
+        self.calls += 1
+        if self.calls == 1:
+            self.release.wait(10)
+            self.slow_answered.set()
+        return self.calls
+
+
+@unittest.skipIf(zmq is None, "pyzmq is not installed")
+class TestClientPool(unittest.TestCase):
+    def test_reuses_connections(self):
+        daemon = ClientPool(start_server("router", 2))
+        for _ in xrange(10):
+            self.assertEqual(daemon('ping')['output'], "pong")
+        self.assertEqual(daemon.stats()['opened'], 1)
+        self.assertTrue(daemon.ping())
+        daemon.close()
+
+    def test_retry_on_new_socket(self):
+        rpc = SlowStartRPC()
+        daemon = ClientPool(start_server("router", 2, rpc), timeout=1.0, retries=1)
+        # The first attempt is held until it timed out, the retry goes out on a new socket and is answered
+        self.assertEqual(daemon('answer')['output'], 2)
+        self.assertEqual(daemon('answer')['output'], 3)
+        self.assertTrue(daemon.healthy)
+        # The server drops the late answer to the closed socket
+        rpc.release.set()
+        self.assertTrue(rpc.slow_answered.wait(2))
+        daemon.close()
+
+    def test_no_daemon(self):
+        daemon = ClientPool("tcp://127.0.0.1:{0}".format(_free_port()), timeout=0.1, retries=2)
+        begin = time.time()
+        with self.assertRaises(DaemonTimeout) as raised:
+            daemon('ping')
+        self.assertEqual(raised.exception.attempts, 3)
+        self.assertTrue(time.time() - begin < 1.0)
+        self.assertFalse(daemon.healthy)
+        self.assertEqual(daemon.stats()['timeouts'], 1)
+        self.assertFalse(daemon.ping())
+        daemon.close()
+
+    def test_heartbeat(self):
+        daemon = ClientPool(start_server("rep", 1), heartbeat=0.05)
+        daemon('ping')
+        time.sleep(0.1)
+        self.assertEqual(daemon('ping')['output'], "pong")
+        self.assertEqual(daemon.stats()['heartbeats'], 1)
+        daemon.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+import sys
+import os
+
+# Insert Path for project ../ from here
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pcb_drill_compact import GCodeCompactor, checksum, compact_lines, format_number
+from pcb_drill_estimate import estimate
+from pcb_drill_gcode import PcbDrillGCode
+from test_pcb_drill_path import random_holes
+
+
+class TestCompact(unittest.TestCase):
+    def test_format_number(self):
+        self.assertEqual(format_number(12.7), "12.7")
+        self.assertEqual(format_number(-0.5), "-.5")
+        self.assertEqual(format_number(3000.0), "3000")
+        self.assertEqual(format_number(-0.0001), "0")
+        self.assertEqual(format_number(1.23456789, 4), "1.2346")
+
+    def test_modal_words(self):
+        """ Comments and line numbers go, G0/G1 words the machine already has go"""
+        lines = list(compact_lines(["N001 G1 X1.0 Y2.0 F3000 ; Drill hole location",
+                                    "; --- End Hole # 1",
+                                    "G1 X1.0 Y3.0 F3000",
+                                    "G1 X1.0 Y3.0",
+                                    "G28 X0 Y0 (go home)",
+                                    "G1 X1.0 Y3.0"]))
+        self.assertEqual(lines, ["G1 X1 Y2 F3000\n", "G1 Y3\n", "G28 X0 Y0\n", "G1 X1 Y3\n"])
+
+    def test_relative_moves_repeat(self):
+        lines = list(compact_lines(["G91", "G1 X1", "G1 X1", "G90", "G1 X1", "G1 X1"]))
+        self.assertEqual(lines, ["G91\n", "G1 X1\n", "G1 X1\n", "G90\n", "G1 X1\n"])
+
+    def test_checksums(self):
+        compactor = GCodeCompactor(checksums=True)
+        self.assertEqual(compactor.compact("G21"), "M110 N0\nN1 G21*{0}".format(checksum("N1 G21")))
+        self.assertEqual(compactor.compact("G90"), "N2 G90*{0}".format(checksum("N2 G90")))
+        self.assertEqual(checksum("N1 G21"), 27)
+
+    def test_generator(self):
+        """ Much smaller and moves like the full program"""
+        holes = random_holes(300)
+        full = PcbDrillGCode(drill_cycle="clearance")
+        full.drill_holes(holes)
+        full_gcode = full.generate()
+        compact = PcbDrillGCode(drill_cycle="clearance", compact=True)
+        compact.drill_holes(holes)
+        compact_gcode = compact.generate()
+        self.assertEqual(compact.size_reduction, (len(full_gcode), len(compact_gcode)))
+        self.assertTrue(len(compact_gcode) * 4 < len(full_gcode))
+        self.assertTrue(";" not in compact_gcode)
+        full_estimate = estimate(full_gcode)
+        compact_estimate = estimate(compact_gcode)
+        # Only rounding to 3 digits differs
+        self.assertAlmostEqual(full_estimate['time'], compact_estimate['time'], delta=0.01)
+        self.assertAlmostEqual(full_estimate['xy_travel'], compact_estimate['xy_travel'], delta=0.3)
+        self.assertTrue(compact.body in compact_gcode)
+        self.assertRaises(ValueError, lambda: full.size_reduction)
@@ -0,0 +1,83 @@
+import unittest
+import sys
+import os
+
+# Insert Path for project ../ from here
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from pcb_drill_cycles import DrillCycle, get_drill_cycle, parse_keep_out_zones
+from pcb_drill_estimate import estimate
+from pcb_drill_gcode import PcbDrillGCode
+from test_pcb_drill_path import random_holes
+
+# Two clusters 30mm apart
+CLUSTERED_HOLES = [(0.0, 0.0), (1.0, 0.0), (2.0, 0.0), (30.0, 0.0), (31.0, 0.0), (31.0, 5.0)]
+
+
+class TestDrillCycles(unittest.TestCase):
+    def test_full_retract(self):
+        """ Long moves and moves over a keep out zone get a full retract"""
+        cycle = DrillCycle(long_move=10.0, keep_out_zones=[(4.0, -1.0, 5.0, 1.0)])
+        self.assertTrue(cycle.full_retract(None, (0.0, 0.0)))
+        self.assertFalse(cycle.full_retract((0.0, 0.0), (3.0, 0.0)))
+        self.assertTrue(cycle.full_retract((0.0, 0.0), (11.0, 0.0)))
+        self.assertTrue(cycle.full_retract((3.0, 0.0), (6.0, 0.0)))
+        self.assertFalse(cycle.full_retract((3.0, 2.0), (6.0, 2.0)))
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_full_retracts_array(self):
+        cycle = DrillCycle(long_move=20.0, keep_out_zones=[(100.0, 50.0, 120.0, 60.0)])
+        holes = random_holes(300)
+        previous = [None] + holes[:-1]
+        self.assertEqual(cycle.full_retracts(numpy.array(holes), None).tolist(),
+                         [cycle.full_retract(before, hole) for before, hole in zip(previous, holes)])
+
+    def test_clearance(self):
+        """ Only the first hole of each cluster lifts all the way, and the job ends fully retracted"""
+        gcode_generator = PcbDrillGCode(drill_cycle="clearance")
+        gcode_generator.drill_holes(CLUSTERED_HOLES)
+        output = gcode_generator.generate()
+        self.assertEqual(output.count("Retract drill for a long move"), 2)
+        self.assertEqual(output.count("G1 Z0.5 F3000"), len(CLUSTERED_HOLES))
+        self.assertTrue(output.rindex("G1 Z3.0 F3000") > output.rindex("G1 Z0.5 F3000"))
+
+    def test_canned(self):
+        gcode_generator = PcbDrillGCode(drill_cycle="g83", line_numbers=False)
+        gcode_generator.drill_holes(CLUSTERED_HOLES)
+        output = gcode_generator.generate()
+        self.assertEqual(output.count("G99 G83 X"), 2)
+        self.assertTrue("\nX1.0 Y0.0" in output)
+        self.assertEqual(output.count("G80"), 3)
+        self.assertRaises(ValueError, get_drill_cycle, "g84")
+
+    def test_faster(self):
+        """ On a dense board every cycle drills the holes in less time than plunging from full height"""
+        holes = [(x / 10.0, y / 10.0) for x, y in random_holes(200)]
+        times = {}
+        for cycle in ("plunge", "clearance", "g81"):
+            gcode_generator = PcbDrillGCode(drill_cycle=cycle, hole_ordering="nearest_neighbour")
+            gcode_generator.drill_holes(holes)
+            result = estimate(gcode_generator.generate())
+            times[cycle] = result['time']
+        self.assertTrue(times["clearance"] < times["plunge"] / 2)
+        self.assertTrue(times["g81"] < times["plunge"] / 2)
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_bulk_matches_list_path(self):
+        for cycle in ("clearance", "g81"):
+            expected = PcbDrillGCode(drill_cycle=cycle, coordinate_precision=3)
+            expected.drill_holes(random_holes(500))
+            gcode_generator = PcbDrillGCode(drill_cycle=cycle, coordinate_precision=3)
+            gcode_generator.drill_holes(numpy.array(random_holes(500)))
+            self.assertEqual(gcode_generator.generate(), expected.generate())
+
+    def test_parse_keep_out_zones(self):
+        self.assertEqual(parse_keep_out_zones("0 0 20 10, 180 0 200 10"),
+                         [(0.0, 0.0, 20.0, 10.0), (180.0, 0.0, 200.0, 10.0)])
+        self.assertEqual(parse_keep_out_zones(""), [])
+        self.assertRaises(ValueError, parse_keep_out_zones, "0 0 20")
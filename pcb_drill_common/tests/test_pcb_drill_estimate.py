@@ -0,0 +1,64 @@
+import unittest
+import sys
+import os
+import math
+
+# Insert Path for project ../ from here
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pcb_drill_estimate import GCodeSimulator, MachineLimits, estimate, format_duration
+from pcb_drill_gcode import PcbDrillGCode
+from test_pcb_drill_gcode import sample_holes
+
+
+class TestGCodeEstimate(unittest.TestCase):
+    def setUp(self):
+        self.limits = MachineLimits(max_feed_xy=6000, max_feed_z=300, acceleration_xy=1000, acceleration_z=100)
+
+    def test_trapezoid(self):
+        """ 100mm at 3000mm/min (50mm/s) with 1000mm/s^2: 2s cruising plus 0.05s lost to ramps"""
+        result = estimate("G21\nG90\nG1 X100 F3000\n", self.limits)
+        self.assertAlmostEqual(result['time'], 100 / 50.0 + 50 / 1000.0)
+        self.assertAlmostEqual(result['xy_travel'], 100.0)
+        self.assertEqual(result['moves'], 1)
+
+    def test_triangle(self):
+        """ A short move never reaches the feed rate"""
+        result = estimate("G1 Z0.1 F300", self.limits)
+        self.assertAlmostEqual(result['time'], 2 * math.sqrt(0.1 / 100.0))
+        self.assertAlmostEqual(result['z_travel'], 0.1)
+
+    def test_inline_matches_move_time(self):
+        """ The hot loop's inlined maths agrees with move_time for every kind of move"""
+        simulator = GCodeSimulator(self.limits)
+        for dx, dy, dz in ((10, 5, 0), (-3, 40, 0), (0, 0, -2.5), (4, 3, 2)):
+            simulator.reset()
+            simulator.run("G1 X{0} Y{1} Z{2} F3000".format(dx, dy, dz))
+            self.assertAlmostEqual(simulator.time, simulator.move_time(dx, dy, dz, 3000))
+
+    def test_modes(self):
+        """ Relative moves, inches, homing, pauses and line numbers/checksums"""
+        result = estimate(["N1 G91 G20*12", "G1 X1 Y0 F10 ; one inch", "G1 X1",
+                           "G90 G21", "M0", "G28 X0 Y0", "(comment) G4 P500"], self.limits)
+        self.assertAlmostEqual(result['xy_travel'], 2 * 2 * 25.4)
+        self.assertEqual(result['pauses'], 1)
+        self.assertEqual(result['moves'], 3)
+
+    def test_generated_gcode(self):
+        """ Every hole is a plunge and a retract"""
+        gcode_generator = PcbDrillGCode()
+        gcode_generator.drill_holes(sample_holes())
+        result = estimate(gcode_generator.generate())
+        self.assertAlmostEqual(result['z_travel'], len(sample_holes()) * 7.0 - 3.0)
+        self.assertTrue(result['time'] > 0)
+        self.assertEqual(result['holes'], len(sample_holes()))
+        xs, ys = zip(*sample_holes())
+        for found, expected in zip(result['bounds'], (min(xs), min(ys), max(xs), max(ys))):
+            self.assertAlmostEqual(found, expected, places=3)
+        # Canned cycle holes count too
+        result = estimate("G90\nG0 Z2\nG99 G81 X1 Y2 Z-1.5 R0.5 F80\nX5 Y-3\nG80\n")
+        self.assertEqual((result['holes'], result['bounds']), (2, (1.0, -3.0, 5.0, 2.0)))
+
+    def test_format_duration(self):
+        self.assertEqual(format_duration(5), "5s")
+        self.assertEqual(format_duration(3723), "1h 02m 03s")
@@ -0,0 +1,112 @@
+import unittest
+import sys
+import os
+import time
+
+# Insert Path for project ../ from here
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pcb_drill_excellon import parse_excellon, parse_gerber_drill, read_drill_file, slot_holes
+from pcb_drill_gcode import PcbDrillGCode
+
+KICAD_EXCELLON = """M48
+; DRILL file {KiCad 4.0.7} date 01/02/2017
+; FORMAT={-:-/ absolute / metric / decimal}
+FMAT,2
+METRIC,TZ
+T1C0.800
+T2C1.000
+%
+G90
+G05
+T1
+X10.16Y-20.32
+X12.7Y-20.32
+T2
+X15.0Y-5.0G85X18.0Y-5.0
+T0
+M30
+"""
+
+INCH_LEADING_ZEROS = """M48
+INCH,LZ
+T01C0.0315
+%
+T01
+X0125Y0250
+Y-0050
+M30
+"""
+
+GERBER_DRILL = """%TF.FileFunction,Plated,1,2,PTH*%
+%FSLAX34Y34*%
+%MOMM*%
+%ADD10C,0.8000*%
+%ADD11C,1.2000*%
+D10*
+X100000Y-200000D03*
+X127000D03*
+D11*
+X0Y0D02*
+G01*
+X30000Y0D01*
+M02*
+"""
+
+
+class TestDrillFile(unittest.TestCase):
+    def test_excellon_metric(self):
+        drill_file = parse_excellon(KICAD_EXCELLON)
+        self.assertEqual(drill_file.tools, {1: 0.8, 2: 1.0})
+        self.assertEqual(drill_file.holes, [(10.16, -20.32, 0.8), (12.7, -20.32, 0.8)])
+        self.assertEqual(drill_file.slots, [(15.0, -5.0, 18.0, -5.0, 1.0)])
+
+    def test_excellon_zero_formats(self):
+        """ Leading zeros kept in inches: 0125 is 01.25 inch and Y carries over"""
+        drill_file = parse_excellon(INCH_LEADING_ZEROS)
+        self.assertEqual(len(drill_file.holes), 2)
+        for hole, expected in zip(drill_file.holes, [(1.25, 2.5), (1.25, -0.5)]):
+            self.assertAlmostEqual(hole[0], expected[0] * 25.4)
+            self.assertAlmostEqual(hole[1], expected[1] * 25.4)
+        trailing_zeros = parse_excellon("M48\nINCH,TZ\nT1C0.0315\n%\nT1\nX125Y-5000\nM30\n")
+        self.assertAlmostEqual(trailing_zeros.holes[0][0], 0.0125 * 25.4)
+        self.assertAlmostEqual(trailing_zeros.holes[0][1], -0.5 * 25.4)
+        self.assertRaises(ValueError, parse_excellon, "M48\nMETRIC\n%\nT3\nX1.0Y1.0\n")
+
+    def test_gerber_drill(self):
+        drill_file = read_drill_file(GERBER_DRILL)
+        self.assertEqual(drill_file.holes, [(10.0, -20.0, 0.8), (12.7, -20.0, 0.8)])
+        self.assertEqual(drill_file.slots, [(0.0, 0.0, 3.0, 0.0, 1.2)])
+        self.assertEqual(sorted(drill_file.tools), [10, 11])
+
+    def test_gerber_drill_inches(self):
+        """ Lines in inches are scaled to mm, only circular apertures are holes"""
+        drill_file = parse_gerber_drill(GERBER_DRILL.replace("%MOMM*%", "%MOIN*%").splitlines(True))
+        self.assertEqual(len(drill_file.holes), 2)
+        for found, expected in zip(drill_file.holes[1], (12.7 * 25.4, -20.0 * 25.4, 0.8 * 25.4)):
+            self.assertAlmostEqual(found, expected)
+        self.assertAlmostEqual(drill_file.slots[0][2], 3.0 * 25.4)
+        self.assertRaises(ValueError, parse_gerber_drill, "%FSLAX34Y34*%\n%ADD10R,1.0X1.0*%\nD10*\nM02*\n")
+
+    def test_slot_holes(self):
+        holes = slot_holes((0.0, 0.0, 3.0, 0.0, 1.0))
+        self.assertEqual([hole[0] for hole in holes], [0.0, 0.5, 1.0, 1.5, 2.0, 2.5, 3.0])
+        self.assertEqual(slot_holes((1.0, 1.0, 1.0, 1.0, 1.0)), [(1.0, 1.0, 1.0)])
+
+    def test_generate(self):
+        """ The holes feed straight into the gcode generator with the file's tool table"""
+        drill_file = parse_excellon(KICAD_EXCELLON)
+        gcode_generator = PcbDrillGCode(tool_table=drill_file.tool_table())
+        gcode_generator.drill_holes(drill_file.drill_holes())
+        output = gcode_generator.generate()
+        self.assertTrue("M0 Load T1 (0.8) drill" in output)
+        self.assertEqual(output.count("Begin Hole"), 2 + 7)
+
+    def test_speed(self):
+        """ 10k holes parse in well under a second"""
+        lines = ["M48", "METRIC,TZ", "T1C0.800", "%", "T1"]
+        lines.extend("X{0:.3f}Y{1:.3f}".format(index % 100 * 2.54, index // 100 * 2.54) for index in xrange(10000))
+        begin = time.time()
+        drill_file = parse_excellon("\n".join(lines))
+        self.assertEqual(len(drill_file.holes), 10000)
+        self.assertTrue(time.time() - begin < 0.5)
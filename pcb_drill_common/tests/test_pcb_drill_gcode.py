@@ -3,6 +3,12 @@ import unittest
 import sys
 import os
 import re
+import StringIO
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # Insert Path for project ../ from here
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
@@ -71,3 +77,41 @@ class TestPcbDrillGCode(unittest.TestCase):
                 self.assertAlmostEqual(float(line_y), self.holes[drill_count][1])
                 drill_count += 1
         self.assertEquals(hole_count, drill_count)
+
+    def test_streaming_matches_generate(self):
+        """ iter_lines and write_to stream exactly what generate returns"""
+        gcode_generator = PcbDrillGCode()
+        gcode_generator.comment("Before the holes")
+        gcode_generator.drill_holes(self.holes)
+        gcode_generator.comment("After the holes")
+        output = gcode_generator.generate()
+        self.assertEqual("".join(gcode_generator.iter_lines()), output)
+        stream = StringIO.StringIO()
+        self.assertEqual(gcode_generator.write_to(stream), len(output))
+        self.assertEqual(stream.getvalue(), output)
+        self.assertTrue("; Before the holes" in output)
+        self.assertTrue("; After the holes" in output)
+
+    def test_streaming_from_iterator(self):
+        """ Holes can come from an iterator and are drilled lazily"""
+        gcode_generator = PcbDrillGCode(line_numbers=False)
+        gcode_generator.drill_holes((float(i), float(i)) for i in xrange(1000))
+        drill_count = 0
+        for line in gcode_generator.iter_lines():
+            if line.startswith("G1 X"):
+                drill_count += 1
+        self.assertEqual(drill_count, 1000)
+        self.assertAlmostEqual(gcode_generator.travel_distance[1], 999 * 2 ** 0.5)
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_bulk_matches_list_path(self):
+        """ numpy hole arrays render byte for byte the same as lists at the same precision"""
+        holes = self.holes + [(0.125, -0.0), (-0.00001, 1000000.0), (-1.99995, 123.45675)]
+        for precision in (0, 3, 4):
+            for line_numbers in (True, False):
+                gcode_generator = PcbDrillGCode(line_numbers=line_numbers, coordinate_precision=precision)
+                gcode_generator.seek_predrill_location((10, 20))
+                gcode_generator.drill_holes(holes)
+                expected = gcode_generator.generate()
+                gcode_generator.drill_holes(numpy.array(holes))
+                self.assertEqual(gcode_generator.generate(), expected)
@@ -0,0 +1,76 @@
+import unittest
+import sys
+import os
+import threading
+
+# Insert Path for project ../ from here
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pcb_drill_jobs import JobQueue, report_progress
+
+
+class TestJobQueue(unittest.TestCase):
+    def setUp(self):
+        self.jobs = JobQueue(workers=1)
+        self.release = threading.Event()
+        self.started = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+        self.jobs.stop()
+
+    def _slow(self, value):
+        """ A job that reports a stage and waits to be released """
+        report_progress("waiting", 0.5)
+        self.started.set()
+        self.release.wait(5)
+        report_progress("finishing", 0.9)
+        return value * 2
+
+    def test_result_and_progress(self):
+        job = self.jobs.submit("slow", self._slow, {'value': 21})
+        self.assertTrue(self.started.wait(5))
+        status = self.jobs.status(job.id)
+        self.assertEqual((status['state'], status['stage'], status['progress']), ("running", "waiting", 0.5))
+        self.assertFalse('result' in self.jobs.result(job.id))
+        self.release.set()
+        self.assertTrue(job.wait(5))
+        result = self.jobs.result(job.id)
+        self.assertEqual((result['state'], result['result'], result['progress']), ("done", 42, 1.0))
+
+    def test_concurrency_limit(self):
+        """ With one worker the second job waits and can be cancelled before it starts"""
+        first = self.jobs.submit("slow", self._slow, {'value': 1})
+        second = self.jobs.submit("slow", self._slow, {'value': 2})
+        self.assertTrue(self.started.wait(5))
+        self.assertEqual(self.jobs.status(second.id)['state'], "queued")
+        self.jobs.cancel(second.id)
+        self.release.set()
+        self.assertTrue(second.wait(5))
+        self.assertEqual(self.jobs.status(first.id)['state'], "done")
+        self.assertEqual(self.jobs.status(second.id)['state'], "cancelled")
+
+    def test_request_sent_again(self):
+        """ A retried request gets the job it started, not a second one"""
+        first = self.jobs.submit("slow", self._slow, {'value': 1}, request_id="attempt")
+        self.assertTrue(self.jobs.submit("slow", self._slow, {'value': 1}, request_id="attempt") is first)
+        self.assertFalse(self.jobs.submit("slow", self._slow, {'value': 1}, request_id="other") is first)
+        self.assertEqual(len(self.jobs.jobs()), 2)
+
+    def test_cancel_running(self):
+        job = self.jobs.submit("slow", self._slow, {'value': 1})
+        self.assertTrue(self.started.wait(5))
+        self.jobs.cancel(job.id)
+        self.release.set()
+        self.assertTrue(job.wait(5))
+        self.assertEqual(self.jobs.status(job.id)['state'], "cancelled")
+
+    def test_failure(self):
+        job = self.jobs.submit("broken", lambda: 1 / 0)
+        self.assertTrue(job.wait(5))
+        result = self.jobs.result(job.id)
+        self.assertEqual(result['state'], "failed")
+        self.assertTrue("ZeroDivisionError" in result['exception'])
+        self.assertRaises(KeyError, self.jobs.status, "unknown")
+        # Outside a job progress reports are ignored
+        report_progress("nothing")
@@ -0,0 +1,87 @@
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+
+# Insert Path for project ../ from here
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pcb_drill_gcode import PcbDrillGCode, calibrate_printer
+from pcb_drill_library import GCodeLibrary
+from test_pcb_drill_gcode import sample_holes
+
+
+class TestGCodeLibrary(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.library = GCodeLibrary(self.directory, refresh_interval=60)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, filename, text):
+        full_path = os.path.join(self.directory, filename)
+        if not os.path.isdir(os.path.dirname(full_path)):
+            os.makedirs(os.path.dirname(full_path))
+        with open(full_path, "w") as gcode_file:
+            gcode_file.write(text)
+        return full_path
+
+    def test_incremental_refresh(self):
+        with open(os.path.join(self.directory, "calibrate_printer.gcode"), "w") as gcode_file:
+            calibrate_printer(fileobj=gcode_file, line_numbers=False)
+        gcode_generator = PcbDrillGCode()
+        gcode_generator.drill_holes(sample_holes())
+        self.write("jobs/board.gcode", gcode_generator.generate())
+        self.write("notes.txt", "not gcode")
+        self.assertEqual(self.library.refresh(), {'added': 2, 'updated': 0, 'removed': 0, 'unchanged': 0})
+        entry = self.library.get("calibrate_printer.gcode")
+        self.assertEqual(entry['holes'], 3)
+        self.assertEqual((entry['min_x'], entry['min_y'], entry['max_x'], entry['max_y']), (0, 0, 30, 20))
+        self.assertTrue(entry['time'] > 0)
+        self.assertEqual(self.library.get("jobs/board.gcode")['holes'], len(sample_holes()))
+        # Within the refresh interval nothing is scanned
+        self.assertEqual(self.library.refresh(), None)
+        # A copy is not analysed again, a removed file leaves the index
+        shutil.copy(os.path.join(self.directory, "jobs/board.gcode"), os.path.join(self.directory, "copy.gcode"))
+        os.remove(os.path.join(self.directory, "calibrate_printer.gcode"))
+        self.assertEqual(self.library.refresh(force=True), {'added': 1, 'updated': 0, 'removed': 1, 'unchanged': 1})
+        self.assertEqual(self.library.get("copy.gcode")['sha1'], self.library.get("jobs/board.gcode")['sha1'])
+        self.assertEqual(self.library.get("calibrate_printer.gcode"), None)
+        full_path = self.write("copy.gcode", "G1 X1 Y1\nG1 Z-1\n")
+        os.utime(full_path, (1, 1))
+        self.assertEqual(self.library.refresh(force=True)['updated'], 1)
+        self.assertEqual(self.library.get("copy.gcode")['holes'], 1)
+
+    def test_query(self):
+        for number in xrange(12):
+            self.write("job_{0:02}.gcode".format(number), "G1 Z-1\nG1 Z1\n" * number)
+        self.write("job%x.gcode", "")
+        self.library.refresh()
+        files, total = self.library.query(page=2, page_size=5)
+        self.assertEqual(total, 13)
+        # job%x.gcode sorts first
+        self.assertEqual([entry['filename'] for entry in files], ["job_04.gcode", "job_05.gcode", "job_06.gcode",
+                                                                 "job_07.gcode", "job_08.gcode"])
+        # LIKE wildcards in the search are plain characters
+        files, total = self.library.query("%")
+        self.assertEqual([entry['filename'] for entry in files], ["job%x.gcode"])
+        files, total = self.library.query("job_1", order="holes")
+        self.assertEqual([entry['filename'] for entry in files], ["job_11.gcode", "job_10.gcode"])
+        self.assertRaises(ValueError, self.library.query, order="filename; DROP TABLE files")
+
+    def test_preview(self):
+        self.write("long.gcode", "".join("G1 X{0}\n".format(number) for number in xrange(1000)))
+        text, offset = self.library.preview("long.gcode", max_lines=400)
+        self.assertEqual(text.splitlines()[-1], "G1 X399")
+        text, offset = self.library.preview("long.gcode", offset, max_lines=400)
+        self.assertEqual(text.splitlines()[0], "G1 X400")
+        text, offset = self.library.preview("long.gcode", offset, max_lines=400)
+        self.assertEqual((len(text.splitlines()), offset), (200, None))
+        self.assertEqual(self.library.path("../outside.gcode"), None)
+        self.assertRaises(IOError, self.library.preview, "../outside.gcode")
+
+
+if __name__ == '__main__':
+    unittest.main()
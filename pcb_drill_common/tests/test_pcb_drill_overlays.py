@@ -0,0 +1,80 @@
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+import threading
+
+# Insert Path for project ../ from here
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy
+
+import pcb_drill_overlays
+from pcb_drill_overlays import FAILED, READY, OverlayWriter
+from pcb_drill_raster import iter_png_strips
+
+
+class TestOverlayWriter(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_background_render(self):
+        overlays = OverlayWriter(self.directory, workers=1)
+        started = threading.Event()
+        done = []
+
+        def render(path):
+            started.wait(5)
+            overlays.save(numpy.zeros((4, 6), dtype=numpy.uint8), path)
+
+        overlays.submit("cv_board.png", render, lambda: done.append(True))
+        # submit returned before the overlay was written
+        self.assertEqual(overlays.status("cv_board.png")['state'], "pending")
+        started.set()
+        self.assertEqual(overlays.wait("cv_board.png", 5)['state'], READY)
+        self.assertEqual(done, [True])
+        self.assertEqual(os.listdir(self.directory), ["cv_board.png"])
+        self.assertEqual(overlays.status("never.png"), None)
+        overlays.stop()
+
+    def test_failed_render(self):
+        overlays = OverlayWriter(self.directory, workers=0)
+
+        def render(path):
+            raise IOError("disk full")
+
+        overlays.submit("cv_board.png", render)
+        status = overlays.status("cv_board.png")
+        self.assertEqual((status['state'], status['error']), (FAILED, "disk full"))
+        self.assertEqual(os.listdir(self.directory), [])
+
+    @unittest.skipIf(pcb_drill_overlays.Image is not None, "PIL downscales with thumbnail instead")
+    def test_downscale_without_pil(self):
+        overlays = OverlayWriter(self.directory, max_size=50, workers=0)
+        image = numpy.zeros((120, 200, 3), dtype=numpy.uint8)
+        image[::4, ::4] = 255
+        overlays.submit("diff_board.png", lambda path: overlays.save(image, path))
+        gray = numpy.concatenate(list(iter_png_strips(os.path.join(self.directory, "diff_board.png"))))
+        self.assertEqual(gray.shape, (30, 50))
+        self.assertTrue((gray == 255).all())
+        self.assertRaises(ImportError, OverlayWriter, self.directory, "jpeg")
+
+    def test_filename(self):
+        overlays = OverlayWriter(self.directory, workers=0)
+        self.assertEqual(overlays.filename("solder_maskboard.jpg"), "solder_maskboard.png")
+        self.assertEqual(overlays.filename("board.drl"), "board.drl.png")
+        self.assertEqual(overlays.filename("board.png", ".jpg"), "board.jpg")
+        self.assertEqual(overlays.mime_type, "image/png")
+        self.assertRaises(ValueError, OverlayWriter, self.directory, "gif")
+
+    def test_keep(self):
+        overlays = OverlayWriter(self.directory, workers=0, keep=2)
+        for number in xrange(4):
+            overlays.submit("cv_{0}.png".format(number),
+                            lambda path: overlays.save(numpy.zeros((2, 2), dtype=numpy.uint8), path))
+        self.assertEqual(overlays.status("cv_0.png"), None)
+        self.assertEqual(overlays.status("cv_3.png")['state'], READY)
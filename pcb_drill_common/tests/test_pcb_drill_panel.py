@@ -0,0 +1,92 @@
+import unittest
+import sys
+import os
+import re
+import time
+
+# Insert Path for project ../ from here
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from pcb_drill_gcode import PcbDrillGCode
+from pcb_drill_tools import DrillTool, ToolTable
+from test_pcb_drill_gcode import sample_holes
+
+if numpy is not None:
+    from pcb_drill_panel import Panel
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class TestPanel(unittest.TestCase):
+    def test_step_and_repeat(self):
+        """ Copies are offset by the pitch, row by row"""
+        panel = Panel([(1.0, 2.0), (3.0, 2.0)], 3, 2, 10.0, 20.0)
+        self.assertEqual(len(panel), 12)
+        self.assertEqual(list(panel)[:4], [(1.0, 2.0), (3.0, 2.0), (11.0, 2.0), (13.0, 2.0)])
+        self.assertEqual(panel.copy(2, 1).tolist(), [[21.0, 22.0], [23.0, 22.0]])
+
+    def test_rotation(self):
+        """ Copies turn about the board's centre, keeping diameters"""
+        panel = Panel([(0.0, 0.0, 0.8), (4.0, 0.0, 1.0)], 2, 1, 10.0, 10.0, rotation=[0, 180])
+        numpy.testing.assert_allclose(panel.copy(1, 0), [[14.0, 0.0, 0.8], [10.0, 0.0, 1.0]], atol=1e-9)
+        self.assertRaises(ValueError, Panel, sample_holes(), 2, 2, 10.0, 10.0, [0, 90])
+
+    def test_generator_matches_hole_list(self):
+        """ A panel drills exactly like its holes passed as a list"""
+        panel = Panel(sample_holes(), 3, 2, 50.0, 40.0, rotation=90)
+        for precision in (None, 3):
+            expected = PcbDrillGCode(coordinate_precision=precision)
+            expected.drill_holes(panel.holes().tolist())
+            gcode_generator = PcbDrillGCode(coordinate_precision=precision)
+            gcode_generator.drill_holes(panel)
+            self.assertEqual(gcode_generator.generate(), expected.generate())
+
+    def test_ordered_panel(self):
+        """ Ordering runs a row of copies at a time and never travels further"""
+        panel = Panel(sample_holes(), 4, 3, 50.0, 40.0)
+        gcode_generator = PcbDrillGCode(hole_ordering="nearest_neighbour")
+        gcode_generator.drill_holes(panel)
+        output = gcode_generator.generate()
+        self.assertEqual(len(re.findall(r"G1 X", output)), len(panel))
+        original, ordered = gcode_generator.travel_distance
+        self.assertTrue(ordered <= original)
+
+    def test_ordering_budget_is_shared(self):
+        """ The rows share one time budget and the travel comment follows the holes like unpanelized"""
+        class RecordingOrdering(object):
+            name = "recording"
+            time_budget = 0.5
+
+            def __init__(self):
+                self.deadlines = []
+
+            def __call__(self, holes, start=None, deadline=None):
+                self.deadlines.append(deadline)
+                return holes
+
+        ordering = RecordingOrdering()
+        panel = Panel(sample_holes(), 2, 5, 50.0, 40.0)
+        begin = time.time()
+        gcode_generator = PcbDrillGCode(hole_ordering=ordering)
+        gcode_generator.drill_holes(panel)
+        output = gcode_generator.generate()
+        self.assertEqual(len(ordering.deadlines), 5)
+        self.assertEqual(ordering.deadlines, sorted(ordering.deadlines))
+        self.assertTrue(ordering.deadlines[0] <= begin + 0.5 / 5 + 0.05)
+        self.assertTrue(ordering.deadlines[-1] <= begin + 0.5 + 0.05)
+        gcode_generator = PcbDrillGCode(hole_ordering=ordering)
+        gcode_generator.drill_holes(panel.holes().tolist())
+        for output in (output, gcode_generator.generate()):
+            self.assertTrue(output.index("Hole ordering recording") > output.rindex("G1 X"))
+
+    def test_tool_sections(self):
+        panel = Panel([(0.0, 0.0, 0.8), (5.0, 0.0, 1.2)], 2, 2, 10.0, 10.0)
+        gcode_generator = PcbDrillGCode(tool_table=ToolTable([DrillTool(1, 0.8), DrillTool(2, 1.2)]))
+        gcode_generator.drill_holes(panel)
+        output = gcode_generator.generate()
+        self.assertEqual(len(re.findall(r"M0 Load", output)), 2)
+        self.assertEqual(len(re.findall(r"G1 X", output)), 8)
@@ -0,0 +1,52 @@
+import unittest
+import sys
+import os
+import random
+
+# Insert Path for project ../ from here
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pcb_drill_path import NearestNeighbourOrdering, OptimizedOrdering, get_hole_ordering, travel_distance
+from pcb_drill_gcode import PcbDrillGCode
+from test_pcb_drill_gcode import sample_holes
+
+
+def random_holes(count, seed=1):
+    """ Return count random holes on a 300x200 bed"""
+    generator = random.Random(seed)
+    return [(generator.uniform(0, 300), generator.uniform(0, 200)) for i in range(count)]
+
+
+class TestHoleOrdering(unittest.TestCase):
+    def test_travel_distance(self):
+        """ Travel includes the leg from the start location"""
+        self.assertAlmostEqual(travel_distance([(3, 4), (3, 0)]), 4.0)
+        self.assertAlmostEqual(travel_distance([(3, 4), (3, 0)], start=(0, 0)), 9.0)
+
+    def test_orderings_keep_every_hole(self):
+        """ Ordering must not drop or duplicate holes"""
+        holes = random_holes(500)
+        for ordering in (NearestNeighbourOrdering(), OptimizedOrdering(time_budget=1.0)):
+            self.assertEqual(sorted(ordering(holes, (0, 0))), sorted(holes))
+
+    def test_optimized_is_shorter(self):
+        """ 2-opt/Or-opt should improve on nearest neighbour which improves on random order"""
+        holes = random_holes(500)
+        nearest = travel_distance(NearestNeighbourOrdering()(holes, (0, 0)), (0, 0))
+        optimized = travel_distance(OptimizedOrdering(time_budget=1.0)(holes, (0, 0)), (0, 0))
+        self.assertTrue(nearest < travel_distance(holes, (0, 0)))
+        self.assertTrue(optimized < nearest)
+
+    def test_unknown_ordering(self):
+        self.assertRaises(ValueError, get_hole_ordering, "bogus")
+
+    def test_generator_reports_travel(self):
+        """ The generator starts from the pre drill location and comments the travel saved"""
+        gcode_generator = PcbDrillGCode(hole_ordering="optimized")
+        gcode_generator.seek_predrill_location((250, 50))
+        gcode_generator.drill_holes(sample_holes())
+        output = gcode_generator.generate()
+        original, ordered = gcode_generator.travel_distance
+        self.assertTrue(ordered < original)
+        self.assertTrue("Hole ordering optimized" in output)
+        self.assertEqual(gcode_generator.ordering_start, (250, 50))
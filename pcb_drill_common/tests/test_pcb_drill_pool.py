@@ -0,0 +1,103 @@
+import unittest
+import sys
+import os
+import pickle
+import shutil
+import tempfile
+
+# Insert Path for project ../ from here
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy
+
+from pcb_drill_blobs import find_blobs, find_blobs_banded
+from pcb_drill_camera import save_image, synthetic_board
+from pcb_drill_pool import SharedArray, VisionPool, read_gray
+from pcb_drill_raster import open_pgm, write_pgm_header
+
+
+def scattered_holes(height=600, width=400, holes=150):
+    """ Grayscale mask with holes of many sizes, some across any band boundary """
+    random = numpy.random.RandomState(0)
+    mask = numpy.empty((height, width), dtype=numpy.uint8)
+    mask[:] = 220
+    y, x = numpy.ogrid[:height, :width]
+    for _ in xrange(holes):
+        hole_x, hole_y, radius = random.randint(0, width), random.randint(0, height), random.randint(2, 10)
+        mask[(x - hole_x) ** 2 + (y - hole_y) ** 2 <= radius * radius] = 20
+    return mask
+
+
+class TestSharedArray(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_pickles_as_its_file(self):
+        image = synthetic_board(64, 48)
+        shared = SharedArray.from_array(image, self.directory)
+        data = pickle.dumps(shared, pickle.HIGHEST_PROTOCOL)
+        self.assertTrue(len(data) < image.nbytes // 10)
+        numpy.testing.assert_array_equal(pickle.loads(data).array, image)
+        array = shared.array
+        shared.unlink()
+        self.assertEqual(os.listdir(self.directory), [])
+        # Still mapped after the file is gone
+        numpy.testing.assert_array_equal(array, image)
+
+    def test_from_memmap(self):
+        mask = scattered_holes(40, 30)
+        filename = os.path.join(self.directory, "mask.pgm")
+        with open(filename, "wb") as pgm_file:
+            write_pgm_header(pgm_file, 30, 40)
+            pgm_file.write(mask.tostring())
+        shared = SharedArray.from_memmap(open_pgm(filename))
+        numpy.testing.assert_array_equal(pickle.loads(pickle.dumps(shared)).array, mask)
+        # Not created by the pool, so not removed
+        shared.unlink()
+        self.assertTrue(os.path.exists(filename))
+
+
+class TestVisionPool(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assertSameBlobs(self, blobs, expected):
+        self.assertEqual(blobs.holes(), expected.holes())
+        numpy.testing.assert_array_equal(blobs.bounding_box, expected.bounding_box)
+        numpy.testing.assert_array_almost_equal(blobs.centroid, expected.centroid)
+
+    def test_banded_blobs(self):
+        mask = scattered_holes()
+        expected = find_blobs(mask)
+        for bands in (1, 3, 7):
+            self.assertSameBlobs(find_blobs_banded(mask, bands, overlap=24), expected)
+        # Holes taller than the overlap: searched again in one go
+        self.assertSameBlobs(find_blobs_banded(mask, 7, overlap=4), expected)
+
+    def test_workers(self):
+        pool = VisionPool(2, warm_up=("numpy",), directory=self.directory)
+        try:
+            mask = scattered_holes()
+            shared = pool.shared(mask)
+            self.assertSameBlobs(find_blobs_banded(shared, 2, overlap=24, map=pool.map), find_blobs(mask))
+            shared.unlink()
+            filenames = [os.path.join(self.directory, name) for name in ("pre.png", "post.png")]
+            save_image(synthetic_board(64, 48), filenames[0])
+            save_image(synthetic_board(64, 48, pitch=16), filenames[1])
+            pre, post = read_gray(pool, filenames)
+            self.assertEqual(pre.shape, (48, 64))
+            self.assertFalse((pre == post).all())
+            self.assertEqual(sorted(os.listdir(self.directory)), ["post.png", "pre.png"])
+        finally:
+            pool.close()
+
+    def test_no_workers(self):
+        pool = VisionPool(0, directory=self.directory)
+        self.assertEqual(pool.map(abs, [-1, 2]), [1, 2])
+        pool.close()
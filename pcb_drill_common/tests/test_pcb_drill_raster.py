@@ -0,0 +1,162 @@
+import unittest
+import sys
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+
+# Insert Path for project ../ from here
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+if numpy is not None:
+    from pcb_drill_blobs import draw_holes_strips, find_blobs
+    import pcb_drill_raster
+    from pcb_drill_raster import PngWriter, iter_png_strips, open_pgm, png_to_pgm, read_png_dpi, read_png_header
+    from benchmark_pcb_drill_raster import encode_adaptive_png, synthetic_mask
+
+
+def _chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+
+def _filter_row(kind, row, previous, pixel_bytes):
+    """ PNG filter kind applied to one row of bytes """
+    filtered = bytearray(len(row))
+    for index, value in enumerate(row):
+        left = row[index - pixel_bytes] if index >= pixel_bytes else 0
+        upper_left = previous[index - pixel_bytes] if index >= pixel_bytes else 0
+        up = previous[index]
+        if kind == 1:
+            predictor = left
+        elif kind == 2:
+            predictor = up
+        elif kind == 3:
+            predictor = (left + up) >> 1
+        elif kind == 4:
+            estimate = left + up - upper_left
+            predictor = min((abs(estimate - left), 0, left), (abs(estimate - up), 1, up),
+                            (abs(estimate - upper_left), 2, upper_left))[2]
+        else:
+            predictor = 0
+        filtered[index] = (value - predictor) & 0xff
+    return filtered
+
+
+def encode_png(pixels, color_type, bit_depth=8, width=None, filters=(0, 1, 2, 3, 4)):
+    """ PNG file contents of pixels (rows of sample bytes), cycling through filters row by row """
+    height = len(pixels)
+    channels = {0: 1, 2: 3, 4: 2, 6: 4}[color_type]
+    if width is None:
+        width = len(pixels[0]) * 8 // (channels * bit_depth)
+    pixel_bytes = max(1, channels * bit_depth // 8)
+    data = bytearray()
+    previous = bytearray(len(pixels[0]))
+    for number, row in enumerate(pixels):
+        kind = filters[number % len(filters)]
+        data.append(kind)
+        data.extend(_filter_row(kind, bytearray(row), previous, pixel_bytes))
+        previous = bytearray(row)
+    return ("\x89PNG\r\n\x1a\n" + _chunk("IHDR", struct.pack(">IIBBBBB", width, height, bit_depth, color_type, 0, 0, 0))
+            + _chunk("IDAT", zlib.compress(str(data))) + _chunk("IEND", ""))
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class TestRaster(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.random = numpy.random.RandomState(2)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _write(self, name, contents):
+        path = os.path.join(self.directory, name)
+        with open(path, "wb") as output_file:
+            output_file.write(contents)
+        return path
+
+    def test_filters(self):
+        """ Every filter type decodes, whatever the strip size"""
+        rgba = self.random.randint(0, 256, (23, 17, 4)).astype(numpy.uint8)
+        png = self._write("rgba.png", encode_png([row.tostring() for row in rgba.reshape(23, -1)], 6))
+        rgb = rgba[..., :3].astype(numpy.uint32)
+        expected = (rgb[..., 0] * 299 + rgb[..., 1] * 587 + rgb[..., 2] * 114 + 500) // 1000
+        for strip_rows in (1, 5, 100):
+            self.assertEqual(numpy.concatenate(list(iter_png_strips(png, strip_rows))).tolist(), expected.tolist())
+
+    def test_adaptive_filters(self):
+        """ A mask filtered like libpng does decodes the same with and without PIL"""
+        rgb = synthetic_mask(61, 47)
+        path = os.path.join(self.directory, "adaptive.png")
+        with open(path, "wb") as output_file:
+            counts = encode_adaptive_png(output_file, rgb)
+        self.assertTrue(counts[3] > 0 and counts[4] > 0)
+        expected = (rgb.astype(numpy.uint32) * [299, 587, 114]).sum(axis=2) + 500
+        image_module = pcb_drill_raster.Image
+        for decoder in set([image_module, None]):
+            pcb_drill_raster.Image = decoder
+            try:
+                decoded = numpy.concatenate(list(iter_png_strips(path, 10)))
+            finally:
+                pcb_drill_raster.Image = image_module
+            self.assertEqual(decoded.tolist(), (expected // 1000).tolist())
+
+    def test_one_bit(self):
+        mask = self.random.rand(9, 20) < 0.5
+        rows = numpy.packbits(mask, axis=1)
+        png = self._write("mask.png", encode_png([row.tostring() for row in rows], 0, bit_depth=1, width=20))
+        self.assertEqual(read_png_header(png).width, 20)
+        self.assertEqual(numpy.concatenate(list(iter_png_strips(png))).tolist(), (mask * 255).tolist())
+
+    def test_dpi(self):
+        """ The resolution comes from pHYs in pixels per meter, files without one have none"""
+        png = encode_png(["\x00\xff"], 0)
+        self.assertEqual(read_png_dpi(self._write("plain.png", png)), None)
+        phys = _chunk("pHYs", struct.pack(">IIB", 23622, 23622, 1))
+        png = png[:33] + phys + png[33:]
+        self.assertAlmostEqual(read_png_dpi(self._write("600dpi.png", png)), 600.0, places=1)
+        self.assertRaises(ValueError, read_png_dpi, self._write("mask.jpg", "\xff\xd8\xff"))
+
+    def test_tiled_matches_whole(self):
+        """ Blobs found strip by strip in a memory-mapped PGM match the whole image, also across strips"""
+        image = numpy.ones((120, 90), dtype=numpy.uint8) * 255
+        for x, y in self.random.randint(5, 85, (40, 2)):
+            image[y:y + 6, x:x + 5] = 0
+        image[10:110, 40:43] = 0
+        png = self._write("mask.png", encode_png([row.tostring() for row in image], 0))
+        pgm = os.path.join(self.directory, "mask.pgm")
+        png_to_pgm(png, pgm, strip_rows=7)
+        mask = open_pgm(pgm)
+        self.assertEqual(mask.tolist(), image.tolist())
+        whole = find_blobs(image)
+        tiled = find_blobs(mask, strip_rows=7)
+        self.assertEqual(tiled.holes(), whole.holes())
+        self.assertEqual(tiled.bounding_box.tolist(), whole.bounding_box.tolist())
+
+    def test_draw_strips(self):
+        image = numpy.ones((30, 40), dtype=numpy.uint8) * 200
+        overlay = os.path.join(self.directory, "overlay.png")
+        strips = (image[top:top + 8] for top in xrange(0, 30, 8))
+        draw_holes_strips(strips, 40, 30, [(10, 10, 1.0), (39, 29, 1.0)], overlay)
+        # Red outline pixels are darker in grayscale
+        gray = numpy.concatenate(list(iter_png_strips(overlay)))
+        self.assertEqual(gray[10, 12], (255 * 299 + 500) // 1000)
+        self.assertEqual(gray[10, 10], 200)
+        self.assertEqual(gray[29, 37], (255 * 299 + 500) // 1000)
+
+    def test_writer(self):
+        rgb = self.random.randint(0, 256, (11, 13, 3)).astype(numpy.uint8)
+        path = os.path.join(self.directory, "written.png")
+        with open(path, "wb") as output_file:
+            writer = PngWriter(output_file, 13, 11)
+            writer.write(rgb[:4])
+            writer.write(rgb[4:])
+            writer.close()
+        expected = (rgb.astype(numpy.uint32) * [299, 587, 114]).sum(axis=2) + 500
+        self.assertEqual(numpy.concatenate(list(iter_png_strips(path))).tolist(), (expected // 1000).tolist())
@@ -0,0 +1,66 @@
+import unittest
+import sys
+import os
+import math
+
+# Insert Path for project ../ from here
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy
+
+from pcb_drill_registration import (draw_outline, phase_correlation, register, similarity, transform_points,
+                                    warp_affine)
+
+
+def random_board(random, width=300, height=200, holes=40):
+    """ Light board with dark holes scattered over it """
+    board = numpy.empty((height, width), dtype=numpy.uint8)
+    board[:] = 230
+    y, x = numpy.ogrid[:height, :width]
+    for _ in xrange(holes):
+        hole_x, hole_y, radius = random.randint(8, width - 8), random.randint(8, height - 8), random.randint(2, 6)
+        board[(x - hole_x) ** 2 + (y - hole_y) ** 2 <= radius * radius] = 20
+    return board
+
+
+def picture(random, board, matrix, shape=(384, 512)):
+    """ board moved by matrix onto a darker bed, with sensor noise """
+    image = warp_affine(board.astype(numpy.float32) - 230, matrix, shape) + 120
+    image += random.normal(0, 8, shape)
+    return numpy.clip(image, 0, 255).astype(numpy.uint8)
+
+
+class TestRegistration(unittest.TestCase):
+    def setUp(self):
+        self.random = numpy.random.RandomState(1)
+        self.board = random_board(self.random)
+
+    def test_register(self):
+        height, width = self.board.shape
+        corners = [(0, 0), (width - 1, 0), (width - 1, height - 1), (0, height - 1)]
+        for angle, scale, dx, dy in [(0, 1.0, 60, 80), (8, 0.8, 200, 60), (-15, 1.2, 100, 150), (175, 0.9, 400, 300)]:
+            truth = similarity(math.radians(angle), scale, dx, dy)
+            registration = register(self.board, picture(self.random, self.board, truth))
+            error = numpy.abs(numpy.array(registration.corners) - transform_points(truth, corners)).max()
+            self.assertTrue(error < 1.0, "{0} degrees: corners off by {1}".format(angle, error))
+            self.assertAlmostEqual(math.degrees(registration.angle), angle, delta=0.2)
+            self.assertTrue(registration.confidence > 0.2)
+        self.assertEqual(registration.crop(picture(self.random, self.board, truth)).shape, self.board.shape)
+        self.assertEqual(sorted(registration.to_dict()),
+                         ['angle', 'confidence', 'corners', 'matrix', 'scale', 'translation'])
+
+    def test_no_board(self):
+        noise = numpy.clip(self.random.normal(120, 30, (384, 512)), 0, 255).astype(numpy.uint8)
+        self.assertTrue(register(self.board, noise).confidence < 0.2)
+
+    def test_phase_correlation(self):
+        image = self.random.normal(0, 1, (64, 64))
+        dx, dy, peak = phase_correlation(numpy.roll(numpy.roll(image, 5, axis=1), 3, axis=0), image)
+        self.assertEqual((round(dx), round(dy)), (5, 3))
+        self.assertAlmostEqual(peak, 1.0, places=3)
+
+    def test_draw_outline(self):
+        rgb = numpy.zeros((10, 10, 3), dtype=numpy.uint8)
+        draw_outline(rgb, [(2, 2), (7, 2), (7, 7), (2, 7)], (255, 0, 0))
+        self.assertEqual(int(rgb[2, 2:8, 0].min()), 255)
+        self.assertEqual(int(rgb[5, 5, 0]), 0)
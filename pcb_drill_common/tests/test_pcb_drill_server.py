@@ -0,0 +1,97 @@
+import unittest
+import sys
+import os
+import threading
+import time
+
+# Insert Path for project ../ from here
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+try:
+    import zmq
+except ImportError:
+    zmq = None
+
+from pcb_drill_transport import Binary, to_bytes
+
+if zmq is not None:
+    from pcb_drill_client import PcbDrillClient
+    from load_test_pcb_drill_server import run_clients, start_server
+
+
+class ImageRPC(object):
+    """ Echo an in-band image back in-band """
+
+    def invert(self, image, name):
+        return {'name': name, 'image': Binary("".join(chr(255 - ord(byte)) for byte in to_bytes(image)))}
+
+
+class CameraRPC(object):
+    """ Two commands on one resource that record whether they ever overlapped """
+
+    def __init__(self):
+        self.busy = False
+        self.overlapped = False
+
+    def capture_image(self):
+        if self.busy:
+            self.overlapped = True
+        self.busy = True
+        time.sleep(0.05)
+        self.busy = False
+
+    def start_preview(self):
+        return self.capture_image()
+
+
+@unittest.skipIf(zmq is None, "pyzmq is not installed")
+class TestServer(unittest.TestCase):
+    def test_router_serves_clients_at_once(self):
+        address = start_server("router", 4)
+        begin = time.time()
+        run_clients(address, 4, 2, 0.2)
+        # One at a time would take 1.6s
+        self.assertTrue(time.time() - begin < 1.2)
+
+    def test_errors(self):
+        daemon = PcbDrillClient()
+        daemon.connect(start_server("router", 2))
+        self.assertEqual(daemon('ping')['output'], "pong")
+        response = daemon('work', seconds="not a number")
+        self.assertFalse(response['success'])
+        self.assertTrue('exception' in response)
+
+    def test_resource_lock(self):
+        rpc = CameraRPC()
+        address = start_server("router", 4, rpc, {'camera': ("capture_image", "start_preview")})
+
+        def client(command):
+            daemon = PcbDrillClient()
+            daemon.connect(address)
+            for _ in xrange(3):
+                daemon(command)
+        threads = [threading.Thread(target=client, args=(command,))
+                   for command in ("capture_image", "start_preview", "capture_image")]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertFalse(rpc.overlapped)
+
+    def test_job_request_sent_again(self):
+        """ Attempts of one request share its request id and start one job"""
+        daemon = PcbDrillClient()
+        daemon.connect(start_server("router", 2, job_commands=("work",)))
+        request = {'command': 'work', 'seconds': 0.01, 'request_id': "retried"}
+        first = daemon._send(dict(request), None, 0)
+        self.assertEqual(daemon._send(dict(request), None, 0)['job_id'], first['job_id'])
+        self.assertNotEqual(daemon('work', seconds=0.01)['job_id'], first['job_id'])
+        self.assertEqual(len(daemon('job_list')['output']), 2)
+
+    def test_binary_transport(self):
+        for envelope in ("json", None):
+            daemon = PcbDrillClient(envelope)
+            daemon.connect(start_server("router", 2, ImageRPC()))
+            response = daemon('invert', image=Binary("\x00\x01\xff" * 1000), name="mask.png")
+            self.assertEqual(response['output']['name'], "mask.png")
+            self.assertEqual(to_bytes(response['output']['image']), "\xff\xfe\x00" * 1000)
@@ -0,0 +1,85 @@
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+
+# Insert Path for project ../ from here
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pcb_drill_excellon import read_drill_file
+from pcb_drill_session import HoleArray, SessionStore
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestHoleArray(unittest.TestCase):
+    def test_round_trip(self):
+        holes = [(10, 20, 0.8), (30, 40, 1.0)]
+        compact = HoleArray(holes)
+        self.assertEqual(compact.holes(), holes)
+        # Ints stay ints so the gcode and hole lists read the same
+        self.assertTrue(isinstance(compact.holes()[0][0], int))
+        self.assertEqual((len(compact), compact.nbytes), (2, 48))
+        self.assertEqual(HoleArray([]).holes(), [])
+        self.assertEqual(HoleArray([(1.5, 2.5)]).holes(), [(1.5, 2.5)])
+        self.assertRaises(ValueError, HoleArray, [(1, 2), (1, 2, 3)])
+
+    def test_missing_diameters(self):
+        """ A drill file without tools has no diameters, they come back as None"""
+        holes = read_drill_file("M48\nMETRIC\n%\nX1.0Y2.0\nX3.0Y4.0\nM30").drill_holes()
+        self.assertEqual(HoleArray(holes).holes(), [(1.0, 2.0, None), (3.0, 4.0, None)])
+        self.assertEqual(HoleArray([(1, 2, 0.8), (3, 4, None)]).holes(), [(1, 2, 0.8), (3, 4, None)])
+
+
+class TestSessionStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.clock = Clock()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_spill_and_reload(self):
+        store = SessionStore(self.directory, max_bytes=250, ttl=0, clock=self.clock)
+        store['a'] = "a" * 100
+        store['b'] = "b" * 100
+        store['a']
+        store['c'] = "c" * 100
+        # b was least recently used, it went to disk
+        self.assertEqual(store.stats()['spilled'], 1)
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+        self.assertEqual(store['b'], "b" * 100)
+        self.assertRaises(KeyError, store.__getitem__, 'd')
+        stats = store.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['reloads']), (2, 1, 1))
+        self.assertTrue(stats['bytes'] <= 250)
+        self.assertEqual(len(store), 3)
+
+    def test_no_directory_drops(self):
+        store = SessionStore(None, max_bytes=150, clock=self.clock)
+        store['a'] = "a" * 100
+        store['b'] = "b" * 100
+        self.assertFalse('a' in store)
+        self.assertEqual((store.evictions, len(store)), (1, 1))
+
+    def test_ttl(self):
+        store = SessionStore(self.directory, max_bytes=150, ttl=60, clock=self.clock)
+        holes = store.namespace("holes")
+        holes['board.drl'] = HoleArray([(1, 2, 0.8)])
+        store['big'] = "x" * 100
+        store['bigger'] = "y" * 100
+        self.clock.now += 30
+        self.assertEqual(holes['board.drl'].holes(), [(1, 2, 0.8)])
+        self.clock.now += 45
+        # board.drl was used 45s ago, the others 75s ago (big from disk)
+        self.assertTrue('board.drl' in holes)
+        self.assertFalse('big' in store or 'bigger' in store)
+        self.assertEqual(store.expirations, 2)
+        self.assertEqual(os.listdir(self.directory), [])
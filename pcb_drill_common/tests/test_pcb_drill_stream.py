@@ -0,0 +1,57 @@
+import unittest
+import sys
+import os
+import time
+
+# Insert Path for project ../ from here
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import zmq
+
+from pcb_drill_camera import CameraService, FakeCameraBackend
+from pcb_drill_stream import BOUNDARY, Frame, FrameProducer, FrameRelay, mjpeg_parts
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.02)
+    return condition()
+
+
+class TestStream(unittest.TestCase):
+    def setUp(self):
+        self.context = zmq.Context()
+        self.camera = CameraService(FakeCameraBackend(), idle_timeout=0)
+        self.producer = FrameProducer(self.camera, "inproc://preview", 64, 48, fps=50, context=self.context)
+
+    def tearDown(self):
+        self.producer.stop()
+        self.context.term()
+
+    def test_relay(self):
+        relay = FrameRelay("inproc://preview", self.context, linger=0.1)
+        # Nobody watches: the camera stays closed
+        time.sleep(0.1)
+        self.assertEqual((self.producer.frames, self.camera.captures), (0, 0))
+        viewers = [relay.frames(), relay.frames()]
+        first = [next(viewer) for viewer in viewers]
+        self.assertTrue(first[0].content_type in ("image/jpeg", "image/png"))
+        self.assertEqual((first[0].width, first[0].height), (64, 48))
+        # A slow viewer gets the newest frame, not the ones it missed
+        time.sleep(0.2)
+        later = next(viewers[0])
+        self.assertTrue(later.sequence > first[0].sequence + 1)
+        self.assertEqual(relay.viewers, 2)
+        for viewer in viewers:
+            viewer.close()
+        self.assertEqual(relay.viewers, 0)
+        # The relay unsubscribes after its linger and the producer stops capturing
+        self.assertTrue(wait_for(lambda: not self.producer.watching))
+        frames = self.producer.frames
+        time.sleep(0.1)
+        self.assertEqual(self.producer.frames, frames)
+
+    def test_mjpeg_parts(self):
+        body = "".join(mjpeg_parts([Frame(1, 0.0, 2, 2, "image/jpeg", "abc")]))
+        self.assertEqual(body, "--{0}\r\nContent-Type: image/jpeg\r\nContent-Length: 3\r\n\r\nabc\r\n".format(BOUNDARY))
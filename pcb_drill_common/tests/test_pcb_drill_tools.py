@@ -0,0 +1,89 @@
+import unittest
+import sys
+import os
+import re
+
+# Insert Path for project ../ from here
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from pcb_drill_tools import DrillTool, ToolTable, diameters_to_mm, parse_tool_table, equivalent_diameter
+from pcb_drill_gcode import PcbDrillGCode
+
+if numpy is not None:
+    from pcb_drill_blobs import find_blobs
+    from pcb_drill_raster import iter_png_strips
+
+SOLDER_MASK = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           '..', '..', 'pcb_drilld', 'tests', 'functional', 'solder_mask_test.png')
+
+
+def sized_holes():
+    """ Holes with (x, y, diameter)"""
+    return [(10.0, 10.0, 0.75), (20.0, 10.0, 1.3), (30.0, 10.0, 0.9),
+            (40.0, 10.0, 1.05), (50.0, 10.0, 0.8), (60.0, 10.0, 1.25)]
+
+
+class TestToolTable(unittest.TestCase):
+    def setUp(self):
+        self.table = ToolTable([DrillTool(2, 1.0), DrillTool(1, 0.8), DrillTool(3, 1.2, depth=-1.6)])
+
+    def test_closest_tool(self):
+        self.assertEqual(self.table.tool_for(0.85).number, 1)
+        self.assertEqual(self.table.tool_for(0.95).number, 2)
+        self.assertEqual(self.table.tool_for(5.0).number, 3)
+        self.assertEqual(self.table.tool_for(None).number, 1)
+
+    def test_group(self):
+        """ Groups come back smallest tool first with the holes in their original order"""
+        groups = self.table.group(sized_holes())
+        self.assertEqual([tool.number for tool, holes in groups], [1, 2, 3])
+        self.assertEqual([hole[0] for hole in groups[0][1]], [10.0, 30.0, 50.0])
+        self.assertEqual([hole[0] for hole in groups[2][1]], [20.0, 60.0])
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_group_array(self):
+        groups = self.table.group(numpy.array(sized_holes()))
+        self.assertEqual([(tool.number, holes[:, 0].tolist()) for tool, holes in groups],
+                         [(tool.number, [hole[0] for hole in holes])
+                          for tool, holes in self.table.group(sized_holes())])
+
+    def test_parse_tool_table(self):
+        table = parse_tool_table("T1 0.8, T2 1.0 plunge_feed=80 depth=-1.6")
+        self.assertEqual([tool.number for tool in table], [1, 2])
+        self.assertEqual(table.tool_for(1.0).drill_command, "G1 Z-1.6 F80")
+        self.assertTrue(parse_tool_table("") is None)
+        self.assertRaises(ValueError, parse_tool_table, "T1 0.8 speed=3")
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_solder_mask_in_mm(self):
+        """ Blob diameters (5-16 pixels) of a 150 DPI mask sorted onto the example table of pcb_drill.ini """
+        holes = find_blobs(numpy.concatenate(list(iter_png_strips(SOLDER_MASK)))).holes()
+        table = parse_tool_table("T1 0.8, T2 1.0 plunge_feed=80, T3 1.2 depth=-1.6")
+        # In pixels everything looks bigger than the biggest bit
+        self.assertEqual([tool.number for tool, group in table.group(holes)], [3])
+        groups = dict((tool.number, group) for tool, group in table.group(diameters_to_mm(holes, 25.4 / 150)))
+        self.assertEqual(sorted(groups), [1, 2, 3])
+        self.assertEqual(sum(len(group) for group in groups.values()), 105)
+        # Most pads are 6.4 pixels, 1.08 mm
+        self.assertEqual(max(groups, key=lambda number: len(groups[number])), 2)
+        self.assertTrue(all(hole[2] > 1.1 for hole in groups[3]))
+        # Unknown scale: no diameters, the smallest bit
+        self.assertEqual([tool.number for tool, group in table.group(diameters_to_mm(holes, None))], [1])
+
+    def test_equivalent_diameter(self):
+        self.assertAlmostEqual(equivalent_diameter(3.14159265358979), 2.0)
+
+    def test_generator_sections(self):
+        """ One tool change per tool, each followed by only that tool's holes"""
+        gcode_generator = PcbDrillGCode(tool_table=self.table, hole_ordering="nearest_neighbour")
+        gcode_generator.drill_holes(sized_holes())
+        output = gcode_generator.generate()
+        self.assertEqual(len(re.findall(r"M0 Load", output)), 3)
+        self.assertEqual(output.count("G1 Z-1.6 F100"), 2)
+        self.assertEqual(len(re.findall(r"G1 X", output)), len(sized_holes()))
+        self.assertTrue(output.index("M0 Load T1") < output.index("M0 Load T2") < output.index("M0 Load T3"))
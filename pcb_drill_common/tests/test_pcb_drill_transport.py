@@ -0,0 +1,43 @@
+import unittest
+import sys
+import os
+import json
+
+# Insert Path for project ../ from here
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pcb_drill_transport
+from pcb_drill_transport import Binary, decode_message, encode_message, to_bytes
+
+
+class TestTransport(unittest.TestCase):
+    def test_plain_message_is_json(self):
+        """ Messages without binary data stay one JSON frame, what older clients send """
+        frames = encode_message({'command': 'ping'})
+        self.assertEqual(frames, [json.dumps({'command': 'ping'})])
+        self.assertEqual(decode_message(frames), ({'command': 'ping'}, None))
+
+    def test_binary_frames(self):
+        image = "\x89PNG\r\n\x1a\n" + "\x00" * 1000
+        frames = encode_message({'command': 'process_solder_mask', 'image': Binary(image),
+                                 'debug': [Binary("a"), {'overlay': Binary("b")}]}, "json")
+        # Marker, envelope, then the raw bytes untouched
+        self.assertEqual(len(frames), 5)
+        self.assertTrue(image in frames)
+        message, envelope = decode_message(frames)
+        self.assertEqual(envelope, "json")
+        self.assertEqual(message['command'], "process_solder_mask")
+        self.assertEqual(to_bytes(message['image']), image)
+        self.assertEqual(to_bytes(message['debug'][0]), "a")
+        self.assertEqual(to_bytes(message['debug'][1]['overlay']), "b")
+
+    @unittest.skipIf(pcb_drill_transport.msgpack is None, "msgpack is not installed")
+    def test_msgpack_envelope(self):
+        frames = encode_message({'command': 'capture_image', 'width': 1024, 'image': Binary("jpeg")}, "msgpack")
+        message, envelope = decode_message(frames)
+        self.assertEqual(envelope, "msgpack")
+        self.assertEqual((message['width'], to_bytes(message['image'])), (1024, "jpeg"))
+
+    def test_errors(self):
+        self.assertRaises(ValueError, encode_message, {'image': Binary("x")}, "xml")
+        self.assertRaises(ValueError, decode_message, ["not a marker", "{}"])
@@ -1,6 +1,7 @@
 #!/home/pi/pcb_drill/bin/python
 
 import argparse
+import base64
 import json
 import os
 import random
@@ -10,7 +11,8 @@ import datetime
 import ConfigParser
 import StringIO
 
-from flask import Flask, render_template, request, url_for, g, make_response, abort, session, redirect, flash
+from flask import (Flask, Response, render_template, request, url_for, g, make_response, abort, session, redirect,
+                   flash, jsonify, send_from_directory)
 from werkzeug.utils import secure_filename
 from werkzeug.local import LocalProxy
 
@@ -21,12 +23,42 @@ GCODE_LIBRARY = ""
 IMAGE_STORAGE = ""
 DEFAULT_WIDTH = 1024
 DEFAULT_HEIGHT = 768
+# Seconds between job_result polls while a slow command runs on the daemon
+JOB_POLL_INTERVAL = 0.25
+# Seconds a request waits for a daemon job before it cancels the job
+JOB_TIMEOUT = 600.0
+# Seconds /overlays waits for the daemon to render an overlay
+OVERLAY_TIMEOUT = 30
+# Send uploads to the daemon in-band instead of through image storage
+BINARY_TRANSPORT = False
+# With BINARY_TRANSPORT, whether the daemon still writes uploads and overlays to image storage
+PERSIST_IMAGES = True
+# The daemon's live camera preview and the relay its viewers share
+PREVIEW_SOCKET = "tcp://localhost:5556"
+PREVIEW_RELAY = None
+# The daemon's RPC socket and the connections every request of this process shares
+DAEMON_SOCKET = "tcp://localhost:5555"
+DAEMON_POOL_SIZE = 4
+# Seconds to wait for each answer, times an unanswered request is sent again and seconds a connection
+# may sit unused before it is pinged
+DAEMON_TIMEOUT = 10.0
+DAEMON_RETRIES = 2
+DAEMON_HEARTBEAT = 30.0
+DAEMON_POOL = None
+# The index of GCODE_LIBRARY, rescanned at most every LIBRARY_REFRESH seconds
+LIBRARY_REFRESH = 5.0
+LIBRARY_PAGE_SIZE = 50
+GCODE_LIBRARY_INDEX = None
 
 # Insert Path for project ../ from here
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 
-from pcb_drill_common.pcb_drill_client import PcbDrillClient
+from pcb_drill_common.pcb_drill_client import ClientPool, DaemonTimeout
+from pcb_drill_common.pcb_drill_transport import Binary, to_bytes
+from pcb_drill_common.pcb_drill_stream import FrameRelay, MIMETYPE, mjpeg_parts
 from pcb_drill_common.pcb_drill_gcode import calibrate_printer, eject_bed, retract_bed
+from pcb_drill_common.pcb_drill_estimate import format_duration
+from pcb_drill_common.pcb_drill_library import GCodeLibrary, ORDERS
 
 from navigation_menu import NavigationMenuItem, NavigationMenu
 
@@ -44,6 +76,7 @@ def get_nav_menu_items():
 
     main_menu = NavigationMenu('Main', 'main', action='')
     main_menu.add(NavigationMenuItem('Solder Mask', 'main', action='soldermask'))
+    main_menu.add(NavigationMenuItem('Drill File', 'main', action='drillfile'))
     main_menu.add(NavigationMenuItem('GCode', 'main', action='gcode'))
     main_menu.add(NavigationMenuItem('Library', 'library', filename=''))
 
@@ -79,20 +112,47 @@ def generate_response(name, template, **kwargs):
     return response
 
 def connect_to_daemon():
-    """Connect to background daemon """
-    daemon = getattr(g, 'daemon', None)
-    if daemon is None:
-        daemon = g.daemon = PcbDrillClient()
-        daemon.connect("tcp://localhost:5555")
-    return daemon
+    """ The ClientPool every request of this process borrows daemon connections from """
+    global DAEMON_POOL
+    if DAEMON_POOL is None:
+        DAEMON_POOL = ClientPool(DAEMON_SOCKET, DAEMON_POOL_SIZE, DAEMON_TIMEOUT, DAEMON_RETRIES, DAEMON_HEARTBEAT)
+    return DAEMON_POOL
+
+def call_daemon(*args, **kwargs):
+    """ One RPC round trip, a daemon that does not answer is a DaemonError """
+    try:
+        return connect_to_daemon()(*args, **kwargs)
+    except DaemonTimeout as error:
+        raise DaemonError({'success': False, 'error': str(error)})
 
 def send_command(*args, **kwargs):
-    """ send RPC command to daemon from Flask"""
-    daemon = LocalProxy(connect_to_daemon)
-    response = daemon(*args, **kwargs)
+    """ send RPC command to daemon from Flask, slow commands run as a daemon job that is waited for"""
+    response = call_daemon(*args, **kwargs)
     if 'exception' in response:
         raise DaemonError(response)
+    if 'job_id' in response:
+        response = wait_for_job(response['job_id'])
     return response
+
+
+def wait_for_job(job_id):
+    """ Poll the daemon until job_id finished, returns a response like a direct command's.
+        A job still running after JOB_TIMEOUT seconds is cancelled and is a DaemonError """
+    deadline = time.time() + JOB_TIMEOUT
+    while True:
+        response = call_daemon('job_result', job_id=job_id)
+        if 'exception' in response:
+            raise DaemonError(response)
+        job = response['output']
+        if job['state'] == 'done':
+            return {'success': True, 'output': job['result'], 'time': job.get('elapsed', 0)}
+        if job['state'] in ('failed', 'cancelled'):
+            raise DaemonError(job)
+        if time.time() > deadline:
+            call_daemon('job_cancel', job_id=job_id)
+            raise DaemonError({'success': False, 'error': "Job {0} ({1}) did not finish in {2}s and was cancelled"
+                               .format(job_id, job.get('command'), JOB_TIMEOUT)})
+        time.sleep(JOB_POLL_INTERVAL)
     
 
 def internal_error(message=None):
@@ -105,6 +165,52 @@ def index():
     return generate_response("index", "index.html")
 
 
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """ Stage and progress of a daemon job as JSON """
+    try:
+        return jsonify(send_command('job_status', job_id=job_id)['output'])
+    except DaemonError as error:
+        return jsonify({'error': str(error)}), 404
+
+
+@app.route('/overlays/<filename>')
+def overlay(filename):
+    """ Redirect to a debug overlay once the daemon finished rendering it in the background"""
+    deadline = time.time() + OVERLAY_TIMEOUT
+    try:
+        while True:
+            status = send_command('overlay_status', filename=filename)['output']
+            if status['state'] == 'ready':
+                return redirect(url_for('static', filename='pcb_drill_image_library/' + filename))
+            if status['state'] == 'failed' or time.time() > deadline:
+                break
+            time.sleep(JOB_POLL_INTERVAL)
+    except DaemonError:
+        abort(404)
+    if status['state'] == 'failed':
+        abort(404)
+    response = make_response("Overlay {0} is not ready yet".format(filename), 503)
+    response.headers['Retry-After'] = str(OVERLAY_TIMEOUT)
+    return response
+
+
+@app.route('/daemon/health')
+def daemon_health():
+    """ Whether the daemon answers a heartbeat, and how the connection pool is used, as JSON """
+    daemon = connect_to_daemon()
+    daemon.ping()
+    return jsonify(daemon.stats()), 200 if daemon.healthy else 503
+
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def job_cancel(job_id):
+    try:
+        return jsonify(send_command('job_cancel', job_id=job_id)['output'])
+    except DaemonError as error:
+        return jsonify({'error': str(error)}), 404
+
+
 @app.route('/calibrate/printer', methods=['GET', 'POST'])
 def calibrate_printer():
     pre_image_filename = session.get('pre_image_filename', None)
@@ -140,7 +246,7 @@ def calibrate_printer():
                 del session['pre_image_filename']
                 del session['post_image_filename']
                 message = send_command('calibrate_printer', pre_drill_filename=os.path.basename(pre_image_filename), post_drill_filename=os.path.basename(post_image_filename))
-                cv_image_filename = url_for('static', filename="pcb_drill_image_library/" + message['output']['cv_image_filename'])
+                cv_image_filename = url_for('overlay', filename=message['output']['cv_image_filename'])
     except DaemonError as error:
         return internal_error(error)
 
@@ -175,9 +281,9 @@ def calibrate_pcb():
             message = send_command('calibrate_pcb', pcb_filename=filename)
             flash("pcb_drilld" + str(message['output']) + " duration="  + str(message['time']) + " second(s)")
             return generate_response('calibrate_pcb', 'calibrate/pcb.html', calibrate_pcb_fullpath=calibrate_pcb_fullpath,
-                                        cv_keypoint_fullpath = url_for('static', filename="pcb_drill_image_library/" + message['output']['cv_keypoint_filename']),
-                                        #pcb_cropped_fullpath = url_for('static', filename="pcb_drill_image_library/" + message['output']['pcb_cropped_filename']),
-                                        cv_image_fullpath = url_for('static', filename="pcb_drill_image_library/" + message['output']['cv_image']))
+                                        cv_keypoint_fullpath = url_for('overlay', filename=message['output']['cv_keypoint_filename']),
+                                        #pcb_cropped_fullpath = url_for('overlay', filename=message['output']['pcb_cropped_filename']),
+                                        cv_image_fullpath = url_for('overlay', filename=message['output']['cv_image']))
 
         except DaemonError as error:
             return internal_error(error)
@@ -199,12 +305,29 @@ def calibrate_camera():
     return generate_response('calibrate_camera', 'calibrate/camera.html')
 
 
+def preview_relay():
+    """ The FrameRelay every preview viewer of this process shares """
+    global PREVIEW_RELAY
+    if PREVIEW_RELAY is None:
+        PREVIEW_RELAY = FrameRelay(PREVIEW_SOCKET)
+    return PREVIEW_RELAY
+
+
+@app.route('/camera/stream')
+def camera_stream():
+    """ Live camera preview as MJPEG, frames are encoded once by the daemon for every viewer """
+    return Response(mjpeg_parts(preview_relay().frames()), mimetype=MIMETYPE,
+                    headers={'Cache-Control': 'no-cache, no-store'})
+
+
 
 @app.route('/main/<action>', methods=['GET', 'POST'])
 def main(action):
     if request.method == 'GET':
         if action == "soldermask":
             template = "soldermask.html"
+        elif action == "drillfile":
+            template = "drillfile.html"
         elif action == "gcode":
             template = "gcode.html"
         #elif action == "index":
@@ -219,25 +342,51 @@ def main(action):
         if action == "soldermask":
             if 'image' in request.files:
                 f = request.files['image']
-                filename = IMAGE_STORAGE + "/" + session['pcb_drill_session'] + "solder_mask_original_" + secure_filename(f.filename)
-                f.save(filename)
+                filename = session['pcb_drill_session'] + "solder_mask_original_" + secure_filename(f.filename)
+                if BINARY_TRANSPORT:
+                    # The overlay comes back in the reply
+                    arguments = {'image': Binary(f.read()), 'persist': PERSIST_IMAGES}
+                else:
+                    f.save(IMAGE_STORAGE + "/" + filename)
+                    arguments = {}
                 try:
-                    message = send_command('process_solder_mask', filename=session['pcb_drill_session'] +
-                                             "solder_mask_original_" +
-                                                secure_filename(f.filename))
+                    message = send_command('process_solder_mask', filename=filename, **arguments)
                 except DaemonError as error:
                     return internal_error(error)
                 data = message['output']
                 prefix_rows = len(data['prefix'].splitlines())
                 postfix_rows = len(data['postfix'].splitlines())
                 body_rows = len(data['body'].splitlines())
-                cv_solder_mask_filename=url_for('static', filename='pcb_drill_image_library/' + os.path.basename(data['cv_solder_mask_filename']))
+                if 'cv_solder_mask_filename' in data:
+                    cv_solder_mask_filename=url_for('overlay', filename=os.path.basename(data['cv_solder_mask_filename']))
+                else:
+                    cv_solder_mask_filename = "data:{0};base64,{1}".format(data['solder_mask_image_type'],
+                                                                           base64.b64encode(to_bytes(data['solder_mask_image'])))
                 return generate_response('main', 'soldermask.html',prefix=data['prefix'], postfix=data['postfix'],
                             gcode=data['gcode'], count=data['count'],body=data['body'],
                             cv_solder_mask_filename=cv_solder_mask_filename,
                             holes=data['holes'], prefix_rows=prefix_rows, postfix_rows=postfix_rows, body_rows=body_rows) 
             else:
                 print "No file"
+        elif action == "drillfile":
+            if 'drill_file' in request.files:
+                f = request.files['drill_file']
+                filename = session['pcb_drill_session'] + "drill_file_" + secure_filename(f.filename)
+                f.save(IMAGE_STORAGE + "/" + filename)
+                try:
+                    message = send_command('process_drill_file', filename=filename)
+                except DaemonError as error:
+                    return internal_error(error)
+                data = message['output']
+                prefix_rows = len(data['prefix'].splitlines())
+                postfix_rows = len(data['postfix'].splitlines())
+                body_rows = len(data['body'].splitlines())
+                return generate_response('main', 'drillfile.html', prefix=data['prefix'], postfix=data['postfix'],
+                            gcode=data['gcode'], count=data['count'], body=data['body'], tools=data['tools'],
+                            slots=data['slots'], holes=data['holes'], prefix_rows=prefix_rows,
+                            postfix_rows=postfix_rows, body_rows=body_rows)
+            else:
+                print "No file"
         elif action == "gcode":
             gcode = StringIO.StringIO()
             gcode.write(request.form.get("prefix"))
@@ -247,55 +396,77 @@ def main(action):
     else:
         raise NotImplementedError("Error not here")
 
+def gcode_library():
+    """ The GCodeLibrary index every request of this process shares """
+    global GCODE_LIBRARY_INDEX
+    if GCODE_LIBRARY_INDEX is None:
+        GCODE_LIBRARY_INDEX = GCodeLibrary(GCODE_LIBRARY, refresh_interval=LIBRARY_REFRESH)
+    return GCODE_LIBRARY_INDEX
+
+
+# These are special files that are generated on the fly.
+GENERATED_GCODE = {'calibrate_printer.gcode': calibrate_printer, 'eject_bed.gcode': eject_bed,
+                   'retract_bed.gcode': retract_bed}
+
+
 @app.route('/library/')
-@app.route('/library/<filename>')
+@app.route('/library/<path:filename>')
 def library(filename=""):
-    # TODO validate the filename, handle IOError, etc for writing file.
-    # Security tip: Don't use os.path.join as it will follow ../
+    """ Page through and search the indexed library, a selected file shows a page of its lines """
+    index = gcode_library()
+    entry = None
     gcode = None
-    max_rows = 5
+    gcode_estimate = None
+    next_offset = None
+    fullpath = ""
     if filename != "":
-        fullpath = GCODE_LIBRARY + os.path.sep + filename
-    else:
-        fullpath = ""
-
-    dir_list = []
-    for dirname, dirnames, filenames in os.walk(GCODE_LIBRARY):
-        for name in filenames:
-            if name.lower().endswith(".gcode"):
-                dir_list.append(name)
-    print "dir_list: ", dir_list
-
-    # These are special files that are generated on the fly.
-    if filename == "calibrate_printer.gcode":
-        # This is a special file that we use to generate the calibration holes
-        if not os.path.exists(fullpath):
+        fullpath = index.path(filename)
+        if fullpath is None:
+            abort(404)
+        if filename in GENERATED_GCODE and not os.path.exists(fullpath):
             # It is magicial since it will be auto generated as needed
-            gcode = calibrate_printer(line_numbers=False)
-            with open(fullpath, "w") as write_file:
-                write_file.write(gcode)
-    elif filename == "eject_bed.gcode":
-        if not os.path.exists(fullpath):
-            gcode = eject_bed(line_numbers=False)
-            with open(fullpath, "w") as write_file:
-                write_file.write(gcode)
-    elif filename == "retract_bed.gcode":
-        if not os.path.exists(fullpath):
-            gcode = retract_bed(line_numbers=False)
             with open(fullpath, "w") as write_file:
-                write_file.write(gcode)
-    try:
-        if fullpath != "":
-            with open(fullpath, "r") as open_file:
-                gcode = open_file.read()
-                max_rows = len(gcode.splitlines())
-            
-    except IOError as exception:
-        print "IOError:", exception
+                GENERATED_GCODE[filename](fileobj=write_file, line_numbers=False)
+    index.refresh()
+    if filename != "":
+        entry = index.get(filename)
+        if entry is None and os.path.isfile(fullpath):
+            # Written since the last refresh
+            index.refresh(force=True)
+            entry = index.get(filename)
+        if entry is None:
+            abort(404)
+        try:
+            gcode, next_offset = index.preview(filename, request.args.get('offset', 0, type=int))
+        except IOError as exception:
+            print "IOError:", exception
+            abort(404)
+        if entry['time'] is not None:
+            gcode_estimate = dict(entry, duration=format_duration(entry['time']))
+
+    search = request.args.get('q', "")
+    order = request.args.get('order', "filename")
+    if order not in ORDERS:
+        order = "filename"
+    page = max(1, request.args.get('page', 1, type=int))
+    files, total = index.query(search, page, LIBRARY_PAGE_SIZE, order)
+    for file_entry in files:
+        file_entry['modified'] = time.ctime(file_entry['mtime'])
+        file_entry['duration'] = format_duration(file_entry['time']) if file_entry['time'] is not None else None
+    pages = max(1, (total + LIBRARY_PAGE_SIZE - 1) // LIBRARY_PAGE_SIZE)
+    return generate_response('library', 'library.html', gcode=gcode, entry=entry,
+                            filename=filename, max_rows=min(40, len(gcode.splitlines())) if gcode else 5,
+                            fullpath=fullpath, files=files, total=total, page=page, pages=pages,
+                            search=search, order=order, orders=sorted(ORDERS), next_offset=next_offset,
+                            estimate=gcode_estimate)
+
+
+@app.route('/library/download/<path:filename>')
+def library_download(filename):
+    """ A whole library file, streamed from disk (with Range requests for partial downloads) """
+    if gcode_library().path(filename) is None:
         abort(404)
-    return generate_response('library', 'library.html', gcode=gcode,
-                            filename=filename, max_rows=max_rows,
-                            fullpath=fullpath, dir_list=dir_list)
+    return send_from_directory(GCODE_LIBRARY, filename, mimetype="text/plain", as_attachment=True)
 
 @app.route('/about')
 def about():
@@ -317,6 +488,28 @@ if __name__ == '__main__':
     config_parser.read(args.config)
     IMAGE_STORAGE = config_parser.get('web', 'image_storage')
     GCODE_LIBRARY = config_parser.get('web', 'gcode_library')
+    if config_parser.has_option('web', 'binary_transport'):
+        BINARY_TRANSPORT = config_parser.getboolean('web', 'binary_transport')
+    if config_parser.has_option('web', 'persist_images'):
+        PERSIST_IMAGES = config_parser.getboolean('web', 'persist_images')
+    if config_parser.has_option('web', 'preview_socket'):
+        PREVIEW_SOCKET = config_parser.get('web', 'preview_socket')
+    if config_parser.has_option('web', 'zeromq_socket'):
+        DAEMON_SOCKET = config_parser.get('web', 'zeromq_socket')
+    if config_parser.has_option('web', 'daemon_pool_size'):
+        DAEMON_POOL_SIZE = config_parser.getint('web', 'daemon_pool_size')
+    if config_parser.has_option('web', 'daemon_timeout'):
+        DAEMON_TIMEOUT = config_parser.getfloat('web', 'daemon_timeout')
+    if config_parser.has_option('web', 'daemon_retries'):
+        DAEMON_RETRIES = config_parser.getint('web', 'daemon_retries')
+    if config_parser.has_option('web', 'daemon_heartbeat'):
+        DAEMON_HEARTBEAT = config_parser.getfloat('web', 'daemon_heartbeat')
+    if config_parser.has_option('web', 'job_timeout'):
+        JOB_TIMEOUT = config_parser.getfloat('web', 'job_timeout')
+    if config_parser.has_option('web', 'library_refresh'):
+        LIBRARY_REFRESH = config_parser.getfloat('web', 'library_refresh')
+    if config_parser.has_option('web', 'library_page_size'):
+        LIBRARY_PAGE_SIZE = config_parser.getint('web', 'library_page_size')
 
     for dirname in (IMAGE_STORAGE, GCODE_LIBRARY):
         if not os.path.exists(dirname):
@@ -327,4 +520,5 @@ if __name__ == '__main__':
     random.seed()
     # Cookies are only valid per startup session. And this isn't cryptographically secure...
     app.secret_key = "".join([chr(random.randrange(ord('A'), ord('z'))) for i in range(40)])
-    app.run(host='0.0.0.0', port=int(config_parser.get('web', 'port'))) 
+    # Threaded so preview streams do not hold up other requests
+    app.run(host='0.0.0.0', port=int(config_parser.get('web', 'port')), threaded=True) 
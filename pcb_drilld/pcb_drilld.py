@@ -6,152 +6,529 @@ pcb_drilld.py - main interface for launching a daemon to run selective commands
 
 import argparse
 import daemon
+import inspect
+import io
 import lockfile
 import signal
 import subprocess
 import grp
 import time
-import traceback
 import os
 import pwd
 import logging
-import zmq
-import json
 import sys
 import math
 import re
+import shutil
+import tempfile
 import SimpleCV
 import ConfigParser
-import picamera
 
 # Insert Path for project ../ from here
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 
 from pcb_drill_common.pcb_drill_gcode import PcbDrillGCode
+from pcb_drill_common.pcb_drill_path import get_hole_ordering
+from pcb_drill_common.pcb_drill_tools import MM_PER_INCH, diameters_to_mm, equivalent_diameter, parse_tool_table
+from pcb_drill_common.pcb_drill_estimate import GCodeSimulator, estimate
+from pcb_drill_common.pcb_drill_excellon import read_drill_file
+from pcb_drill_common.pcb_drill_cycles import get_drill_cycle, parse_keep_out_zones
+from pcb_drill_common.pcb_drill_cache import ResultCache, cache_key, file_cache_key
+from pcb_drill_common.pcb_drill_jobs import report_progress
+from pcb_drill_common.pcb_drill_server import PcbDrillServer
+from pcb_drill_common.pcb_drill_transport import Binary, to_bytes
+from pcb_drill_common.pcb_drill_session import HoleArray, SessionStore
+from pcb_drill_common.pcb_drill_overlays import OverlayWriter
+from pcb_drill_common.pcb_drill_stream import FrameProducer
+try:
+    from pcb_drill_common import pcb_drill_blobs
+    from pcb_drill_common import pcb_drill_raster
+    from pcb_drill_common import pcb_drill_calibrate
+    from pcb_drill_common import pcb_drill_registration
+    from pcb_drill_common.pcb_drill_pool import SharedArray, VisionPool, read_gray
+    from pcb_drill_common.pcb_drill_panel import Panel
+    from pcb_drill_common.pcb_drill_camera import (CameraService, average_frames, encode_image,
+                                                 get_camera_backend, save_image)
+except ImportError:
+    # No numpy: solder masks go through SimpleCV, there is no panelize and images are only
+    # captured with raspistill
+    pcb_drill_blobs = None
+    pcb_drill_raster = None
+    pcb_drill_calibrate = None
+    pcb_drill_registration = None
+    VisionPool = None
+    Panel = None
+    CameraService = None
+
+# How process_solder_mask finds holes
+HOLE_DETECTIONS = ("numpy", "simplecv")
+# Bump when process_solder_mask results change so old cache entries are not used
+RESULT_CACHE_VERSION = 1
+# Slow commands: they run on the job queue and answer with a job id straight away
+JOB_COMMANDS = ("process_solder_mask", "process_drill_file", "calibrate_pcb", "calibrate_printer",
+                "capture_image", "generate_gcode", "write_gcode", "panelize")
+# Commands that share hardware, the server never runs two of them at the same time
+RESOURCE_LOCKS = {'camera': ("capture_image", "start_preview", "stop_preview")}
 
 USE_RASPISTILL = False
 
+# (user, group): (uid, gid), the password and group databases are read once per user and group
+_FILE_OWNERS = {}
+
 def set_file_permissions(filename, mode=0644, user='pi', group='pi'):
     """ Set the permissions of a filename """
     os.chmod(filename, mode)
-    uid = pwd.getpwnam(user).pw_uid
-    gid = grp.getgrnam(group).gr_gid
-    log.info("uid = " + str(uid) + " gid = " + str(gid))
-    os.chown(filename, uid, gid)
+    owner = _FILE_OWNERS.get((user, group))
+    if owner is None:
+        owner = _FILE_OWNERS[(user, group)] = (pwd.getpwnam(user).pw_uid, grp.getgrnam(group).gr_gid)
+        log.info("uid = " + str(owner[0]) + " gid = " + str(owner[1]))
+    os.chown(filename, owner[0], owner[1])
 
 class PcbDrillRPC(object):
     """ Execute a given command as an RPC server"""
-    def __init__(self, image_storage, user, group):
+    def __init__(self, image_storage, user, group, hole_ordering='optimized', ordering_time_budget=2.0,
+                 gcode_library=None, tool_table="", drill_cycle="plunge", clearance_height=0.5,
+                 long_move=10.0, keep_out_zones="", compact_gcode=False, hole_detection="numpy",
+                 result_cache_size=64, tiled_detection_pixels=8000000, tile_rows=256, session_memory=32,
+                 session_ttl=86400, camera_backend="picamera", camera_idle_timeout=60, camera_source="",
+                 overlay_format="png", overlay_quality=85, overlay_max_size=0, overlay_workers=1,
+                 calibrate_window=24, calibrate_min_contrast=40, registration_min_confidence=0.2,
+                 vision_workers=3, preview_socket="", preview_width=640, preview_height=480, preview_fps=10,
+                 preview_quality=70, solder_mask_dpi=0, tile_directory=""):
+        # Worker processes for vision stages, started before any thread so forking them is safe
+        self._vision_pool = VisionPool(int(vision_workers) if hole_detection == "numpy" else 0) \
+            if VisionPool is not None else None
         self._original_images = {}
-        self._blobs = {}
         self._image_storage = image_storage
         self._user = user
         self._group = group
-        self._drill_holes = {}
-        self._solder_mask = {}
+        # Per file and per session state shares one memory budget, old state goes to disk or away
+        self._session_store = SessionStore(image_storage + os.path.sep + "session_store",
+                                           int(float(session_memory) * 1024 * 1024), float(session_ttl))
+        # HoleArray by filename
+        self._drill_holes = self._session_store.namespace("drill_holes")
+        # Tool tables from drill files, used instead of tool_table for their holes
+        self._drill_tool_tables = self._session_store.namespace("drill_tool_tables")
+        # Solder mask path (or its bytes when it was not persisted) by session
+        self._solder_mask = self._session_store.namespace("solder_mask")
+        # Where the last printer calibration found its holes: (image shape, [(x, y), ...])
+        self._printer_calibration = self._session_store.namespace("printer_calibration")
+        self._calibrate_window = int(calibrate_window)
+        self._calibrate_min_contrast = int(calibrate_min_contrast)
+        self._registration_min_confidence = float(registration_min_confidence)
+        # Stays open between captures, closes after camera_idle_timeout seconds without use
         self._camera = None
-        self._camera_in_preview = False
-
-    def _initialize_camera(self):
-        if self._camera_in_preview:
-            if self._camera is not None:
-                self.stop_preview()
-            else:
-                log.error("_initialize_camera found _camera_in_preview without a _camera object")
-        if self._camera is None:
-            self._camera = picamera.PiCamera()
-        self._camera.awb_mode = 'fluorescent'
-        self._camera.contrast = 40
-        self._camera.exif_tags['IFD0.Artist'] = "pcb_drilld"
-        self._camera.exif_tags['IFD0.Copyright'] = "TODO"
-
-    def _uninitialize_camera(self):
-        if self._camera is not None:
-            self._camera.close()
-            self._camera = None
-        
-
-    def process_solder_mask(self, filename, session='default'):
+        if CameraService is not None:
+            self._camera = CameraService(get_camera_backend(camera_backend, source=camera_source or None),
+                                         float(camera_idle_timeout))
+        else:
+            log.warning("The camera service and live preview need numpy, only raspistill can capture images")
+        # Live preview for the web app, the camera only streams while a browser watches
+        self._preview_stream = None
+        if preview_socket and self._camera is not None:
+            self._preview_stream = FrameProducer(self._camera, preview_socket, preview_width, preview_height,
+                                                 preview_fps, preview_quality)
+        self._hole_ordering = get_hole_ordering(hole_ordering, time_budget=float(ordering_time_budget))
+        self._gcode_library = gcode_library
+        self._tool_table = parse_tool_table(tool_table)
+        # Solder mask blob diameters are pixels, the tool table is mm
+        self._solder_mask_dpi = float(solder_mask_dpi)
+        self._drill_cycle = get_drill_cycle(drill_cycle, clearance_height=float(clearance_height),
+                                            long_move=float(long_move),
+                                            keep_out_zones=parse_keep_out_zones(keep_out_zones))
+        self._compact_gcode = str(compact_gcode).lower() in ("1", "yes", "true", "on")
+        if hole_detection not in HOLE_DETECTIONS:
+            raise ValueError("Unknown hole detection {0}, expected one of {1}".format(
+                hole_detection, ", ".join(HOLE_DETECTIONS)))
+        if hole_detection == "numpy" and (pcb_drill_blobs is None or pcb_drill_blobs.Image is None):
+            log.warning("numpy hole detection needs numpy and PIL, falling back to SimpleCV")
+            hole_detection = "simplecv"
+        self._hole_detection = hole_detection
+        self._tiled_detection_pixels = int(tiled_detection_pixels)
+        self._tile_rows = int(tile_rows)
+        # Tiled detection's grayscale copies of big masks, as big as width x height bytes
+        self._tile_directory = tile_directory or image_storage + os.path.sep + "tiles"
+        if not os.path.exists(self._tile_directory):
+            os.makedirs(self._tile_directory)
+        # Debug images are rendered in the background, commands answer with their numbers first
+        self._overlays = OverlayWriter(image_storage, overlay_format, int(overlay_quality), int(overlay_max_size),
+                                       int(overlay_workers),
+                                       lambda path: set_file_permissions(path, 0644, self._user, self._group))
+        # Everything besides the image that process_solder_mask results depend on
+        self._processing_parameters = {
+            'version': RESULT_CACHE_VERSION, 'hole_detection': hole_detection,
+            'hole_ordering': hole_ordering, 'ordering_time_budget': float(ordering_time_budget),
+            'tool_table': tool_table, 'drill_cycle': drill_cycle, 'clearance_height': float(clearance_height),
+            'long_move': float(long_move), 'keep_out_zones': keep_out_zones, 'compact_gcode': self._compact_gcode,
+            'overlay': self._overlays.parameters}
+        self._result_cache = ResultCache(image_storage + os.path.sep + "result_cache",
+                                         int(float(result_cache_size) * 1024 * 1024))
+
+    def process_solder_mask(self, filename, session='default', image=None, persist=True):
         """ Process a solder mask that is a simple image which contains
-            black "solder" blobs and find the center of those blobs"""
+            black "solder" blobs and find the center of those blobs. The overlay of the holes is
+            rendered in the background (see overlay_status)
+        Arguments:
+            filename - the solder mask in image storage (or the name of image)
+            session - calibrate_pcb uses the last solder mask of its session
+            image - the solder mask's bytes sent in-band (pcb_drill_transport.Binary), the overlay
+                    then comes back in-band as solder_mask_image (solder_mask_image_type says which format)
+            persist - with image, whether the solder mask and overlay are written to image storage too
+        """
         rpc_data = {}
-        image = self._load_image(filename)
+        in_memory = image is not None and not persist
+        if image is not None and persist:
+            self._write_image(filename, image)
+        self._solder_mask[session] = to_bytes(image) if in_memory else self._build_filename(filename)
+
+        # The same mask uploaded again (under any name) at the same scale gives the same results
+        report_progress("hashing solder mask", 0.0)
+        mm_per_pixel = self._solder_mask_mm_per_pixel(session)
+        parameters = dict(self._processing_parameters, mm_per_pixel=mm_per_pixel)
+        if image is not None:
+            key = cache_key(image, parameters)
+        else:
+            key = file_cache_key(self._solder_mask[session], parameters)
+        cached = self._result_cache.get(key)
+        # The grayscale file of a tiled detection
+        tiles = None
+        if cached is not None:
+            holes = [tuple(hole) for hole in cached['holes']]
+            extension = cached['overlay_extension']
+            cached_overlay = self._result_cache.file_path(key, extension)
+            render = lambda output: self._copy_overlay(cached_overlay, output)
+        else:
+            report_progress("detecting holes", 0.1)
+            extension = self._overlays.extension
+            if self._hole_detection == "numpy" and not in_memory and self._is_large_png(self._solder_mask[session]):
+                holes, render, tiles = self._find_holes_tiled(filename)
+                if self._overlays.max_size <= 0:
+                    # Streamed strip by strip, only PNG can be written that way
+                    extension = ".png"
+            elif self._hole_detection == "numpy":
+                holes, render = self._find_holes(filename, image if in_memory else None)
+            else:
+                holes, render = self._find_holes_simplecv(filename, session)
 
-        self._solder_mask[session] = self._build_filename(filename)
+        try:
+            rpc_data['count'] = len(holes)
+            rpc_data['holes'] = "\n".join(["({0},{1})".format(*hole) for hole in holes])
+            rpc_data['cached'] = cached is not None
+            if mm_per_pixel is None and self._tool_table is not None and len(self._tool_table) > 1:
+                rpc_data['warning'] = ("The solder mask's scale is unknown (no solder_mask_dpi and no resolution "
+                                       "in the PNG), every hole is drilled with the smallest tool")
+
+            self._drill_holes[filename] = HoleArray(diameters_to_mm(holes, mm_per_pixel))
+            if cached is not None:
+                gcode_data = cached['gcode']
+            else:
+                report_progress("generating gcode", 0.7)
+                gcode_data = self.generate_gcode(filename)
+            rpc_data.update(gcode_data)
+            result = {'holes': holes, 'gcode': gcode_data, 'overlay_extension': extension}
+
+            report_progress("rendering overlay", 0.9)
+            if in_memory:
+                overlay = io.BytesIO()
+                render(overlay)
+                rpc_data['solder_mask_image'] = Binary(overlay.getvalue())
+                rpc_data['solder_mask_image_type'] = self._overlays.mime_type
+                if cached is None:
+                    self._result_cache.put(key, result, contents={extension: overlay.getvalue()})
+                return rpc_data
+
+            overlay_filename = self._overlays.filename("solder_mask" + filename, extension)
+            solder_mask_image = self._build_filename(overlay_filename)
+            done = None
+            if cached is None:
+                done = lambda: self._result_cache.put(key, result, {extension: solder_mask_image})
+            self._overlays.submit(overlay_filename, render, done)
+            # The render removes it from here on
+            tiles = None
+            rpc_data['cv_solder_mask_filename'] = solder_mask_image
+            if image is not None:
+                # In-band callers get the overlay in the reply
+                status = self._overlays.wait(overlay_filename)
+                if status['state'] != "ready":
+                    raise ValueError("Rendering the solder mask overlay failed: {0}".format(status.get('error')))
+                with open(solder_mask_image, "rb") as overlay_file:
+                    rpc_data['solder_mask_image'] = Binary(overlay_file.read())
+                rpc_data['solder_mask_image_type'] = self._overlays.mime_type
+            return rpc_data
+        finally:
+            if tiles is not None:
+                # Cancelled or failed before the render was queued
+                os.remove(tiles)
+
+    def _solder_mask_mm_per_pixel(self, session):
+        """ mm per pixel of the session's solder mask: from solder_mask_dpi, else the resolution the PNG
+            was exported at (its pHYs chunk), None when neither is known """
+        if self._solder_mask_dpi > 0:
+            return MM_PER_INCH / self._solder_mask_dpi
+        if pcb_drill_raster is None:
+            return None
+        solder_mask = self._solder_mask[session]
+        try:
+            dpi = pcb_drill_raster.read_png_dpi(solder_mask if isinstance(solder_mask, basestring)
+                                                else io.BytesIO(solder_mask))
+        except (IOError, ValueError):
+            # Not a PNG
+            return None
+        return MM_PER_INCH / dpi if dpi else None
+
+    def _copy_overlay(self, filename, output):
+        """ Copy an overlay file to output (path or file object) """
+        if isinstance(output, basestring):
+            shutil.copyfile(filename, output)
+        else:
+            with open(filename, "rb") as overlay_file:
+                shutil.copyfileobj(overlay_file, output)
 
+    def _write_image(self, filename, image):
+        """ Write image bytes received in-band to filename in image storage """
+        full_filename = self._build_filename(filename)
+        with open(full_filename, "wb") as image_file:
+            image_file.write(image)
+        set_file_permissions(full_filename, 0644, self._user, self._group)
+
+    def _solder_mask_source(self, session):
+        """ What SimpleCV.Image opens for the session's solder mask: its file or the in-band image """
+        solder_mask = self._solder_mask[session]
+        if isinstance(solder_mask, basestring):
+            return solder_mask
+        # Only the SimpleCV paths get here and SimpleCV needs PIL anyway
+        import PIL.Image
+        return PIL.Image.open(io.BytesIO(solder_mask))
+
+    def _find_holes(self, filename, image=None):
+        """ Holes of a solder mask with the numpy engine and a render(output) that draws them
+            image are the mask's bytes when it is not in image storage"""
+        def solder_mask():
+            return io.BytesIO(image) if image is not None else self._build_filename(filename)
+        holes = self._find_blobs(pcb_drill_blobs.read_image(solder_mask())).holes()
+
+        def render(output):
+            self._overlays.save(pcb_drill_blobs.holes_image(solder_mask(), holes), output)
+        return holes, render
+
+    def _is_large_png(self, full_filename):
+        """ Is full_filename a PNG too big to decode into memory in one go? """
+        if not full_filename.lower().endswith(".png"):
+            return False
+        try:
+            header = pcb_drill_raster.read_png_header(full_filename)
+        except ValueError:
+            return False
+        return header.pixels > self._tiled_detection_pixels and not header.interlace
+
+    def _find_blobs(self, mask):
+        """ pcb_drill_blobs.find_blobs of a mask array, a band of rows per vision worker when there are some """
+        if self._vision_pool.workers == 0:
+            return pcb_drill_blobs.find_blobs(mask, strip_rows=self._tile_rows)
+        # Memory-mapped files (the tiled PGM) are shared as they are, anything else is copied once
+        shared = SharedArray.from_memmap(mask) if hasattr(mask, 'filename') else self._vision_pool.shared(mask)
+        try:
+            return pcb_drill_blobs.find_blobs_banded(shared, self._vision_pool.workers, strip_rows=self._tile_rows,
+                                                     map=self._vision_pool.map)
+        finally:
+            shared.unlink()
+
+    def _find_holes_tiled(self, filename):
+        """ _find_holes for big masks: the PNG is decoded strip by strip into a memory-mapped
+            grayscale file in tile_directory and only tile_rows rows are processed at a time.
+            render(output) draws the holes from the same file and removes it, the caller removes
+            the file (the third value) when render is never run"""
+        handle, raw_filename = tempfile.mkstemp(suffix=".pgm", dir=self._tile_directory)
+        os.close(handle)
+        try:
+            header = pcb_drill_raster.png_to_pgm(self._build_filename(filename), raw_filename, self._tile_rows)
+            report_progress("detecting holes in tiles", 0.3)
+            holes = self._find_blobs(pcb_drill_raster.open_pgm(raw_filename)).holes()
+        except:
+            os.remove(raw_filename)
+            raise
+
+        def render(output):
+            try:
+                mask = pcb_drill_raster.open_pgm(raw_filename)
+                if self._overlays.max_size > 0:
+                    self._overlays.save(pcb_drill_blobs.holes_preview(mask, holes, self._overlays.max_size), output)
+                else:
+                    strips = (mask[top:top + self._tile_rows] for top in xrange(0, header.height, self._tile_rows))
+                    pcb_drill_blobs.draw_holes_strips(strips, header.width, header.height, holes, output)
+            finally:
+                os.remove(raw_filename)
+        return holes, render, raw_filename
+
+    def _find_holes_simplecv(self, filename, session):
+        """ Holes of a solder mask with SimpleCV findBlobs and a render(output) that draws them """
+        image = SimpleCV.Image(self._solder_mask_source(session))
         image = image.binarize()
 
         blobs = image.findBlobs()
-        self._blobs[filename] = blobs
-
-        # Load same image
-        image = SimpleCV.Image(self._solder_mask[session])
 
-        dl = image.dl()
-
-        count = blobs.count()
         holes = []
-        for blob in blobs:
+        for blob in blobs or []:
             (x, y) = blob.coordinates()
-            holes.append((x,y))
-            dl.circle(blob.coordinates(), 2, color=SimpleCV.Color.RED)
-        image.addDrawingLayer(dl)
-        image.applyLayers()
-        solder_mask_image = self._build_filename("solder_mask" + filename)
-        image.save(solder_mask_image)
-        set_file_permissions(solder_mask_image, 0644, self._user, self._group)
-
-        rpc_data['count'] = count
-        rpc_data['cv_solder_mask_filename'] = solder_mask_image
-        rpc_data['holes'] = "\n".join(["({0},{1})".format(*hole) for hole in holes])
+            holes.append((int(x), int(y), equivalent_diameter(blob.area())))
+
+        def render(output):
+            # Load same image
+            image = SimpleCV.Image(self._solder_mask_source(session))
+            dl = image.dl()
+            for hole in holes:
+                dl.circle(hole[:2], 2, color=SimpleCV.Color.RED)
+            image.addDrawingLayer(dl)
+            self._overlays.save(image.applyLayers(), output)
+        return holes, render
+
+    def process_drill_file(self, filename, session='default'):
+        """ Read the holes from an Excellon or Gerber X2 drill file in image storage,
+            a much faster and more precise alternative to process_solder_mask"""
+        if re.match(r'^[0-9A-Za-z\._-]+$', filename) is None:
+            raise ValueError("Filename has characters outside of A-Za-z-_.")
+        # Don't use os.path.join as it will follow ../
+        with open(self._image_storage + os.path.sep + filename) as drill:
+            drill_file = read_drill_file(drill.read())
+        holes = drill_file.drill_holes()
+        self._drill_holes[filename] = HoleArray(holes)
+        self._drill_tool_tables[filename] = drill_file.tool_table()
 
-        self._drill_holes[filename] = holes
+        rpc_data = {}
+        rpc_data['count'] = len(holes)
+        rpc_data['slots'] = len(drill_file.slots)
+        rpc_data['tools'] = ", ".join("T{0} {1:g}mm".format(number, diameter)
+                                      for number, diameter in sorted(drill_file.tools.iteritems()))
+        rpc_data['holes'] = "\n".join(["({0},{1})".format(*hole) for hole in holes])
         rpc_data.update(self.generate_gcode(filename))
         return rpc_data
 
-    def capture_image(self, filename, width=800, height=600):
+    def capture_image(self, filename, width=800, height=600, persist=True, frames=1):
         """ Capture an image using platform specific tools (e.g. raspberry pi uses raspistill)
             requires filename:
+            persist - False returns the image in-band (pcb_drill_transport.Binary, encoded as
+                      filename's extension says) instead of writing it and returning its path
+            frames - more than 1 averages a burst from the video port, less sensor noise
         """
         width = int(width)
         height = int(height)
+        frames = int(frames)
         full_path = self._build_filename(filename)
-        if USE_RASPISTILL: 
+        image_format = "JPEG" if full_path.lower().endswith(".jpg") else "PNG"
+        if USE_RASPISTILL:
+            if not persist:
+                return Binary(subprocess.check_output(['/usr/bin/raspistill', '-h', str(height), '-w', str(width),
+                                                       '-e', image_format.lower(), '-o', '-', '-t', '5']))
             subprocess.check_call(['/usr/bin/raspistill', '-h', str(height),
                                    '-w', str(width), '-o', full_path, '-t', '5'])
+            set_file_permissions(full_path, 0644, self._user, self._group)
+            return full_path
+
+        camera = self._camera_service()
+        if frames > 1:
+            image = average_frames(camera.capture_burst(frames, width, height))
         else:
-            self._initialize_camera()
-            self._camera.resolution = (width, height)
-            self._camera.capture(full_path)
-            
+            image = camera.capture(width, height)
+        # The camera's buffer is only encoded when the image leaves the daemon
+        if not persist:
+            return Binary(encode_image(image, image_format))
+        save_image(image, full_path)
         set_file_permissions(full_path, 0644, self._user, self._group)
 
         return full_path
 
+    def _camera_service(self):
+        """ The CameraService, an error when numpy is missing """
+        if self._camera is None:
+            raise ValueError("The camera service needs numpy")
+        return self._camera
+
+    def camera_stats(self):
+        """ Whether the camera is open, how often it was opened and captures taken """
+        return self._camera_service().stats()
+
+    def preview_stats(self):
+        """ Whether the live preview is being watched, frames sent, frame size and rate """
+        if self._preview_stream is None:
+            raise ValueError("No preview_socket configured for the daemon")
+        return self._preview_stream.stats()
+
     def calibrate_pcb(self, pcb_filename, session='default'):
-        """ Calibrate the PCB on the bed """
-        rpc_data = {}
+        """ Calibrate the PCB on the bed: find the board of the session's solder mask in pcb_filename.
+            The FFT registration (numpy hole detection) answers with the affine transform from solder
+            mask to picture pixels, SimpleCV keypoint matching is tried when it does not find the board."""
         pcb_fullpath = self._build_filename(pcb_filename)
-        pcb_image = SimpleCV.Image(pcb_fullpath)
-        pcb_image_bin = pcb_image.binarize()
         if session not in self._solder_mask:
             raise ValueError("You must process a solder mask image 1st")
-        solder_mask = SimpleCV.Image(self._solder_mask[session])#.binarize().invert()
+        if self._hole_detection == "numpy" and pcb_drill_registration is not None:
+            rpc_data = self._calibrate_pcb_registration(pcb_filename, pcb_fullpath, session)
+            if rpc_data is not None:
+                return rpc_data
+        return self._calibrate_pcb_keypoints(pcb_filename, pcb_fullpath, session)
+
+    def _calibrate_pcb_registration(self, pcb_filename, pcb_fullpath, session):
+        """ calibrate_pcb with pcb_drill_registration, None when the board was not found """
+        report_progress("loading images", 0.0)
+        solder_mask = self._solder_mask[session]
+        if isinstance(solder_mask, basestring):
+            pcb_image, solder_mask = read_gray(self._vision_pool, [pcb_fullpath, solder_mask])
+        else:
+            pcb_image, = read_gray(self._vision_pool, [pcb_fullpath])
+            solder_mask = pcb_drill_blobs.read_image(io.BytesIO(solder_mask))
+        report_progress("registering solder mask", 0.1)
+        registration = pcb_drill_registration.register(solder_mask, pcb_image)
+        if registration.confidence < self._registration_min_confidence:
+            log.info("Registration confidence {0:.3f} is too low, trying keypoints".format(registration.confidence))
+            return None
+        log.info("registration angle = {0}, scale = {1}, confidence = {2}".format(
+            registration.angle, registration.scale, registration.confidence))
+
+        report_progress("finding holes", 0.5)
+        holes = pcb_drill_blobs.find_blobs(solder_mask).holes()
+        height, width = pcb_image.shape[:2]
+        points = [(int(round(x)), int(round(y))) for x, y in registration.transform([hole[:2] for hole in holes])
+                  if 0 <= x < width and 0 <= y < height]
+        rpc_data = {'method': "registration", 'transform': registration.to_dict(), 'angle': registration.angle,
+                    'count': len(points)}
+
+        def render_crop(output):
+            self._overlays.save(registration.crop(pcb_image), output)
+
+        def render_outline(output):
+            outline = pcb_drill_blobs.holes_array(pcb_drill_blobs.to_gray(pcb_image), [])
+            self._overlays.save(pcb_drill_registration.draw_outline(outline, registration.corners), output)
+
+        def render_holes(output):
+            overlay = pcb_drill_blobs.holes_array(pcb_drill_blobs.to_gray(pcb_image), points, 4)
+            self._overlays.save(pcb_drill_registration.draw_outline(overlay, registration.corners), output)
+
+        rpc_data['pcb_cropped_filename'] = self._submit_overlay("crop_pcb_" + pcb_filename, render_crop)
+        rpc_data['cv_keypoint_filename'] = self._submit_overlay("cv_keypoint_" + pcb_filename, render_outline)
+        rpc_data['cv_image'] = self._submit_overlay("cv_" + pcb_filename, render_holes)
+        return rpc_data
+
+    def _calibrate_pcb_keypoints(self, pcb_filename, pcb_fullpath, session):
+        """ calibrate_pcb with SimpleCV keypoint matching """
+        rpc_data = {'method': "keypoint"}
+        report_progress("loading images", 0.0)
+        pcb_image = SimpleCV.Image(pcb_fullpath)
+        pcb_image_bin = pcb_image.binarize()
+        solder_mask = SimpleCV.Image(self._solder_mask_source(session))#.binarize().invert()
+        report_progress("matching solder mask", 0.1)
         keypoint = pcb_image_bin.findKeypointMatch(solder_mask)
         if keypoint is None:
             raise ValueError("Unable to locate board based on solder mask")
 
         pcb_only = keypoint[0].crop()
 
-        pcb_only_filename = "crop_pcb_" + pcb_filename
-        pcb_only.save(self._build_filename(pcb_only_filename))
-        set_file_permissions(self._build_filename(pcb_only_filename), 0644, self._user, self._group)
-        rpc_data['pcb_cropped_filename'] = pcb_only_filename
+        rpc_data['pcb_cropped_filename'] = self._submit_overlay("crop_pcb_" + pcb_filename,
+                                                                lambda output: self._overlays.save(pcb_only, output))
 
         delta_x = keypoint[0].topRightCorner()[0] - keypoint[0].topLeftCorner()[0]
         delta_y = keypoint[0].bottomRightCorner()[1] - keypoint[0].topRightCorner()[1]
         angle = math.atan2(delta_y, delta_x)
 
+        report_progress("finding holes", 0.5)
         solder_mask_bin = solder_mask.binarize()
         solder_mask_bin_image_mask = solder_mask_bin.rotate(angle).scale(keypoint[0].width(), keypoint[0].height())
         blobs = pcb_only.findBlobsFromMask(solder_mask_bin_image_mask)
@@ -160,38 +537,41 @@ class PcbDrillRPC(object):
         rpc_data['angle'] = angle
         log.info("keypoint x = {0}, y = {1}".format(keypoint.x(), keypoint.y()))
 
-        cv_filename = "cv_" + pcb_filename
-        pcb_image.draw(keypoint, SimpleCV.Color.FUCHSIA, width=2)
+        def render_holes(output):
+            pcb_image.draw(keypoint, SimpleCV.Color.FUCHSIA, width=2)
+            for blob in blobs:
+                point = keypoint[0].topLeftCorner() + blob.coordinates()
+                pcb_image.drawCircle(point, 4, color=SimpleCV.Color.RED)
+            self._overlays.save(pcb_image.applyLayers(), output)
 
-        for blob in blobs:
-            point = keypoint[0].topLeftCorner() + blob.coordinates()
-            pcb_image.drawCircle(point, 4, color=SimpleCV.Color.RED)
+        def render_keypoints(output):
+            self._overlays.save(pcb_image_bin.drawKeypointMatches(solder_mask), output)
 
-
-        pcb_image.save(self._build_filename(cv_filename))
-
-        cv_keypoint_image = pcb_image_bin.drawKeypointMatches(solder_mask)
-        cv_keypoint_filename = "cv_keypoint_" + pcb_filename
-        cv_keypoint_image.save(self._build_filename(cv_keypoint_filename))
-        set_file_permissions(self._build_filename(cv_keypoint_filename), 0644, self._user, self._group)
-        rpc_data['cv_keypoint_filename'] = cv_keypoint_filename
-
-        set_file_permissions(self._build_filename(cv_filename), 0644, self._user, self._group)
-        rpc_data['cv_image'] = cv_filename 
+        rpc_data['cv_keypoint_filename'] = self._submit_overlay("cv_keypoint_" + pcb_filename, render_keypoints)
+        rpc_data['cv_image'] = self._submit_overlay("cv_" + pcb_filename, render_holes)
 
         return rpc_data
 
 
-    def calibrate_printer(self, pre_drill_filename, post_drill_filename):
-        """ Calibrate size according to the gcode that drills three holes """
+    def calibrate_printer(self, pre_drill_filename, post_drill_filename, predicted=None):
+        """ Calibrate size according to the gcode that drills three holes
+        Arguments:
+            pre_drill_filename, post_drill_filename - pictures before and after drilling in image storage
+            predicted - [[x, y], ...] pixels where the holes should be, defaults to where the
+                        last calibration found them
+        """
         pre_drill_filename = self._build_filename(pre_drill_filename)
         post_drill_filename = self._build_filename(post_drill_filename)
+        if self._hole_detection == "numpy" and pcb_drill_calibrate is not None:
+            return self._calibrate_printer_roi(pre_drill_filename, post_drill_filename, predicted)
+        report_progress("loading images", 0.0)
         pre_drill_image = SimpleCV.Image(pre_drill_filename)
         post_drill_image = SimpleCV.Image(post_drill_filename)
         diff_image = post_drill_image - pre_drill_image
         pre_drill_image = None
         post_drill_image = None
         rpc_data = {}
+        report_progress("finding drilled holes", 0.4)
         diff_image = diff_image.binarize()
         blobs = diff_image.findBlobs()
         log.debug("calibrate printer")
@@ -201,9 +581,8 @@ class PcbDrillRPC(object):
         if len(blobs) != 3:
             #raise ValueError("Unable to calibrate image since it has {0} differences between images".format(len(blobs)))
             rpc_data['warning'] = "Unable to calibrate image since it has {0} differences between images".format(len(blobs))
-        diff_image_filename = "diff_" + os.path.basename(post_drill_filename)
-        diff_image.save(self._build_filename(diff_image_filename))
-        set_file_permissions(self._build_filename(diff_image_filename), 0644, self._user, self._group)
+        diff_image_filename = self._submit_overlay("diff_" + os.path.basename(post_drill_filename),
+                                                   lambda output: self._overlays.save(diff_image, output))
         rpc_data['cv_image_filename'] = diff_image_filename
         rpc_data['cv_image_fullname'] = self._build_filename(diff_image_filename)
         rpc_data['count'] = len(blobs)
@@ -212,33 +591,151 @@ class PcbDrillRPC(object):
         #calibrate_image = time.strftime("calibrate_%Y_%m_%d_%H_%M_%S.jpg")
         #calibrate_image = self.capture_image(calibrate_image, 1024, 768)
 
+    def _calibrate_printer_roi(self, pre_drill_filename, post_drill_filename, predicted):
+        """ calibrate_printer that differences small windows around the expected holes only """
+        report_progress("loading images", 0.0)
+        pre_drill_image, post_drill_image = read_gray(self._vision_pool, [pre_drill_filename, post_drill_filename])
+        if predicted is None and 'holes' in self._printer_calibration:
+            shape, holes = self._printer_calibration['holes']
+            if shape == pre_drill_image.shape:
+                predicted = holes
+        report_progress("finding drilled holes", 0.4)
+        found = pcb_drill_calibrate.locate_calibration_holes(pre_drill_image, post_drill_image, predicted,
+                                                             self._calibrate_window, self._calibrate_min_contrast)
+        holes = found['holes']
+        log.debug("calibrate printer ({0}, {1} missed windows)".format(found['method'], found['misses']))
+        for i, (x, y) in enumerate(holes):
+            log.debug("{0} hole - ({1:.2f},{2:.2f})".format(i, x, y))
+        rpc_data = {'count': len(holes), 'holes': [[x, y] for x, y in holes], 'method': found['method'],
+                    'pixels_per_mm': found['pixels_per_mm']}
+        if found['pixels_per_mm'] is None:
+            rpc_data['warning'] = "Unable to calibrate image since it has {0} differences between images".format(
+                len(holes))
+        else:
+            self._printer_calibration['holes'] = (pre_drill_image.shape, holes)
+
+        def render(output):
+            diff = pcb_drill_calibrate.difference(pre_drill_image, post_drill_image)
+            self._overlays.save(pcb_drill_blobs.holes_array(diff, [(int(round(x)), int(round(y))) for x, y in holes],
+                                                            self._calibrate_window), output)
+
+        diff_image_filename = self._submit_overlay("diff_" + os.path.basename(post_drill_filename), render)
+        rpc_data['cv_image_filename'] = diff_image_filename
+        rpc_data['cv_image_fullname'] = self._build_filename(diff_image_filename)
+        return rpc_data
+
+    def _submit_overlay(self, name, render):
+        """ Render an overlay called name (its extension follows overlay_format) in the background,
+            returns its filename in image storage """
+        filename = self._overlays.filename(name)
+        # Same checks as every other file in image storage
+        self._build_filename(filename)
+        self._overlays.submit(filename, render)
+        return filename
+
+    def overlay_status(self, filename):
+        """ Whether an overlay is still pending, ready or failed """
+        status = self._overlays.status(filename)
+        if status is None:
+            if not os.path.exists(self._build_filename(filename)):
+                raise ValueError("Unknown overlay {0}".format(filename))
+            # Written before the daemon started
+            status = {'filename': filename, 'state': "ready"}
+        return status
+
+    def session_stats(self):
+        """ Hits, misses, evictions and size of the session store """
+        return self._session_store.stats()
+
     def start_preview(self):
         """ Start the RaspberryPi Camera """
-        self._initialize_camera()
-        if not self._camera_in_preview:
-            log.info("Starting preview")
-            self._camera_in_preview = True
-            self._camera.start_preview()
+        log.info("Starting preview")
+        self._camera_service().start_preview()
 
     def stop_preview(self):
-        if self._camera is not None and self._camera_in_preview:
-            log.info("Stop preview")
-            self._camera.stop_preview()
-            self._camera_in_preview = False
-            self._camera.close()
-            self._camera = None
-
-    def generate_gcode(self, filename, prefix=None, postfix=None):
-        generator = PcbDrillGCode(prefix, postfix, line_numbers=False)
-        generator.comment("Generated from pcb_drilld daemon at " + time.ctime())
-        holes = self._drill_holes[filename]
-        generator.drill_holes(holes)
-        generator.comment("Processed {0} drill holes".format(len(holes)))
+        """ Stop the preview, the camera stays warm for the next capture """
+        log.info("Stop preview")
+        self._camera_service().stop_preview()
+
+    def generate_gcode(self, filename, prefix=None, postfix=None, start_x=None, start_y=None):
+        """ Generate gcode for the holes found in filename
+            start_x, start_y - where the head is before drilling (defaults to home)"""
+        generator = self._gcode_generator(filename, prefix, postfix, start_x, start_y)
         prefix = generator.prefix
         postfix = generator.postfix
         gcode = generator.generate()
         body = generator.body
-        return {'prefix': prefix, 'postfix': postfix, 'body': body, 'gcode': gcode}
+        original_travel, ordered_travel = generator.travel_distance
+        return self._with_size_reduction(generator, {
+            'prefix': prefix, 'postfix': postfix, 'body': body, 'gcode': gcode,
+            'travel_distance_original': original_travel, 'travel_distance_ordered': ordered_travel,
+            'estimate': estimate(gcode)})
+
+    def write_gcode(self, filename, gcode_filename, prefix=None, postfix=None, start_x=None, start_y=None):
+        """ Stream gcode for the holes found in filename straight into gcode_filename in the
+            gcode library without holding the program in memory"""
+        generator = self._gcode_generator(filename, prefix, postfix, start_x, start_y)
+        return self._write_gcode(generator, gcode_filename)
+
+    def panelize(self, filename, gcode_filename, columns, rows, pitch_x, pitch_y, rotation=0,
+                 prefix=None, postfix=None, start_x=None, start_y=None):
+        """ Step and repeat the holes found in filename into a columns x rows panel and stream
+            the gcode into gcode_filename in the gcode library. Vision is not run again.
+            rotation - degrees for every copy or a list with one angle per copy (row by row)"""
+        if Panel is None:
+            raise ValueError("panelize needs numpy")
+        panel = Panel(self._drill_holes[filename].holes(), columns, rows, pitch_x, pitch_y, rotation)
+        generator = self._gcode_generator(filename, prefix, postfix, start_x, start_y, panel)
+        generator.comment("Panel of {0} x {1} copies at pitch {2} x {3}".format(columns, rows, pitch_x, pitch_y))
+        result = self._write_gcode(generator, gcode_filename)
+        result['holes'] = len(panel)
+        return result
+
+    def _write_gcode(self, generator, gcode_filename):
+        """ Stream generator's program into gcode_filename in the gcode library """
+        if self._gcode_library is None:
+            raise ValueError("No gcode_library configured for the daemon")
+        if re.match(r'^[0-9A-Za-z\._-]+$', gcode_filename) is None:
+            raise ValueError("Filename has characters outside of A-Za-z-_.")
+        if not gcode_filename.lower().endswith(".gcode"):
+            gcode_filename += ".gcode"
+        # Don't use os.path.join as it will follow ../
+        full_path = self._gcode_library + os.path.sep + gcode_filename
+        with open(full_path, "w") as gcode_file:
+            def written_lines():
+                for line in generator.iter_lines():
+                    gcode_file.write(line)
+                    yield line
+            # Estimate the run time on the way through
+            gcode_estimate = GCodeSimulator().run(written_lines())
+        set_file_permissions(full_path, 0644, self._user, self._group)
+        original_travel, ordered_travel = generator.travel_distance
+        return self._with_size_reduction(generator, {
+            'gcode_filename': gcode_filename, 'gcode_fullname': full_path, 'size': os.path.getsize(full_path),
+            'travel_distance_original': original_travel, 'travel_distance_ordered': ordered_travel,
+            'estimate': gcode_estimate})
+
+    def _with_size_reduction(self, generator, rpc_data):
+        """ Add the full and compact sizes to rpc_data when compact_gcode is on """
+        if self._compact_gcode:
+            rpc_data['size_full'], rpc_data['size_compact'] = generator.size_reduction
+        return rpc_data
+
+    def _gcode_generator(self, filename, prefix, postfix, start_x, start_y, holes=None):
+        """ Set up a generator for the holes found in filename (or holes made from them)"""
+        # A drill file's own tools (in mm) win over the configured table
+        tool_table = self._drill_tool_tables.get(filename) or self._tool_table
+        generator = PcbDrillGCode(prefix, postfix, line_numbers=False, hole_ordering=self._hole_ordering,
+                                  tool_table=tool_table, drill_cycle=self._drill_cycle,
+                                  compact=self._compact_gcode)
+        if start_x is not None and start_y is not None:
+            generator.ordering_start = (float(start_x), float(start_y))
+        generator.comment("Generated from pcb_drilld daemon at " + time.ctime())
+        if holes is None:
+            holes = self._drill_holes[filename].holes()
+        generator.drill_holes(holes)
+        generator.comment("Processed {0} drill holes".format(len(holes)))
+        return generator
 
     def _build_filename(self, base_filename):
         """ build the full pathname and ensure the name is safe"""
@@ -266,72 +763,21 @@ class PcbDrillRPC(object):
         return self._original_images[session].rotate(degrees)
 
        
-class PcbDrillServer(object):
-    """ Run the actual server """
-    def __init__(self, rpc):
-        log.info("Starting PcbDrillServer...")
-        self._methods = self._get_rpc_methods(rpc)
-        self._context = zmq.Context()
-        self._socket = self._context.socket(zmq.REP)
-
-    def _request(self):
-        request = json.loads(self._socket.recv())
-        ascii_request = {}
-        for k,v in request.items():
-            if hasattr(k, 'encode') and hasattr(v, 'encode'):
-                ascii_request[k.encode("utf8")] = v.encode("utf8")
-            else:
-                # Handles ints and other things
-                ascii_request[k] = v
-        return ascii_request
-
-    def _response(self, data):
-        self._socket.send(json.dumps(data))
-
-    def _execute(self, request):
-        command = request['command']
-        del request['command']
-        kwargs = request
-        log.info("Command: " + str(command) + " Arguments: " + str(kwargs))
-        start_time = time.time()
-        response = self._methods[command](**kwargs)
-        end_time = time.time()
-        duration = end_time - start_time
-
-        return {'success': True, 'output': response, 'time': duration}
-            
-    def _get_rpc_methods(self, rpc):
-        methods = {}
-        log.info("rpc = " + str(rpc))
-        for method in dir(rpc):
-            if not method.startswith("_") and \
-                callable(getattr(rpc, method)):
-                methods[method] = getattr(rpc, method)
-        log.info("Currently supporing the following methods:" \
-                 + " ".join(sorted(methods.keys())))
-        return methods
-
-    def bind(self, address):
-        """ ZeroMQ Binding """
-        self._socket.bind(address)
-
-    def run(self):
-        while True:
-            response = {'error': 'premature exit'}
-            try:
-                request = self._request()
-                response = self._execute(request)
-                # Fall through to finally
-            except Exception as error:
-                exception_output = traceback.format_exception(*sys.exc_info())
-                response = {'success': False, 'error': str(error),
-                            'exception': "!! ".join(exception_output)}
-                log.exception(error)
-            finally:
-                self._response(response)
-
 log = None
 
+def config_get(config_parser, section, option, default):
+    """ ConfigParser.get with a default for options missing from older config files """
+    if config_parser.has_option(section, option):
+        return config_parser.get(section, option)
+    return default
+
+def rpc_options(config_parser, section='daemon'):
+    """ PcbDrillRPC keyword arguments from the options of section named like them, options missing from
+        older config files keep PcbDrillRPC's defaults and options of the server are left out """
+    names = inspect.getargspec(PcbDrillRPC.__init__).args[1:]
+    return dict((name, config_parser.get(section, name)) for name in names
+                if config_parser.has_option(section, name))
+
 def main(config_file, log_level):
     """ Run the daemon """
     #logging.basicConfig(filename='/tmp/pcb_drilld.log', level=log_level)
@@ -362,9 +808,11 @@ def main(config_file, log_level):
     with daemon_context:
         try:
             log.info("Started pcb_drilld as a daemon: PID=%d" % os.getpid())
-            server = PcbDrillServer(PcbDrillRPC(config_parser.get('daemon', 'image_storage'),
-                                                config_parser.get('daemon', 'user'),
-                                                config_parser.get('daemon', 'group')))
+            server = PcbDrillServer(PcbDrillRPC(**rpc_options(config_parser)),
+                                    job_workers=config_get(config_parser, 'daemon', 'job_workers', 2),
+                                    mode=config_get(config_parser, 'daemon', 'server_mode', 'rep'),
+                                    workers=config_get(config_parser, 'daemon', 'server_workers', 4),
+                                    job_commands=JOB_COMMANDS, resources=RESOURCE_LOCKS)
             server.bind(config_parser.get('daemon', 'zeromq_socket'))
             server.run()
         except Exception as error: